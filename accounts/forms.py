@@ -1,8 +1,32 @@
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.urls import Resolver404, resolve
+
+
+# routes of a user's own pages (/<username>, /<username>/follow, ...)
+PROFILE_ROUTES = {'': 'profile', '/follow': 'follow', '/unfollow': 'unfollow'}
+
+
+def is_reserved_username(username):
+    """Whether pages of a user with that username would be shadowed by other routes (eg. /following)"""
+    for suffix, view_name in PROFILE_ROUTES.items():
+        try:
+            match = resolve(f'/{username}{suffix}')
+        except Resolver404:
+            return True
+        if match.view_name != view_name:
+            return True
+    return False
 
 
 class CustomUserCreationForm(UserCreationForm):
     class Meta:
         model = get_user_model()
         fields = ('username', 'email')
+
+    def clean_username(self):
+        username = self.cleaned_data['username']
+        if is_reserved_username(username):
+            raise ValidationError('This username is reserved.', code='reserved')
+        return username
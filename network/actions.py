@@ -0,0 +1,228 @@
+from django.db import transaction
+from django.db.models import Case, F, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from . import hot, jobs, page_cache, search, tags, timeline
+from .cache import evict_card
+from .models import User, Post, Like
+from .sql import delete_returning, insert_ignore, update_returning
+
+
+# user interactions (create/edit post, like/unlike, follow/unfollow)
+# each one updates the relation (through table), related counters and timelines
+# inside a single transaction so that they never drift from relations
+# then bumps versions of cached pages that show them
+# counters are updated using F() expressions (ie. at db level)
+# to avoid lost updates when many users like the same post at once
+# side effects that can lag behind (fan-out, recommendations) are enqueued as jobs
+# in the same transaction, then run by workers (check: network/jobs.py)
+
+def create_post(user, content):
+    with transaction.atomic():
+        post = Post.objects.create(content=content, user=user)
+        search.index_post(post)
+        tags.index_post(post, created=True)
+        # pushing post into followers timelines runs in background (check: network/tasks.py)
+        jobs.enqueue('timeline.fan_out', post.id, key=f'fan_out:{post.id}')
+        page_cache.bump('index', f'profile:{user.username}')
+    return post
+
+def edit_post(post, content):
+    # cached card of old version is no longer needed
+    evict_card(post)
+    with transaction.atomic():
+        post.content = content
+        post.save()
+        search.index_post(post)
+        tags.index_post(post)
+        page_cache.bump('index', f'profile:{post.user.username}')
+
+# like/unlike and follow/unfollow are idempotent
+# the relation is written using a single statement (INSERT ... ON CONFLICT DO NOTHING or DELETE)
+# whose returned rows tell whether state changed (so no need to check it before, which is racy)
+# and only then counters are updated using a second statement
+# they return whether state changed
+
+def like(user, post):
+    with transaction.atomic():
+        liked_at = timezone.now()
+        if not insert_ignore(Like, [{'user': user.id, 'post': post.id, 'created_at': liked_at}], ['post']):
+            return False
+        [(post.likes_count,)] = update_returning(
+            Post.objects.filter(pk=post.id), ['likes_count'],
+            likes_count=F('likes_count') + 1,
+            hot_score=F('hot_score') + hot.like_weight(liked_at),
+        )
+        page_cache.bump('index', f'profile:{post.user.username}')
+    return True
+
+def unlike(user, post):
+    with transaction.atomic():
+        unliked = delete_returning(Like.objects.filter(user=user.id, post=post.id), ['created_at'])
+        if not unliked:
+            return False
+        [(liked_at,)] = unliked
+        # never go below zero (even if counter has drifted)
+        # the weight removed is the one the like added (ie. at its time)
+        [(post.likes_count,)] = update_returning(
+            Post.objects.filter(pk=post.id), ['likes_count'],
+            likes_count=Greatest(F('likes_count') - 1, 0),
+            hot_score=Greatest(F('hot_score') - hot.like_weight(liked_at), 0.0),
+        )
+        page_cache.bump('index', f'profile:{post.user.username}')
+    return True
+
+def _update_follow_counters(follower, deltas):
+    """Update friends of follower and followers of users (single statement)
+
+    deltas: {user: +1 (followed) or -1 (unfollowed)}
+    """
+    def counter(field, changes):
+        # never go below zero (even if counter has drifted)
+        return Case(
+            *[When(pk=pk, then=Greatest(F(field) + delta, 0)) for pk, delta in changes.items()],
+            default=F(field),
+        )
+
+    users = {user.id: user for user in deltas}
+    rows = update_returning(
+        User.objects.filter(pk__in=[follower.id, *users]), ['id', 'friends_count', 'followers_count'],
+        friends_count=counter('friends_count', {follower.id: sum(deltas.values())}),
+        followers_count=counter('followers_count', {user.id: delta for user, delta in deltas.items()}),
+    )
+    for pk, friends_count, followers_count in rows:
+        if pk == follower.id:
+            follower.friends_count = friends_count
+        if pk in users:
+            users[pk].followers_count = followers_count
+
+def follow(follower, user_to_follow):
+    # when foo follows bar
+    # bar is a friend to foo, foo is a follower to bar
+    with transaction.atomic():
+        if not insert_ignore(User.friends.through, [{'from_user': follower.id, 'to_user': user_to_follow.id}], ['to_user']):
+            return False
+        _update_follow_counters(follower, {user_to_follow: 1})
+        timeline.backfill(follower, user_to_follow)
+        jobs.enqueue('recommendations.follows_changed', follower.id, [[user_to_follow.id, 1]])
+        page_cache.bump(f'profile:{follower.username}', f'profile:{user_to_follow.username}')
+    return True
+
+def unfollow(follower, user_to_unfollow):
+    # when foo unfollows bar
+    # bar is no longer a friend to foo, foo is no longer a follower to bar
+    with transaction.atomic():
+        if not delete_returning(User.friends.through.objects.filter(from_user=follower.id, to_user=user_to_unfollow.id), ['to_user']):
+            return False
+        _update_follow_counters(follower, {user_to_unfollow: -1})
+        timeline.remove(follower, user_to_unfollow)
+        jobs.enqueue('recommendations.follows_changed', follower.id, [[user_to_unfollow.id, -1]])
+        page_cache.bump(f'profile:{follower.username}', f'profile:{user_to_unfollow.username}')
+    return True
+
+
+# batches of interactions (eg. clicks coalesced by clients)
+# operation: whether it sets relation (True) or removes it (False)
+LIKE_OPERATIONS = {'like': True, 'unlike': False}
+FOLLOW_OPERATIONS = {'follow': True, 'unfollow': False}
+
+def _replay(operations, kinds, initial):
+    """Compute result of each operation from initial state of its target
+
+    (operations of a batch may target the same post/user many times, eg. like then unlike)
+    """
+    state = dict(initial)
+    results = {}
+    for i, (op, target) in enumerate(operations):
+        if op in kinds and target in state:
+            wanted = kinds[op]
+            results[i] = (wanted != state[target], wanted)
+            state[target] = wanted
+    return results
+
+def apply_batch(user, operations):
+    """Apply many interactions of user at once (in a single transaction)
+
+    operations: list of (operation, target) where target is a post id
+    for like/unlike and a username for follow/unfollow.
+    only the last operation on each target is applied (earlier ones are overridden)
+    relations are written using a bulk insert and a bulk delete per kind (likes, follows)
+    and counters using a single update per kind.
+    return a result per operation: (changed, state after it, target) or None if target wasn't found
+    where target is a post or user instance (with updated counters).
+    """
+    wanted_likes = {target: LIKE_OPERATIONS[op] for op, target in operations if op in LIKE_OPERATIONS}
+    wanted_follows = {target: FOLLOW_OPERATIONS[op] for op, target in operations if op in FOLLOW_OPERATIONS}
+    scopes = set()
+
+    with transaction.atomic():
+        posts = Post.objects.select_related('user').only('id', 'likes_count', 'user__username').in_bulk(wanted_likes)
+        users = User.objects.only('id', 'username', 'followers_count').in_bulk(wanted_follows, field_name='username')
+        # users can't follow themselves
+        users.pop(user.username, None)
+
+        # likes
+        liked_at = timezone.now()
+        to_like = [pk for pk in posts if wanted_likes[pk]]
+        to_unlike = [pk for pk in posts if not wanted_likes[pk]]
+        liked = {pk for pk, in insert_ignore(Like, [{'user': user.id, 'post': pk, 'created_at': liked_at} for pk in to_like], ['post'])} if to_like else set()
+        # time of each removed like (the weight it added is removed from score)
+        unliked = dict(delete_returning(Like.objects.filter(user=user.id, post__in=to_unlike), ['post', 'created_at'])) if to_unlike else {}
+        if liked or unliked:
+            rows = update_returning(
+                Post.objects.filter(pk__in=liked | unliked.keys()), ['id', 'likes_count'],
+                # never go below zero (even if counter has drifted)
+                likes_count=Case(When(pk__in=liked, then=F('likes_count') + 1), default=Greatest(F('likes_count') - 1, 0)),
+                hot_score=Case(
+                    When(pk__in=liked, then=F('hot_score') + hot.like_weight(liked_at)),
+                    *[When(pk=pk, then=Greatest(F('hot_score') - hot.like_weight(at), 0.0)) for pk, at in unliked.items()],
+                    default=F('hot_score'),
+                ),
+            )
+            for pk, likes_count in rows:
+                posts[pk].likes_count = likes_count
+                scopes.update(['index', f'profile:{posts[pk].user.username}'])
+
+        # follows
+        friends = User.friends.through
+        ids = {target.id: username for username, target in users.items()}
+        to_follow = [pk for pk, username in ids.items() if wanted_follows[username]]
+        to_unfollow = [pk for pk, username in ids.items() if not wanted_follows[username]]
+        followed = {pk for pk, in insert_ignore(friends, [{'from_user': user.id, 'to_user': pk} for pk in to_follow], ['to_user'])} if to_follow else set()
+        unfollowed = {pk for pk, in delete_returning(friends.objects.filter(from_user=user.id, to_user__in=to_unfollow), ['to_user'])} if to_unfollow else set()
+        if followed or unfollowed:
+            deltas = {
+                **{users[ids[pk]]: 1 for pk in followed},
+                **{users[ids[pk]]: -1 for pk in unfollowed},
+            }
+            _update_follow_counters(user, deltas)
+            jobs.enqueue('recommendations.follows_changed', user.id, [[target.id, delta] for target, delta in deltas.items()])
+            for pk in followed:
+                timeline.backfill(user, users[ids[pk]])
+            for pk in unfollowed:
+                timeline.remove(user, users[ids[pk]])
+            scopes.update([f'profile:{user.username}', *(f'profile:{ids[pk]}' for pk in followed | unfollowed)])
+
+        if scopes:
+            page_cache.bump(*scopes)
+
+    # state before batch: a relation is set if setting it changed nothing
+    # or if removing it changed something
+    liked_before = {pk: (pk not in liked) if wanted_likes[pk] else (pk in unliked) for pk in posts}
+    followed_before = {
+        username: (target.id not in followed) if wanted_follows[username] else (target.id in unfollowed)
+        for username, target in users.items()
+    }
+    like_results = _replay(operations, LIKE_OPERATIONS, liked_before)
+    follow_results = _replay(operations, FOLLOW_OPERATIONS, followed_before)
+
+    results = []
+    for i, (op, target) in enumerate(operations):
+        if i in like_results:
+            results.append((*like_results[i], posts[target]))
+        elif i in follow_results:
+            results.append((*follow_results[i], users[target]))
+        else:
+            results.append(None)
+    return results
@@ -0,0 +1,183 @@
+import json
+
+from django.db.models import F
+from django.http import JsonResponse
+
+from . import actions, timeline
+from .feeds import liked_post_ids
+from .models import User, Post
+from .utils import get_cursor_page
+
+
+# json api (v1) for feeds and user interactions
+# feeds are read as plain rows (.values()) instead of model instances
+# and paginated using cursors (?cursor=...)
+
+# fields of posts sent to clients
+POST_FIELDS = ['id', 'content', 'created_at']
+# renamed fields of posts sent to clients (name in response: lookup)
+POST_RENAMED_FIELDS = {
+    'author': F('user__username'),
+    'likes': F('likes_count'),
+}
+
+
+def json_response(data, status=200):
+    # compact json (no whitespace after separators)
+    return JsonResponse(data, status=status, json_dumps_params={'separators': (',', ':')})
+
+def json_error(message, status):
+    return json_response({'error': message}, status=status)
+
+
+def _feed_response(request, posts):
+    rows = posts.values(*POST_FIELDS, **POST_RENAMED_FIELDS)
+    page = get_cursor_page(rows, request.GET.get('cursor'))
+    if page is None:
+        return json_error('Invalid cursor.', 404)
+
+    liked_ids = liked_post_ids(request.user, [row['id'] for row in page])
+    for row in page:
+        row['liked'] = row['id'] in liked_ids
+
+    return json_response({
+        'posts': list(page),
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    })
+
+
+def posts_feed(request):
+    """All posts (most recent first)"""
+    if request.method != 'GET':
+        return json_error('Method not allowed.', 405)
+    return _feed_response(request, Post.objects.all())
+
+def user_posts_feed(request, username):
+    """Posts created by a user"""
+    if request.method != 'GET':
+        return json_error('Method not allowed.', 405)
+    user_id = User.objects.filter(username=username).values_list('id', flat=True).first()
+    if user_id is None:
+        return json_error('User not found.', 404)
+    return _feed_response(request, Post.objects.filter(user=user_id))
+
+def following_feed(request):
+    """Posts created by friends of current user"""
+    if not request.user.is_authenticated:
+        return json_error('Unauthorized.', 401)
+    if request.method != 'GET':
+        return json_error('Method not allowed.', 405)
+    return _feed_response(request, timeline.timeline_posts(request.user))
+
+
+def _interaction(request):
+    """Validate an interaction request (return an error response or None)"""
+    if not request.user.is_authenticated:
+        return json_error('Unauthorized.', 401)
+    if request.method != 'POST':
+        return json_error('Method not allowed.', 405)
+    return None
+
+def _post_or_none(post_id):
+    return Post.objects.select_related('user').filter(pk=post_id).first()
+
+def _user_or_none(username):
+    return User.objects.filter(username=username).first()
+
+
+def like_post(request, post_id):
+    error = _interaction(request)
+    if error:
+        return error
+    post = _post_or_none(post_id)
+    if post is None:
+        return json_error('Post not found.', 404)
+
+    changed = actions.like(request.user, post)
+    return json_response({'id': post.id, 'liked': True, 'likes': post.likes_count, 'changed': changed})
+
+def unlike_post(request, post_id):
+    error = _interaction(request)
+    if error:
+        return error
+    post = _post_or_none(post_id)
+    if post is None:
+        return json_error('Post not found.', 404)
+
+    changed = actions.unlike(request.user, post)
+    return json_response({'id': post.id, 'liked': False, 'likes': post.likes_count, 'changed': changed})
+
+def follow(request, username):
+    error = _interaction(request)
+    if error:
+        return error
+    user = _user_or_none(username)
+    if user is None:
+        return json_error('User not found.', 404)
+    if user == request.user:
+        return json_error("You can't follow yourself!", 400)
+
+    changed = actions.follow(request.user, user)
+    return json_response({'username': user.username, 'following': True, 'followers': user.followers_count, 'changed': changed})
+
+def unfollow(request, username):
+    error = _interaction(request)
+    if error:
+        return error
+    user = _user_or_none(username)
+    if user is None:
+        return json_error('User not found.', 404)
+    if user == request.user:
+        return json_error("You can't unfollow yourself!", 400)
+
+    changed = actions.unfollow(request.user, user)
+    return json_response({'username': user.username, 'following': False, 'followers': user.followers_count, 'changed': changed})
+
+
+# max number of operations of a batch
+MAX_BATCH_OPERATIONS = 100
+
+def _parse_operation(operation):
+    """Return (operation, target) of an operation sent by client (raise ValueError if invalid)"""
+    op = operation['op']
+    if op in actions.LIKE_OPERATIONS:
+        return op, int(operation['post'])
+    if op in actions.FOLLOW_OPERATIONS:
+        return op, str(operation['user'])
+    raise ValueError(f'unknown operation: {op}')
+
+def batch(request):
+    """Apply many interactions (like/unlike posts, follow/unfollow users) at once
+
+    body: {"operations": [{"op": "like", "post": 1}, {"op": "follow", "user": "foo"}, ...]}
+    operations are applied in one transaction and get a result each
+    (with updated likes/followers counts).
+    """
+    error = _interaction(request)
+    if error:
+        return error
+    try:
+        operations = [_parse_operation(operation) for operation in json.loads(request.body)['operations']]
+    except (ValueError, KeyError, TypeError):
+        return json_error('Invalid operations.', 400)
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return json_error(f'Too many operations (max {MAX_BATCH_OPERATIONS}).', 400)
+
+    results = []
+    for (op, target), result in zip(operations, actions.apply_batch(request.user, operations)):
+        if op in actions.LIKE_OPERATIONS:
+            if result is None:
+                results.append({'op': op, 'post': target, 'error': 'Post not found.'})
+            else:
+                changed, liked, post = result
+                results.append({'op': op, 'post': target, 'changed': changed, 'liked': liked, 'likes': post.likes_count})
+        else:
+            if result is None:
+                message = "You can't follow yourself!" if target == request.user.username else 'User not found.'
+                results.append({'op': op, 'user': target, 'error': message})
+            else:
+                changed, following, user = result
+                results.append({'op': op, 'user': target, 'changed': changed, 'following': following, 'followers': user.followers_count})
+
+    return json_response({'results': results, 'friends': request.user.friends_count})
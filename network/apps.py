@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class NetworkConfig(AppConfig):
     name = 'network'
+
+    def ready(self):
+        # connect signal receivers
+        from . import signals
+        # register tasks run by background jobs
+        from . import tasks
@@ -0,0 +1,17 @@
+from django.urls import path
+
+from . import async_views
+
+
+# async versions of feed and interaction views (served under /async/)
+app_name = 'async'
+
+urlpatterns = [
+    path("", async_views.index, name="index"),
+    path('following', async_views.friends_posts, name='following'),
+    path('posts/<int:post_id>/like', async_views.like_post, name='like_post'),
+    path('posts/<int:post_id>/unlike', async_views.unlike_post, name='unlike_post'),
+    path('<str:username>', async_views.profile, name='profile'),
+    path('<str:username>/follow', async_views.follow, name='follow'),
+    path('<str:username>/unfollow', async_views.unfollow, name='unfollow'),
+]
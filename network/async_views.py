@@ -0,0 +1,225 @@
+import asyncio
+import functools
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpResponse, HttpResponseNotAllowed, Http404, HttpResponseBadRequest
+from django.shortcuts import redirect
+from django.urls import reverse
+
+from . import actions, timeline
+from .models import User, Post
+from .feeds import annotate_page, feed_posts
+from .middleware import render
+from .page_cache import cache_anonymous_page, conditional_page, following_scopes, index_scopes, profile_scopes
+from .replicas import replica_reads
+from .utils import get_request_page
+from .views import _cards_url, _follow_buttons
+
+
+# async (asgi-native) versions of feed and interaction views
+# django orm is sync only, so db access runs in threads as "batches"
+# (a sync function doing all queries that depend on each other)
+# and independent batches run concurrently (each thread has its own db connection)
+
+
+def _parallel():
+    return getattr(settings, 'NETWORK_ASYNC_PARALLEL_QUERIES', True)
+
+def _batch(func):
+    """Turn a sync function into an awaitable batch running in a thread
+
+    when parallel queries are disabled (eg. sqlite in-memory test db where
+    other connections can't see uncommitted data) all batches run
+    one after another in the thread shared by sync code.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if not _parallel():
+            return await sync_to_async(func)(*args, **kwargs)
+        return await sync_to_async(_closing(func), thread_sensitive=False)(*args, **kwargs)
+    return wrapper
+
+def _closing(func):
+    # threads outlive requests, so close their connections like request_finished does
+    # (unless they can be reused, see CONN_MAX_AGE)
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return wrapper
+
+async def _gather(*batches):
+    """Run independent batches (awaitables) concurrently"""
+    if not _parallel():
+        return [await batch for batch in batches]
+    return await asyncio.gather(*batches)
+
+
+@_batch
+def _current_user(request):
+    # request.user is lazy (session and user queries)
+    return request.user if request.user.is_authenticated else None
+
+@_batch
+def _get_or_none(queryset, **lookup):
+    return queryset.filter(**lookup).first()
+
+@_batch
+def _feed_page(request, posts):
+    page = get_request_page(request, feed_posts(posts))
+    if page is not None:
+        annotate_page(page, request.user)
+    return page
+
+@_batch
+def _is_following(user, other):
+    return user is not None and user.friends.filter(pk=other.id).exists()
+
+_render = _batch(render)
+
+
+@replica_reads
+@conditional_page(index_scopes)
+@cache_anonymous_page(index_scopes)
+async def index(request):
+    await _current_user(request)
+    page = await _feed_page(request, Post.objects.all())
+    if page is None:
+        raise Http404()
+
+    return await _render(request, "network/index.html", {
+        'page': page,
+        'cards_url': _cards_url('index'),
+    })
+
+@replica_reads
+@conditional_page(profile_scopes)
+@cache_anonymous_page(profile_scopes)
+async def profile(request, username):
+    # current user and profile owner are independent
+    current_user, user = await _gather(
+        _current_user(request),
+        _get_or_none(User.objects, username=username),
+    )
+    if user is None:
+        raise Http404()
+
+    # so are posts page and follow state
+    page, is_following = await _gather(
+        _feed_page(request, user.posts.all()),
+        _is_following(current_user, user),
+    )
+    if page is None:
+        raise Http404()
+
+    return await _render(request, 'network/profile.html', {
+        'user': user,
+        'page': page,
+        'cards_url': _cards_url('profile', username=user.username),
+        **_follow_buttons(request.user, user, is_following),
+    })
+
+@replica_reads
+@conditional_page(following_scopes)
+async def friends_posts(request):
+    """View posts created by current user friends"""
+    current_user = await _current_user(request)
+    # only available for logged-in users
+    if current_user is None:
+        return HttpResponse(status=401)
+
+    page = await _feed_page(request, timeline.timeline_posts(current_user))
+    if page is None:
+        raise Http404()
+
+    return await _render(request, 'network/following.html', {
+        'page': page,
+        'cards_url': _cards_url('following'),
+    })
+
+
+@_batch
+def _like(user, post, like):
+    """Like (or unlike) a post, return an error message if it's already (un)liked"""
+    if like and not actions.like(user, post):
+        return "You already liked that post."
+    if not like and not actions.unlike(user, post):
+        return "You hadn't liked that post yet."
+    post.is_liked = like
+    return None
+
+async def _like_view(request, post_id, like):
+    # current user and post are independent
+    current_user, post = await _gather(
+        _current_user(request),
+        _get_or_none(Post.objects.select_related('user'), pk=post_id),
+    )
+    # reject non-authenticated requests (ie. user not logged-in)
+    if current_user is None:
+        return HttpResponse('Unauthorized', status=401)
+    # only accept POST requests
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    if post is None:
+        raise Http404()
+
+    error = await _like(current_user, post, like)
+    if error:
+        return HttpResponseBadRequest(error)
+
+    # send updated likes and correct button (like/unlike)
+    return await _render(request, 'network/likes.html', {
+        'post': post,
+    })
+
+async def like_post(request, post_id):
+    return await _like_view(request, post_id, like=True)
+
+async def unlike_post(request, post_id):
+    return await _like_view(request, post_id, like=False)
+
+
+@_batch
+def _follow(user, other, follow):
+    """Follow (or unfollow) a user, return an error message if it's already (un)followed"""
+    if follow and not actions.follow(user, other):
+        return f"You're already following {other.username}"
+    if not follow and not actions.unfollow(user, other):
+        return f"You can't unfollow {other.username} as you aren't friends with them."
+    return None
+
+async def _follow_view(request, username, follow):
+    # current user and user to (un)follow are independent
+    current_user, user = await _gather(
+        _current_user(request),
+        _get_or_none(User.objects, username=username),
+    )
+    # reject non-authenticated requests (ie. user not logged-in)
+    if current_user is None:
+        return HttpResponse('Unauthorized', status=401)
+    # only accept POST requests
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    if user is None:
+        raise Http404()
+
+    # users can't (un)follow themselves
+    if user == current_user:
+        return HttpResponseBadRequest("You can't follow yourself!" if follow else "You can't unfollow yourself!")
+
+    error = await _follow(current_user, user, follow)
+    if error:
+        return HttpResponseBadRequest(error)
+
+    # redirect to user profile (async version)
+    return redirect(reverse('async:profile', kwargs={'username': username}))
+
+async def follow(request, username):
+    return await _follow_view(request, username, follow=True)
+
+async def unfollow(request, username):
+    return await _follow_view(request, username, follow=False)
@@ -0,0 +1,539 @@
+"""Benchmarks of network views under realistic data
+
+run `manage.py generate_graph` first, then `manage.py benchmark`
+results are written as json so that runs (eg. of two commits) can be diffed.
+"""
+import asyncio
+import contextlib
+import datetime
+import gc
+import gzip
+import random
+import re
+import statistics
+import subprocess
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import SyncToAsync
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.models import Max, Q
+from django.template.loader import render_to_string
+from django.test import AsyncClient, Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import actions, middleware, recommendations, replicas
+from .feeds import annotate_page, feed_posts
+from .models import User, Post, Job
+from .utils import close_pool_connections, get_cursor_page
+
+
+def percentiles(samples):
+    """Return p50/p95/p99 (and mean) of latency samples (in ms)"""
+    if len(samples) == 1:
+        samples = samples * 2
+    cuts = statistics.quantiles(samples, n=100, method='inclusive')
+    return {
+        'p50_ms': round(cuts[49], 3),
+        'p95_ms': round(cuts[94], 3),
+        'p99_ms': round(cuts[98], 3),
+        'mean_ms': round(statistics.mean(samples), 3),
+    }
+
+
+def rows_read(queries, alias=DEFAULT_DB_ALIAS):
+    """Count rows returned by SELECT queries (ie. rows the app read from db alias)"""
+    total = 0
+    with connections[alias].cursor() as cursor:
+        for query in queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith('SELECT'):
+                continue
+            cursor.execute(f'SELECT COUNT(*) FROM ({sql}) AS benchmarked')
+            total += cursor.fetchone()[0]
+    return total
+
+
+def measure(requests, send):
+    """Call send() n times and report latency, queries and rows read per request"""
+    samples = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = send()
+        samples.append((time.perf_counter() - started) * 1000)
+        assert response.status_code < 400, f'benchmarked request failed ({response.status_code})'
+
+    # queries of a single (extra) request, on the primary and replicas (feeds read from them)
+    # (not timed: capturing queries has its own overhead)
+    with contextlib.ExitStack() as stack:
+        captured = {
+            alias: stack.enter_context(CaptureQueriesContext(connections[alias]))
+            for alias in dict.fromkeys([DEFAULT_DB_ALIAS, *replicas.replicas()])
+        }
+        send()
+    return {
+        'requests': requests,
+        **percentiles(samples),
+        'queries': sum(len(queries.captured_queries) for queries in captured.values()),
+        'rows_read': sum(rows_read(queries.captured_queries, alias) for alias, queries in captured.items()),
+    }
+
+
+def _host():
+    # an allowed host (localhost is always allowed when debugging)
+    return next((host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*'), 'localhost')
+
+def _client(user=None):
+    # test client (no server/network overhead: only django and db)
+    client = Client(HTTP_HOST=_host())
+    if user is not None:
+        client.force_login(user)
+    return client
+
+
+class _Alternate:
+    """Alternate between two requests (eg. like/unlike) so that db state is kept"""
+    def __init__(self, first, second):
+        self.calls = [first, second]
+        self.sent = 0
+
+    def __call__(self):
+        call = self.calls[self.sent % 2]
+        self.sent += 1
+        return call()
+
+    def restore(self):
+        # undo first request if it was sent once more than second one
+        if self.sent % 2:
+            self()
+
+
+def benchmark_endpoints(requests=100, workers=1):
+    """Benchmark feeds (index, profile, following) and interactions (like, follow)
+
+    requests are sent one after another (workers is unused).
+    """
+    # most followed user (profile to view) and user following most users (viewer)
+    celebrity = User.objects.order_by('-followers_count').first()
+    viewer = User.objects.exclude(pk=getattr(celebrity, 'pk', None)).order_by('-friends_count').first()
+    if celebrity is None or viewer is None:
+        raise ValueError('Not enough users to benchmark, run generate_graph first.')
+
+    post_id = Post.objects.exclude(fans=viewer).aggregate(Max('id'))['id__max']
+    if post_id is None:
+        raise ValueError('No posts to benchmark, run generate_graph first.')
+    # viewer shouldn't already follow user to follow (follow/unfollow keep state)
+    user_to_follow = User.objects.exclude(pk=viewer.pk).exclude(followers=viewer).order_by('-followers_count').first()
+
+    # a page in the middle of All Posts feed (deep pages cost more when using offsets)
+    middle_page = max(1, Post.objects.count() // 20)
+
+    anonymous, client = _client(), _client(viewer)
+    endpoints = {
+        'index_anonymous': lambda: anonymous.get(reverse('index')),
+        'index': lambda: client.get(reverse('index')),
+        'index_middle_page': lambda: client.get(reverse('index'), {'page': middle_page}),
+        'profile': lambda: client.get(reverse('profile', args=[celebrity.username])),
+        'following': lambda: client.get(reverse('following')),
+        'like_post': _Alternate(
+            lambda: client.post(reverse('like_post', args=[post_id])),
+            lambda: client.post(reverse('unlike_post', args=[post_id])),
+        ),
+    }
+    if user_to_follow is not None:
+        endpoints['follow'] = _Alternate(
+            lambda: client.post(reverse('follow', args=[user_to_follow.username])),
+            lambda: client.post(reverse('unfollow', args=[user_to_follow.username])),
+        )
+
+    results = {}
+    for name, send in endpoints.items():
+        try:
+            results[name] = measure(requests, send)
+        except AssertionError as error:
+            results[name] = {'error': str(error)}
+        if isinstance(send, _Alternate):
+            send.restore()
+    return results
+
+
+def _throughput(latencies, elapsed):
+    return {
+        'requests': len(latencies),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        **percentiles(latencies),
+    }
+
+def _wsgi_load(urls, user, workers):
+    """Send requests (one per url) using a pool of worker threads"""
+    # log in once, then each worker (client) uses the same session
+    cookies = _client(user).cookies
+    local = threading.local()
+
+    def send(url):
+        if not hasattr(local, 'client'):
+            local.client = _client()
+            local.client.cookies = cookies.copy()
+        started = time.perf_counter()
+        response = local.client.get(url)
+        assert response.status_code < 400, f'benchmarked request failed ({response.status_code})'
+        return (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        latencies = list(executor.map(send, urls))
+        elapsed = time.perf_counter() - started
+        close_pool_connections(executor, workers)
+    return _throughput(latencies, elapsed)
+
+def _asgi_load(urls, user, workers):
+    """Send requests (one per url) with at most `workers` requests in flight
+
+    db queries of async views run in the default executor of the event loop
+    which is limited to `workers` threads too (same db concurrency as wsgi).
+    """
+    client = AsyncClient()
+    if user is not None:
+        client.force_login(user)
+
+    async def load():
+        executor = ThreadPoolExecutor(max_workers=workers)
+        asyncio.get_running_loop().set_default_executor(executor)
+        in_flight = asyncio.Semaphore(workers)
+
+        async def send(url):
+            async with in_flight:
+                started = time.perf_counter()
+                response = await client.get(url)
+                assert response.status_code < 400, f'benchmarked request failed ({response.status_code})'
+                return (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(send(url) for url in urls))
+        elapsed = time.perf_counter() - started
+        await asyncio.gather(*map(asyncio.wrap_future, close_pool_connections(executor, workers)))
+        return _throughput(latencies, elapsed)
+
+    # async test client always sends requests to host "testserver"
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+        return asyncio.run(load())
+
+def benchmark_asgi(requests=100, workers=4):
+    """Compare throughput of sync (wsgi) and async (asgi) feeds at equal worker counts"""
+    celebrity = User.objects.order_by('-followers_count').first()
+    viewer = User.objects.exclude(pk=getattr(celebrity, 'pk', None)).order_by('-friends_count').first()
+    if celebrity is None or viewer is None:
+        raise ValueError('Not enough users to benchmark, run generate_graph first.')
+
+    feeds = {
+        'index': ('index', []),
+        'profile': ('profile', [celebrity.username]),
+        'following': ('following', []),
+    }
+    results = {'workers': workers}
+    for name, (url_name, args) in feeds.items():
+        results[name] = {}
+        for server, load, prefix in [('wsgi', _wsgi_load, ''), ('asgi', _asgi_load, 'async:')]:
+            urls = [reverse(prefix + url_name, args=args)] * requests
+            try:
+                results[name][server] = load(urls, viewer, workers)
+            except AssertionError as error:
+                results[name][server] = {'error': str(error)}
+    return results
+
+
+def benchmark_recommendations(requests=100, workers=1):
+    """Measure loading follow graph and computing recommendations of sampled users
+
+    memory is traced (tracemalloc) so timings are slower than untraced runs.
+    requests is the number of sampled users (workers is unused).
+    eg. `generate_graph --users 20000 --follows 50` for a million follows.
+    """
+    tracemalloc.start()
+    try:
+        started = time.perf_counter()
+        graph = recommendations.load_graph()
+        load_seconds = time.perf_counter() - started
+        load_peak = tracemalloc.get_traced_memory()[1]
+
+        user_ids = list(User.objects.values_list('id', flat=True))
+        if not user_ids:
+            raise ValueError('No users to benchmark, run generate_graph first.')
+        sample = random.Random(0).sample(user_ids, min(requests, len(user_ids)))
+
+        # memory used while counting candidates (on top of graph)
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        samples = []
+        for user_id in sample:
+            started = time.perf_counter()
+            recommendations.candidates(graph, user_id)
+            samples.append((time.perf_counter() - started) * 1000)
+        candidates_peak = tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'edges': graph.edges,
+        'graph_bytes': graph.nbytes,
+        'load_seconds': round(load_seconds, 3),
+        'load_peak_bytes': load_peak,
+        'candidates': {'users': len(sample), **percentiles(samples)},
+        'candidates_peak_bytes': candidates_peak,
+    }
+
+
+# db connection settings compared by sqlite suite
+SQLITE_PROFILES = {
+    # django defaults: rollback journal, deferred transactions, a connection per request
+    'default': {
+        'CONN_MAX_AGE': 0,
+        'TRANSACTION_MODE': 'DEFERRED',
+        'SERIALIZE_WRITES': False,
+        'PRAGMAS': {'journal_mode': 'delete', 'synchronous': 'full', 'mmap_size': 0, 'busy_timeout': 5000},
+    },
+    # project settings (check: project4/sqlite3/base.py)
+    'tuned': {
+        'CONN_MAX_AGE': 60,
+        'TRANSACTION_MODE': 'IMMEDIATE',
+        'SERIALIZE_WRITES': True,
+        'PRAGMAS': {},
+    },
+}
+
+@contextlib.contextmanager
+def _database_profile(profile):
+    """Use other settings for (new) connections to default db"""
+    # settings dict is shared by connections of all threads
+    settings_dict = connections.databases['default']
+    saved = {key: settings_dict[key] for key in profile if key in settings_dict}
+    connection.close()
+    # another open connection would block changing journal mode:
+    # connections of finished threads are closed once collected
+    # and the thread running sync code of async views keeps its own
+    gc.collect()
+    SyncToAsync.single_thread_executor.submit(connections.close_all).result()
+    settings_dict.update(profile)
+    try:
+        yield
+    finally:
+        connection.close()
+        for key in profile:
+            settings_dict.pop(key, None)
+        settings_dict.update(saved)
+
+def _write_load(users, post_id, operations):
+    """Send write requests (like, unlike then create a post) from a thread per user"""
+    # log in one after another (sessions are written)
+    cookies = [_client(user).cookies for user in users]
+
+    def send(cookies):
+        client = Client(HTTP_HOST=_host(), raise_request_exception=False)
+        client.cookies = cookies
+        requests = [
+            lambda: client.post(reverse('like_post', args=[post_id])),
+            lambda: client.post(reverse('unlike_post', args=[post_id])),
+            lambda: client.post(reverse('create_post'), {'content': 'sqlite benchmark'}),
+        ]
+        latencies, errors = [], 0
+        try:
+            for i in range(operations):
+                started = time.perf_counter()
+                try:
+                    failed = requests[i % len(requests)]().status_code >= 500
+                except Exception:
+                    failed = True
+                latencies.append((time.perf_counter() - started) * 1000)
+                errors += failed
+        finally:
+            # connections of this thread (kept alive by CONN_MAX_AGE)
+            connection.close()
+        return latencies, errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(users)) as executor:
+        results = list(executor.map(send, cookies))
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency for worker, _ in results for latency in worker]
+    errors = sum(errors for _, errors in results)
+    return {
+        'operations': len(latencies),
+        'errors': errors,
+        'error_rate': round(errors / len(latencies), 4),
+        'operations_per_second': round((len(latencies) - errors) / elapsed, 1),
+        **percentiles(latencies),
+    }
+
+def benchmark_sqlite(requests=100, workers=4):
+    """Compare concurrent writes (like/unlike, create post) using default and tuned sqlite settings
+
+    each worker (a user) sends requests / workers requests.
+    """
+    if connection.vendor != 'sqlite':
+        raise ValueError('sqlite suite needs a sqlite database.')
+    users = list(User.objects.order_by('id')[:workers])
+    post_id = Post.objects.exclude(fans__in=users).aggregate(Max('id'))['id__max']
+    if len(users) < workers or post_id is None:
+        raise ValueError('Not enough users or posts to benchmark, run generate_graph first.')
+
+    last_post = Post.objects.aggregate(Max('id'))['id__max']
+    operations = max(3, requests // workers // 3 * 3)
+    results = {'workers': workers}
+    try:
+        for name, profile in SQLITE_PROFILES.items():
+            with _database_profile(profile):
+                results[name] = _write_load(users, post_id, operations)
+    finally:
+        # drop created posts (and their jobs), unlike post (likes of failed unlike requests)
+        created = Post.objects.filter(id__gt=last_post, content='sqlite benchmark')
+        Job.objects.filter(key__in=[f'fan_out:{pk}' for pk in created.values_list('id', flat=True)]).delete()
+        created.delete()
+        post = Post.objects.select_related('user').get(pk=post_id)
+        for user in users:
+            actions.unlike(user, post)
+    return results
+
+
+def _transfer(requests, send):
+    """Send requests and report time to first byte, total time and bytes on wire (body)
+
+    streamed bodies are read chunk by chunk (first byte: first chunk).
+    """
+    first_byte, total, sizes = [], [], []
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = send()
+        assert response.status_code < 400, f'benchmarked request failed ({response.status_code})'
+        if response.streaming:
+            chunks = iter(response.streaming_content)
+            size = len(next(chunks, b''))
+            first_byte.append((time.perf_counter() - started) * 1000)
+            size += sum(len(chunk) for chunk in chunks)
+        else:
+            first_byte.append((time.perf_counter() - started) * 1000)
+            size = len(response.content)
+        total.append((time.perf_counter() - started) * 1000)
+        sizes.append(size)
+    return {
+        'requests': requests,
+        'first_byte': percentiles(first_byte),
+        'total': percentiles(total),
+        'bytes': round(statistics.mean(sizes)),
+    }
+
+def benchmark_transfer(requests=100, workers=1):
+    """Compare time to first byte and bytes on wire of feed pages per encoding, buffered or streamed
+
+    pages are the ones of a logged-in viewer (anonymous ones are cached whole).
+    requests are sent one after another (workers is unused).
+    """
+    celebrity = User.objects.order_by('-followers_count').first()
+    viewer = User.objects.exclude(pk=getattr(celebrity, 'pk', None)).order_by('-friends_count').first()
+    if celebrity is None or viewer is None:
+        raise ValueError('Not enough users to benchmark, run generate_graph first.')
+
+    client = _client(viewer)
+    pages = {
+        'index': reverse('index'),
+        'profile': reverse('profile', args=[celebrity.username]),
+        'following': reverse('following'),
+    }
+    encodings = ['identity', 'gzip'] + (['br'] if middleware.brotli is not None else [])
+    results = {}
+    for name, url in pages.items():
+        results[name] = {}
+        for mode in ['buffered', 'streamed']:
+            results[name][mode] = {}
+            with override_settings(NETWORK_STREAM_PAGES=mode == 'streamed'):
+                for encoding in encodings:
+                    try:
+                        results[name][mode][encoding] = _transfer(
+                            requests, lambda: client.get(url, HTTP_ACCEPT_ENCODING=encoding),
+                        )
+                    except AssertionError as error:
+                        results[name][mode][encoding] = {'error': str(error)}
+    return results
+
+
+# start tags of html (elements browsers build)
+START_TAG = re.compile(rb'<[a-zA-Z]')
+
+def benchmark_markup(requests=100, workers=1):
+    """Measure size (raw and gzipped), elements and render time of feed pages of 10 and 100 posts
+
+    pages are rendered for a logged-in viewer owning some of their posts
+    (card fragments are cached by a first render, like on a warm server).
+    requests is the number of renders per page (workers is unused).
+    """
+    viewer = User.objects.order_by('-friends_count').first()
+    if viewer is None or not viewer.posts.exists():
+        raise ValueError('Not enough users or posts to benchmark, run generate_graph first.')
+    # viewer's posts among others (only those get an edit button)
+    posts = Post.objects.filter(Q(user=viewer) | Q(user__in=viewer.friends.all()))
+
+    results = {}
+    for size in [10, 100]:
+        request = RequestFactory().get(reverse('index'))
+        request.user = viewer
+        page = get_cursor_page(feed_posts(posts), page_size=size)
+        annotate_page(page, viewer)
+
+        def render():
+            return render_to_string('network/index.html', {'page': page, 'cards_url': ''}, request=request).encode()
+
+        content = render()
+        samples = []
+        for _ in range(requests):
+            started = time.perf_counter()
+            render()
+            samples.append((time.perf_counter() - started) * 1000)
+        results[f'{size}_posts'] = {
+            'posts': len(page),
+            'bytes': len(content),
+            'gzip_bytes': len(gzip.compress(content, compresslevel=getattr(settings, 'NETWORK_GZIP_LEVEL', 6))),
+            'elements': len(START_TAG.findall(content)),
+            'render': percentiles(samples),
+        }
+    return results
+
+
+# available suites (name: function returning results)
+SUITES = {
+    'endpoints': benchmark_endpoints,
+    'asgi': benchmark_asgi,
+    'recommendations': benchmark_recommendations,
+    'sqlite': benchmark_sqlite,
+    'transfer': benchmark_transfer,
+    'markup': benchmark_markup,
+}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, cwd=settings.BASE_DIR, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(suites, requests, workers=4):
+    """Run benchmark suites and return their results (with info about the run)"""
+    return {
+        'meta': {
+            'commit': _git_commit(),
+            'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'database': connection.vendor,
+            'users': User.objects.count(),
+            'posts': Post.objects.count(),
+            'follows': User.friends.through.objects.count(),
+            'likes': User.likes.through.objects.count(),
+        },
+        **{suite: SUITES[suite](requests=requests, workers=workers) for suite in suites},
+    }
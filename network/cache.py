@@ -0,0 +1,77 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.safestring import mark_safe
+
+from .middleware import render_to_string
+
+
+# post cards fragment cache
+# the viewer-independent parts of a post card (content, author, timestamp)
+# are rendered once per post version (id + updated_at) and reused by all viewers
+# viewer-specific parts (like/unlike and edit buttons) are rendered per request
+
+CARD_TEMPLATES = {
+    'content': 'network/post_card/content.html',
+    'meta': 'network/post_card/meta.html',
+}
+
+
+def _cache():
+    return caches[getattr(settings, 'NETWORK_POST_CARD_CACHE', 'default')]
+
+def card_key(post):
+    # a new key for every post version (so edited posts never hit stale cards)
+    return f'post-card:{post.id}:{post.updated_at.timestamp():.6f}'
+
+
+class CacheStats:
+    """Count fragment cache hits/misses (per process)"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hits, misses):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def as_dict(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+card_stats = CacheStats()
+
+
+def _render_card(post):
+    return {
+        part: render_to_string(template, {'post': post})
+        for part, template in CARD_TEMPLATES.items()
+    }
+
+def attach_cards(posts):
+    """Attach `card` (rendered viewer-independent parts) to each post
+
+    cards of all posts are fetched using a single cache lookup
+    and missing ones are rendered then stored using a single cache write.
+    """
+    cache = _cache()
+    keys = {post.id: card_key(post) for post in posts}
+    cached = cache.get_many(keys.values())
+
+    missing = {}
+    for post in posts:
+        card = cached.get(keys[post.id])
+        if card is None:
+            card = missing[keys[post.id]] = _render_card(post)
+        post.card = {part: mark_safe(html) for part, html in card.items()}
+
+    if missing:
+        cache.set_many(missing, timeout=getattr(settings, 'NETWORK_POST_CARD_TIMEOUT', 24 * 60 * 60))
+    card_stats.record(hits=len(posts) - len(missing), misses=len(missing))
+    return posts
+
+def evict_card(post):
+    _cache().delete(card_key(post))
@@ -0,0 +1,45 @@
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Post, User
+
+
+def _count_of(queryset, field):
+    """Build a subquery counting rows of `queryset` related to outer row by `field`"""
+    return Coalesce(
+        Subquery(
+            queryset
+            .filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(count=Count('*'))
+            .values('count')
+        ),
+        0,
+    )
+
+
+def reconcile_counters():
+    """Recompute denormalized counters from through tables (source of truth)
+
+    only rows whose counters drifted get updated.
+    return number of fixed rows per counter.
+    """
+    likes = User.likes.through.objects
+    friends = User.friends.through.objects
+
+    counters = [
+        (Post, 'likes_count', _count_of(likes, 'post')),
+        # when foo follows bar: from_user=foo (follower), to_user=bar (friend)
+        (User, 'followers_count', _count_of(friends, 'to_user')),
+        (User, 'friends_count', _count_of(friends, 'from_user')),
+    ]
+
+    fixed = {}
+    for model, field, actual in counters:
+        fixed[field] = (
+            model.objects
+            .exclude(**{field: actual})
+            .update(**{field: actual})
+        )
+    return fixed
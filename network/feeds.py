@@ -0,0 +1,55 @@
+from .cache import attach_cards
+
+
+# columns rendered by post cards (everything else is deferred)
+FEED_FIELDS = ['id', 'content', 'created_at', 'updated_at', 'likes_count', 'user', 'user__username']
+
+
+def feed_posts(posts, *fields):
+    """Build the queryset that feeds (index, profile, following) render
+
+    post authors are selected in the same query (instead of a query per post)
+    and only the columns rendered by post cards are loaded
+    (and extra `fields`, eg. the one feed is ordered by).
+    """
+    return posts.select_related('user').only(*FEED_FIELDS, *fields)
+
+
+def liked_post_ids(user, post_ids):
+    """Return which of the given posts are liked by user (as a set of ids)"""
+    if not user.is_authenticated or not post_ids:
+        return set()
+    # read likes through table directly (no need to join posts)
+    return set(
+        user.likes.through.objects
+        .filter(user=user.id, post__in=post_ids)
+        .values_list('post', flat=True)
+    )
+
+
+def annotate_likes(posts, user):
+    """Attach `is_liked` to each post (ie. whether current user liked it)
+
+    like state is fetched for the given posts only (usually one page)
+    using a single query, instead of loading all posts liked by user
+    for every rendered post.
+    """
+    posts = list(posts)
+    if not posts:
+        return posts
+
+    liked_ids = liked_post_ids(user, [post.id for post in posts])
+    for post in posts:
+        post.is_liked = post.id in liked_ids
+    return posts
+
+
+def annotate_page(page, user):
+    """Prepare a page of posts for rendering (attach liked state and cached cards)"""
+    # page.object_list is a lazy queryset
+    # convert it into a list so that annotated instances are the same ones
+    # that get rendered when iterating over page (inside templates)
+    page.object_list = annotate_likes(page.object_list, user)
+    # viewer-independent parts of post cards come from fragment cache
+    attach_cards(page.object_list)
+    return page
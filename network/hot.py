@@ -0,0 +1,90 @@
+"""Hot posts feed (posts ranked by time-decayed likes)
+
+score of a post is the sum of its likes weights, exp(-(now - liked at) / tau)
+(a like counts half as much every half-life).
+decaying all scores as time passes would rewrite every post continuously
+so scores use forward decay instead: a like adds exp((liked at - landmark) / tau)
+(newer likes weigh more) which keeps posts in the same order as decayed scores.
+that way a like is a single increment of Post.hot_score (see network.actions)
+and the Hot feed is a range read of its index.
+unliking removes the weight the like added (its time is kept: Like.created_at).
+
+weights grow exponentially over time, so decay_hot_scores (run periodically, eg. daily)
+moves the landmark to now and rescales scores (zeroing negligible ones).
+"""
+import collections
+import math
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Subquery, Value, When
+from django.db.models.functions import Coalesce, Exp
+
+from .models import Post, HotLandmark, Like
+
+
+# scores lower than this (likes older than ~20 half-lives) are zeroed when decaying
+# so that posts leave the Hot feed and decaying only touches recent posts
+MIN_SCORE = 1e-6
+
+
+def half_life():
+    """Time (seconds) after which a like counts half as much"""
+    return getattr(settings, 'NETWORK_HOT_HALF_LIFE', 6 * 60 * 60)
+
+def _tau():
+    return half_life() / math.log(2)
+
+
+def like_weight(liked_at=None):
+    """Weight of a like made at liked_at (default: now) as an expression reading landmark at db level
+
+    so that it's added (or removed, once unliked) in the same statement that updates likes counter
+    and is never relative to a stale landmark (eg. read before decaying)
+    """
+    timestamp = time.time() if liked_at is None else liked_at.timestamp()
+    # no landmark (yet): weights are relative to now
+    landmark = Coalesce(Subquery(HotLandmark.objects.values('timestamp')[:1]), Value(time.time()), output_field=FloatField())
+    return Exp((Value(timestamp) - landmark) / Value(_tau()))
+
+def weight(timestamp, landmark):
+    """Weight of a like at timestamp (computed in python)"""
+    return math.exp((timestamp - landmark) / _tau())
+
+
+def decay(now=None):
+    """Move landmark to now and rescale scores of posts accordingly
+
+    return number of rescaled posts
+    """
+    now = time.time() if now is None else now
+    with transaction.atomic():
+        landmark, created = HotLandmark.objects.select_for_update().get_or_create(pk=1, defaults={'timestamp': now})
+        factor = math.exp((landmark.timestamp - now) / _tau())
+        rescaled = Post.objects.filter(hot_score__gt=0).update(hot_score=Case(
+            When(hot_score__lt=MIN_SCORE / factor, then=Value(0.0)),
+            default=F('hot_score') * factor,
+        ))
+        landmark.timestamp = now
+        landmark.save()
+    return rescaled
+
+
+def rebuild(now=None):
+    """Set scores of all posts from times of their likes (landmark becomes now)"""
+    now = time.time() if now is None else now
+    with transaction.atomic():
+        HotLandmark.objects.update_or_create(pk=1, defaults={'timestamp': now})
+        Post.objects.exclude(hot_score=0).update(hot_score=0)
+        scores = collections.defaultdict(float)
+        for post_id, liked_at in Like.objects.values_list('post', 'created_at').iterator():
+            scores[post_id] += weight(liked_at.timestamp(), now)
+        posts = [Post(id=post_id, hot_score=score) for post_id, score in scores.items() if score >= MIN_SCORE]
+        Post.objects.bulk_update(posts, ['hot_score'], batch_size=500)
+    return len(posts)
+
+
+def hot_posts():
+    """Posts with a score (paginate them with get_cursor_page(posts, key='hot_score'))"""
+    return Post.objects.filter(hot_score__gt=0)
@@ -0,0 +1,240 @@
+"""Background jobs (a queue of Job rows in db)
+
+side effects of writes that don't have to be visible right away
+(eg. pushing a post into timelines of thousands of followers)
+are enqueued inside the write transaction (so a job exists only if its write
+was committed) then run by workers (manage.py run_jobs) instead of in the request.
+  - due jobs are claimed using a single UPDATE ... RETURNING (a job is never run twice at once)
+  - failed jobs are retried with exponential backoff (up to max_attempts)
+  - jobs enqueued with an idempotency key are enqueued once per key
+  - jobs left running by crashed workers are queued again after a timeout
+tasks (functions run by jobs) are registered using @task and take json-serializable args.
+with NETWORK_JOBS_EAGER (no workers), due tasks run in the request once its write commits
+(a failure doesn't undo the write, the task is queued to be retried) while delayed
+and retried jobs are stored like with workers and run by the next eager runs once due.
+"""
+import datetime
+import functools
+import random
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Count, F, Min
+from django.utils import timezone
+
+from .metrics import CONTENT_TYPE, has_token, registry
+from .models import Job
+from .sql import update_returning
+from .utils import close_pool_connections
+
+
+# name: (function, max attempts)
+TASKS = {}
+
+
+def task(name, max_attempts=5):
+    """Register a function as a task (that jobs could run)"""
+    def decorator(func):
+        TASKS[name] = (func, max_attempts)
+        return func
+    return decorator
+
+
+def is_eager():
+    return getattr(settings, 'NETWORK_JOBS_EAGER', False)
+
+def backoff(attempts):
+    """Delay (seconds) before retrying a job that failed `attempts` times (with jitter)"""
+    base = getattr(settings, 'NETWORK_JOBS_BACKOFF', 2)
+    delay = min(base * 2 ** (attempts - 1), getattr(settings, 'NETWORK_JOBS_MAX_BACKOFF', 60 * 60))
+    # jitter: jobs failing together (eg. db was locked) aren't retried together
+    return delay * random.uniform(0.5, 1)
+
+def stale_timeout():
+    """Time (seconds) after which running jobs are considered abandoned (eg. worker crashed)"""
+    return getattr(settings, 'NETWORK_JOBS_STALE_TIMEOUT', 5 * 60)
+
+
+def enqueue(name, *args, key=None, run_at=None):
+    """Enqueue a job running task `name` with args
+
+    run_at: time the job is due (default: now)
+    return whether it was enqueued (False if a job with the same key exists already)
+    """
+    func, max_attempts = TASKS[name]
+    if is_eager() and (run_at is None or run_at <= timezone.now()):
+        transaction.on_commit(functools.partial(_run_eager, name, args))
+        return True
+
+    fields = {'name': name, 'args': list(args), 'max_attempts': max_attempts}
+    if run_at is not None:
+        fields['run_at'] = run_at
+    if key is None:
+        Job.objects.create(**fields)
+        return True
+    try:
+        # savepoint: a duplicate key mustn't break the write transaction
+        with transaction.atomic():
+            Job.objects.create(key=key, **fields)
+    except IntegrityError:
+        return False
+    return True
+
+
+def _run_eager(name, args):
+    """Run a task right away (queue it to be retried if it fails) then jobs that became due"""
+    func, max_attempts = TASKS[name]
+    try:
+        with transaction.atomic():
+            func(*args)
+    except Exception:
+        now = timezone.now()
+        Job.objects.create(
+            name=name, args=list(args), max_attempts=max_attempts, attempts=1, error=traceback.format_exc(),
+            run_at=now + datetime.timedelta(seconds=backoff(1)),
+        )
+    run_due()
+
+def run_due(limit=10):
+    """Run (up to limit) due jobs in current thread (eg. eager mode, there are no workers)"""
+    count = 0
+    for job in claim(limit):
+        run(job)
+        count += 1
+    return count
+
+
+def claim(limit=1):
+    """Mark due jobs as running (single statement) and return them"""
+    now = timezone.now()
+    due = Job.objects.filter(status=Job.QUEUED, run_at__lte=now).order_by('run_at', 'id').values('id')[:limit]
+    # status is checked again by the update itself
+    # so concurrent workers never claim the same job
+    claimed = update_returning(
+        Job.objects.filter(pk__in=due, status=Job.QUEUED), ['id'],
+        status=Job.RUNNING, started_at=now, attempts=F('attempts') + 1,
+    )
+    return list(Job.objects.filter(pk__in=[pk for pk, in claimed]).order_by('run_at', 'id'))
+
+def run(job):
+    """Run a claimed job then mark it done (or queue it again to retry, or failed)"""
+    started = time.perf_counter()
+    # time job waited for a worker (since it was due)
+    wait = (job.started_at - job.run_at).total_seconds()
+    try:
+        func, _ = TASKS[job.name]
+        with transaction.atomic():
+            func(*job.args)
+    except Exception:
+        error = traceback.format_exc()
+        now = timezone.now()
+        if job.attempts < job.max_attempts:
+            job.status, job.run_at = Job.QUEUED, now + datetime.timedelta(seconds=backoff(job.attempts))
+        else:
+            job.status, job.finished_at = Job.FAILED, now
+        job.error = error
+    else:
+        job.status, job.finished_at, job.error = Job.DONE, timezone.now(), ''
+    Job.objects.filter(pk=job.pk).update(
+        status=job.status, run_at=job.run_at, finished_at=job.finished_at, error=job.error,
+    )
+
+    registry.observe(job.name, {
+        'network_job_wait_seconds': wait,
+        'network_job_duration_seconds': time.perf_counter() - started,
+    })
+    return job.status
+
+def requeue_stale():
+    """Queue again jobs left running for too long (or fail them if out of attempts)"""
+    now = timezone.now()
+    stale = Job.objects.filter(status=Job.RUNNING, started_at__lt=now - datetime.timedelta(seconds=stale_timeout()))
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED, finished_at=now, error='Abandoned by worker',
+    )
+    return stale.update(status=Job.QUEUED, run_at=now) + failed
+
+def purge(older_than=None):
+    """Delete jobs done before `older_than` (seconds ago, default: a week)
+
+    keys of purged jobs could be enqueued again
+    """
+    older_than = 7 * 24 * 60 * 60 if older_than is None else older_than
+    cutoff = timezone.now() - datetime.timedelta(seconds=older_than)
+    return Job.objects.filter(status=Job.DONE, finished_at__lt=cutoff).delete()[0]
+
+
+def _run_closing(job):
+    # worker threads outlive jobs, so close their connections like request_finished does
+    try:
+        return run(job)
+    finally:
+        close_old_connections()
+
+def work(threads=4, poll=1.0, once=False, stop=None):
+    """Claim and run jobs using a pool of threads until stopped
+
+    once: stop when no job is due (instead of polling for new ones)
+    return number of jobs run
+    """
+    stop = stop or threading.Event()
+    count = 0
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        while not stop.is_set():
+            close_old_connections()
+            requeue_stale()
+            jobs = claim(threads)
+            if not jobs:
+                if once:
+                    break
+                stop.wait(poll)
+                continue
+            count += len(list(executor.map(_run_closing, jobs)))
+        close_pool_connections(executor, threads)
+    return count
+
+
+def render_metrics():
+    """Queue depth (jobs per status) and age of oldest due job in prometheus text format"""
+    counts = dict(Job.objects.order_by().values_list('status').annotate(count=Count('*')))
+    oldest = Job.objects.filter(status=Job.QUEUED, run_at__lte=timezone.now()).aggregate(Min('run_at'))['run_at__min']
+    lines = [
+        '# HELP network_jobs Number of background jobs per status',
+        '# TYPE network_jobs gauge',
+        *(f'network_jobs{{status="{status}"}} {counts.get(status, 0)}' for status, _ in Job.STATUSES),
+        '# HELP network_jobs_oldest_due_seconds Time the oldest due job has been waiting',
+        '# TYPE network_jobs_oldest_due_seconds gauge',
+        f'network_jobs_oldest_due_seconds {(timezone.now() - oldest).total_seconds() if oldest else 0}',
+    ]
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        # (same token as the metrics endpoint, if one is set)
+        if getattr(settings, 'NETWORK_METRICS_TOKEN', None) and not has_token(self.headers.get('Authorization')):
+            self.send_error(404)
+            return
+        try:
+            body = (registry.render() + render_metrics()).encode()
+        finally:
+            close_old_connections()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve_metrics(port):
+    """Serve metrics of this (worker) process on a port (in a daemon thread)"""
+    server = ThreadingHTTPServer(('', port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
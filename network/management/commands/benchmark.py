@@ -0,0 +1,31 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from network import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Benchmark network views (run generate_graph first) and report results as json'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--suite', action='append', choices=sorted(benchmark.SUITES),
+                            help='suite to run (could be repeated, default: endpoints)')
+        parser.add_argument('--requests', type=int, default=100, help='number of requests per endpoint')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='number of concurrent workers (threads/in-flight requests) of load suites')
+        parser.add_argument('--output', help='write results to this file (default: stdout)')
+
+    def handle(self, *args, **options):
+        try:
+            results = benchmark.run(options['suite'] or ['endpoints'], options['requests'], options['workers'])
+        except ValueError as error:
+            raise CommandError(error)
+
+        report = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(report + '\n')
+            self.stdout.write(f"Results written to {options['output']}")
+        else:
+            self.stdout.write(report)
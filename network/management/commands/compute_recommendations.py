@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from network import recommendations
+
+
+class Command(BaseCommand):
+    help = 'Compute Who to Follow recommendations of all users (friends of friends)'
+
+    def handle(self, *args, **options):
+        graph = recommendations.load_graph()
+        total = recommendations.compute_all(graph)
+        self.stdout.write(
+            f'Computed {total} recommendation(s) from {graph.edges} follow(s)'
+            f' (graph: {graph.nbytes / 2 ** 20:.1f} MiB)'
+        )
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from network import hot
+
+
+class Command(BaseCommand):
+    help = 'Rescale hot scores of posts to now (run periodically, eg. daily from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Recompute scores from the times of likes (Like.created_at) instead (eg. after importing likes)',
+        )
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            self.stdout.write(f'Scored {hot.rebuild()} post(s)')
+        else:
+            self.stdout.write(f'Rescaled {hot.decay()} post(s)')
@@ -0,0 +1,99 @@
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from network import hot, search, timeline
+from network.counters import reconcile_counters
+from network.models import User, Post
+
+
+class Command(BaseCommand):
+    help = 'Generate a synthetic social graph (users, follows, posts and likes) for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='number of users to create')
+        parser.add_argument('--follows', type=int, default=30, help='average number of users each user follows')
+        parser.add_argument('--alpha', type=float, default=1.2,
+                            help='power-law exponent of followers distribution (higher: more skewed)')
+        parser.add_argument('--posts', type=int, default=10, help='number of posts per user')
+        parser.add_argument('--likes', type=float, default=3, help='average number of likes per post')
+        parser.add_argument('--prefix', default='bench', help='prefix of generated usernames')
+        parser.add_argument('--seed', type=int, default=0, help='random seed (same seed, same graph)')
+        parser.add_argument('--clear', action='store_true', help='delete users generated before (same prefix)')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        prefix = options['prefix']
+
+        with transaction.atomic():
+            if options['clear']:
+                User.objects.filter(username__startswith=f'{prefix}_').delete()
+
+            users = self.create_users(prefix, options['users'])
+            follows = self.create_follows(rng, users, options['follows'], options['alpha'])
+            posts = self.create_posts(users, options['posts'])
+            likes = self.create_likes(rng, users, posts, options['likes'])
+
+            reconcile_counters()
+            hot.rebuild()
+            timeline.rebuild(User.objects.filter(pk__in=users))
+            search.rebuild()
+
+        self.stdout.write(
+            f'Generated {len(users)} users, {follows} follows, {len(posts)} posts and {likes} likes'
+        )
+
+    def create_users(self, prefix, count):
+        # all generated users share the same (unusable) password hash
+        # hashing a password per user would take most of the time
+        password = make_password(None)
+        User.objects.bulk_create(
+            [User(username=f'{prefix}_{i}', password=password) for i in range(count)],
+            batch_size=500,
+        )
+        return list(
+            User.objects
+            .filter(username__startswith=f'{prefix}_')
+            .order_by('id')
+            .values_list('id', flat=True)
+        )
+
+    def create_follows(self, rng, users, average, alpha):
+        """Make each user follow some others where popular users get most followers
+
+        user of rank r is picked (as a friend) with probability proportional to 1 / r^alpha
+        so number of followers per user follows a power law (few celebrities, long tail)
+        """
+        weights = [1 / (rank ** alpha) for rank in range(1, len(users) + 1)]
+        Friends = User.friends.through
+        rows = []
+        for user_id in users:
+            count = min(len(users) - 1, max(0, round(rng.expovariate(1 / average)))) if average else 0
+            friends = set(rng.choices(users, weights=weights, k=count))
+            friends.discard(user_id)
+            rows.extend(Friends(from_user_id=user_id, to_user_id=friend_id) for friend_id in friends)
+        Friends.objects.bulk_create(rows, batch_size=1000, ignore_conflicts=True)
+        return len(rows)
+
+    def create_posts(self, users, per_user):
+        Post.objects.bulk_create(
+            [
+                Post(user_id=user_id, content=f'post #{i + 1} of user {user_id}')
+                for user_id in users
+                for i in range(per_user)
+            ],
+            batch_size=1000,
+        )
+        return list(Post.objects.filter(user__in=users).values_list('id', flat=True))
+
+    def create_likes(self, rng, users, posts, average):
+        """Like posts where likes per post follow a (long-tailed) geometric distribution"""
+        Likes = User.likes.through
+        rows = []
+        for post_id in posts:
+            count = min(len(users), int(rng.expovariate(1 / average))) if average else 0
+            rows.extend(Likes(user_id=user_id, post_id=post_id) for user_id in rng.sample(users, count))
+        Likes.objects.bulk_create(rows, batch_size=1000, ignore_conflicts=True)
+        return len(rows)
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from network import search
+from network.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Rebuild full-text search index of posts'
+
+    def handle(self, *args, **options):
+        search.rebuild()
+        self.stdout.write(f'Indexed {Post.objects.count()} post(s)')
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from network import tags
+from network.models import Tag, PostTag, Mention
+
+
+class Command(BaseCommand):
+    help = 'Extract tags and mentions of all posts again (and recount trending tags)'
+
+    def handle(self, *args, **options):
+        tags.rebuild()
+        self.stdout.write(
+            f'Indexed {PostTag.objects.count()} use(s) of {Tag.objects.count()} tag(s)'
+            f' and {Mention.objects.count()} mention(s)'
+        )
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from network import timeline
+from network.models import User
+
+
+class Command(BaseCommand):
+    help = 'Rebuild home timelines (Following feed) from friends/posts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help='only rebuild timelines of these users')
+
+    def handle(self, *args, **options):
+        users = User.objects.all()
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+        timeline.rebuild(users)
+        self.stdout.write(f'Rebuilt {users.count()} timeline(s)')
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from network.counters import reconcile_counters
+
+
+class Command(BaseCommand):
+    help = 'Recompute likes/followers/friends counters from through tables'
+
+    def handle(self, *args, **options):
+        fixed = reconcile_counters()
+        for field, count in fixed.items():
+            self.stdout.write(f'{field}: fixed {count} row(s)')
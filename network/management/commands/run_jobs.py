@@ -0,0 +1,63 @@
+import multiprocessing
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from network import jobs
+
+
+def _work(metrics_port, **options):
+    # (run in each worker process)
+    if metrics_port:
+        jobs.serve_metrics(metrics_port)
+    jobs.work(**options)
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs (network.jobs) using a pool of worker threads (or processes)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4, help='number of worker threads (per process)')
+        parser.add_argument('--processes', type=int, default=1, help='number of worker processes')
+        parser.add_argument('--poll', type=float, default=1.0, help='seconds to wait before checking for new jobs')
+        parser.add_argument('--once', action='store_true', help='exit once no job is due (instead of polling)')
+        parser.add_argument('--purge', action='store_true', help='delete jobs done more than a week ago first')
+        parser.add_argument('--metrics-port', type=int,
+                            help='serve job metrics (prometheus text format) on this port (process i uses port + i)')
+
+    def handle(self, *args, **options):
+        if options['purge']:
+            self.stdout.write(f'Purged {jobs.purge()} job(s)')
+
+        work = {'threads': options['threads'], 'poll': options['poll'], 'once': options['once']}
+        port = options['metrics_port']
+        if options['processes'] <= 1:
+            stop = threading.Event()
+            # finish running jobs then exit
+            signal.signal(signal.SIGTERM, lambda *args: stop.set())
+            try:
+                if port:
+                    jobs.serve_metrics(port)
+                count = jobs.work(stop=stop, **work)
+            except KeyboardInterrupt:
+                return
+            self.stdout.write(f'Ran {count} job(s)')
+            return
+
+        # forked processes mustn't share connections of parent
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        processes = [
+            context.Process(target=_work, args=(port + i if port else None,), kwargs=work)
+            for i in range(options['processes'])
+        ]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
@@ -0,0 +1,128 @@
+import bisect
+import hmac
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+
+# per-view request metrics (per process), exposed in prometheus text format
+# recorded by network.middleware.MetricsMiddleware
+# (and per-task job metrics recorded by workers, see network.jobs)
+
+# upper bounds of histogram buckets
+SECONDS_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5]
+COUNT_BUCKETS = [0, 1, 2, 3, 5, 10, 20, 50, 100]
+
+# background jobs wait for workers longer than requests take
+JOB_SECONDS_BUCKETS = [0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600]
+
+# metric name: (help, buckets, label)
+# label: what histograms of a metric are per (eg. view of requests)
+HISTOGRAMS = {
+    'network_request_duration_seconds': ('Wall time of requests', SECONDS_BUCKETS, 'view'),
+    'network_db_duration_seconds': ('Time spent running db queries per request', SECONDS_BUCKETS, 'view'),
+    'network_db_queries': ('Number of db queries per request', COUNT_BUCKETS, 'view'),
+    'network_db_duplicate_queries': ('Number of repeated db queries (same sql and params) per request', COUNT_BUCKETS, 'view'),
+    'network_template_render_seconds': ('Time spent rendering templates per request', SECONDS_BUCKETS, 'view'),
+    # recorded by workers (network.jobs)
+    'network_job_wait_seconds': ('Time jobs waited for a worker once due', JOB_SECONDS_BUCKETS, 'job'),
+    'network_job_duration_seconds': ('Time spent running jobs', JOB_SECONDS_BUCKETS, 'job'),
+}
+
+
+class Histogram:
+    """Cumulative histogram (counts of observed values <= each bucket bound)"""
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # one count per bucket, last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        total = 0
+        for count in self.counts:
+            total += count
+            yield total
+
+
+class Registry:
+    """Histograms of each metric per view (url name) or job (task name)"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = defaultdict(dict)
+
+    def observe(self, label, values):
+        """Record values (metric name: value) of a request to view (or a job)"""
+        with self._lock:
+            for name, value in values.items():
+                histogram = self.histograms[name].get(label)
+                if histogram is None:
+                    histogram = self.histograms[name][label] = Histogram(HISTOGRAMS[name][1])
+                histogram.observe(value)
+
+    def clear(self):
+        with self._lock:
+            self.histograms.clear()
+
+    def render(self):
+        """Return metrics in prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name, (help_text, buckets, label) in HISTOGRAMS.items():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for value, histogram in sorted(self.histograms[name].items()):
+                    labels = f'{label}="{_escape(value)}"'
+                    bounds = [_format(bound) for bound in buckets] + ['+Inf']
+                    for bound, count in zip(bounds, histogram.cumulative_counts()):
+                        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+                    lines.append(f'{name}_sum{{{labels}}} {_format(histogram.sum)}')
+                    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+
+        # (imported here to avoid a cycle: post cards are rendered through timed renders)
+        from .cache import card_stats
+        stats = card_stats.as_dict()
+        for kind in ['hits', 'misses']:
+            lines.append(f'# HELP network_post_card_cache_{kind}_total Post card fragment cache {kind}')
+            lines.append(f'# TYPE network_post_card_cache_{kind}_total counter')
+            lines.append(f'network_post_card_cache_{kind}_total {stats[kind]}')
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def has_token(authorization):
+    """Check an Authorization header against NETWORK_METRICS_TOKEN (scrapers send it as a bearer token)"""
+    token = getattr(settings, 'NETWORK_METRICS_TOKEN', None)
+    return bool(token) and hmac.compare_digest(authorization or '', f'Bearer {token}')
+
+
+def metrics(request):
+    """Metrics endpoint (only readable by staff users or with the metrics token)
+
+    client ips aren't trusted: behind a local proxy every request comes from 127.0.0.1
+    """
+    # jobs record their metrics into registry (imported here to avoid a cycle)
+    from .jobs import render_metrics as render_job_metrics
+
+    if not (request.user.is_staff or has_token(request.META.get('HTTP_AUTHORIZATION'))):
+        raise Http404()
+    return HttpResponse(registry.render() + render_job_metrics(), content_type=CONTENT_TYPE)
@@ -0,0 +1,342 @@
+import asyncio
+import contextvars
+import functools
+import gzip
+import random
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+
+try:
+    import brotli
+except ImportError:
+    # optional (pip install brotli), gzip only without it
+    brotli = None
+
+from django import shortcuts
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template import loader
+from django.utils.cache import patch_vary_headers
+
+from .metrics import registry
+from .replicas import RequestState, _state as _replica_state, is_pinned, pin
+
+
+# collector of the request being measured (None if request isn't sampled)
+_collector = contextvars.ContextVar('network_metrics_collector', default=None)
+
+
+class RequestCollector:
+    """Accumulate db and template timings of a single request"""
+    def __init__(self):
+        self.db_time = 0
+        self.queries = Counter()
+        self.template_time = 0
+        # queries of async views may run concurrently (in several threads)
+        self._lock = threading.Lock()
+
+    def record_query(self, sql, params, duration):
+        with self._lock:
+            self.db_time += duration
+            self.queries[(sql, repr(params))] += 1
+
+    def record_template(self, duration):
+        with self._lock:
+            self.template_time += duration
+
+    def values(self, duration):
+        count = sum(self.queries.values())
+        return {
+            'network_request_duration_seconds': duration,
+            'network_db_duration_seconds': self.db_time,
+            'network_db_queries': count,
+            'network_db_duplicate_queries': count - len(self.queries),
+            'network_template_render_seconds': self.template_time,
+        }
+
+
+def _record_query(execute, sql, params, many, context):
+    """Db execute wrapper timing queries of the request being measured
+
+    installed on every connection (of every thread) since async views
+    run queries in other threads (the collector follows them as a context var).
+    """
+    collector = _collector.get()
+    if collector is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        collector.record_query(sql, params, time.perf_counter() - started)
+
+def _instrument_connection(connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def timed_render(render):
+    """Time a template render function (eg. render, render_to_string) for the request being measured
+
+    views, streamed pages and post cards render through the timed ones below
+    (renders aren't nested in each other, so they're summed up).
+    """
+    @functools.wraps(render)
+    def wrapper(*args, **kwargs):
+        collector = _collector.get()
+        if collector is None:
+            return render(*args, **kwargs)
+
+        started = time.perf_counter()
+        try:
+            return render(*args, **kwargs)
+        finally:
+            collector.record_template(time.perf_counter() - started)
+    return wrapper
+
+render = timed_render(shortcuts.render)
+render_to_string = timed_render(loader.render_to_string)
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    return match.view_name
+
+
+class MetricsMiddleware:
+    """Record wall time, db time, queries and template render time per view
+
+    only a sample of requests is measured (NETWORK_METRICS_SAMPLE_RATE, 0..1)
+    so the overhead on other requests is a single random() call.
+    works for both sync and async requests (async views aren't forced into a thread).
+    streamed responses are recorded once their body is sent (rendering included).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # mark instance as a coroutine function (like django's MiddlewareMixin)
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+        # connections opened from now on and the ones already open (of this thread)
+        connection_created.connect(_instrument_connection)
+        for connection in connections.all():
+            _instrument_connection(connection)
+
+    def _sampled(self):
+        return random.random() < getattr(settings, 'NETWORK_METRICS_SAMPLE_RATE', 1)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not self._sampled():
+            return self.get_response(request)
+
+        collector = RequestCollector()
+        token = _collector.set(collector)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _collector.reset(token)
+
+        return self._observe(request, response, collector, started)
+
+    async def __acall__(self, request):
+        if not self._sampled():
+            return await self.get_response(request)
+
+        collector = RequestCollector()
+        token = _collector.set(collector)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _collector.reset(token)
+
+        return self._observe(request, response, collector, started)
+
+    def _observe(self, request, response, collector, started):
+        if not response.streaming:
+            registry.observe(_view_name(request), collector.values(time.perf_counter() - started))
+            return response
+        # streamed bodies are rendered once views returned (check: network/streaming.py)
+        # so keep collecting while chunks are produced and record once the stream ends
+        response.streaming_content = _collected(response.streaming_content, collector, started, _view_name(request))
+        return response
+
+
+def _collected(content, collector, started, view_name):
+    chunks = iter(content)
+    try:
+        while True:
+            token = _collector.set(collector)
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            finally:
+                _collector.reset(token)
+            yield chunk
+    finally:
+        registry.observe(view_name, collector.values(time.perf_counter() - started))
+
+
+class ReplicaPinMiddleware:
+    """Track db routing of each request (check: network/replicas.py)
+
+    clients whose requests wrote to the primary are pinned to it (a short-lived cookie)
+    so their next reads (eg. after a redirect) don't go to a lagging replica.
+    placed before session middleware so that session writes (eg. login) pin too.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        token = _replica_state.set(RequestState(is_pinned(request)))
+        try:
+            return pin(self.get_response(request))
+        finally:
+            _replica_state.reset(token)
+
+    async def __acall__(self, request):
+        token = _replica_state.set(RequestState(is_pinned(request)))
+        try:
+            return pin(await self.get_response(request))
+        finally:
+            _replica_state.reset(token)
+
+
+# responses worth compressing (html pages, cards fragments, json api, metrics)
+COMPRESSIBLE_TYPES = re.compile(r'^(text/|application/(json|javascript)|image/svg)')
+
+
+def _accepted_encodings(header):
+    """Codings accepted by client (Accept-Encoding without the ones refused using q=0)"""
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        q = params.strip().partition('=')[2] if params.strip().startswith('q=') else '1'
+        try:
+            if float(q) > 0:
+                accepted.add(coding.strip().lower())
+        except ValueError:
+            pass
+    return accepted
+
+
+class _Gzip:
+    encoding = 'gzip'
+
+    def __init__(self):
+        self.level = getattr(settings, 'NETWORK_GZIP_LEVEL', 6)
+
+    def compress(self, data):
+        # mtime=0: same content, same bytes (eg. for caches comparing bodies)
+        return gzip.compress(data, compresslevel=self.level, mtime=0)
+
+    def stream(self, chunks):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            # sync flush: client gets each chunk (eg. streamed layout head) right away
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+class _Brotli:
+    encoding = 'br'
+
+    def __init__(self):
+        self.quality = getattr(settings, 'NETWORK_BROTLI_QUALITY', 5)
+
+    def compress(self, data):
+        return brotli.compress(data, mode=brotli.MODE_TEXT, quality=self.quality)
+
+    def stream(self, chunks):
+        compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=self.quality)
+        for chunk in chunks:
+            yield compressor.process(chunk) + compressor.flush()
+        yield compressor.finish()
+
+
+class CompressionMiddleware:
+    """Compress responses using brotli (if installed and accepted) or gzip
+
+    tuned for pages of posts (very repetitive html, eg. a card per post):
+      - middle levels (NETWORK_GZIP_LEVEL, NETWORK_BROTLI_QUALITY) compress them
+        nearly as well as the highest ones at a fraction of the cpu
+      - small responses (NETWORK_COMPRESSION_MIN_SIZE bytes, eg. like buttons)
+        aren't worth it (headers and compressor setup cost more than they save)
+      - streamed pages are compressed chunk by chunk (each one flushed)
+    etags become weak (same content, different bytes per encoding)
+    which conditional requests (check: network/page_cache.py) still match.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return self.compress(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.compress(request, await self.get_response(request))
+
+    def _compressor(self, request):
+        accepted = _accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if brotli is not None and 'br' in accepted:
+            return _Brotli()
+        if 'gzip' in accepted:
+            return _Gzip()
+        return None
+
+    def compress(self, request, response):
+        if (
+            response.has_header('Content-Encoding')
+            or response.status_code in (204, 304)
+            or not COMPRESSIBLE_TYPES.match(response.get('Content-Type', ''))
+        ):
+            return response
+        if not response.streaming and len(response.content) < getattr(settings, 'NETWORK_COMPRESSION_MIN_SIZE', 512):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        compressor = self._compressor(request)
+        if compressor is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compressor.stream(response.streaming_content)
+            # length isn't known (and may have been set for uncompressed content)
+            del response['Content-Length']
+        else:
+            compressed = compressor.compress(response.content)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = compressor.encoding
+        return response
@@ -0,0 +1,61 @@
+# Generated by Django 3.2.8 on 2026-10-16 23:06
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+# (self-contained: migrations don't import app modules, which may change later)
+
+def _count_of(queryset, field):
+    # subquery counting rows of queryset related to outer row by field
+    return Coalesce(
+        Subquery(
+            queryset
+            .filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(count=Count('*'))
+            .values('count')
+        ),
+        0,
+    )
+
+def populate_counters(apps, schema_editor):
+    Post = apps.get_model('network', 'Post')
+    User = apps.get_model('network', 'User')
+    likes = User.likes.through.objects
+    friends = User.friends.through.objects
+
+    Post.objects.update(likes_count=_count_of(likes, 'post'))
+    # when foo follows bar: from_user=foo (follower), to_user=bar (friend)
+    User.objects.update(
+        followers_count=_count_of(friends, 'to_user'),
+        friends_count=_count_of(friends, 'from_user'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('network', '0005_auto_20211118_2036'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='friends_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.8 on 2026-10-16 23:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('network', '0008_timelineentry'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-created_at', '-id'], name='post_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='post_user_created_idx'),
+        ),
+        # reverse-direction (covering) indexes of auto-created through tables
+        # (they only have a unique index on (from, to) and single-column ones)
+        # followers of a user (eg. timeline fan-out)
+        migrations.RunSQL(
+            'CREATE INDEX network_user_friends_to_from_idx ON network_user_friends (to_user_id, from_user_id)',
+            'DROP INDEX network_user_friends_to_from_idx',
+        ),
+        # fans of a post (eg. counting likes)
+        migrations.RunSQL(
+            'CREATE INDEX network_user_likes_post_user_idx ON network_user_likes (post_id, user_id)',
+            'DROP INDEX network_user_likes_post_user_idx',
+        ),
+    ]
@@ -0,0 +1,48 @@
+from django.db import migrations
+
+
+# (self-contained: migrations don't import app modules, which may change later)
+# statements per vendor: (create, drop), other databases have no search index
+SQL = {
+    'sqlite': (
+        [
+            "CREATE VIRTUAL TABLE network_post_fts USING fts5(content, tokenize='porter unicode61')",
+            'INSERT INTO network_post_fts (rowid, content) SELECT id, content FROM network_post',
+        ],
+        ['DROP TABLE network_post_fts'],
+    ),
+    'postgresql': (
+        [
+            'CREATE TABLE network_post_search ('
+            '  post_id integer PRIMARY KEY REFERENCES network_post (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,'
+            '  document tsvector NOT NULL'
+            ')',
+            'CREATE INDEX network_post_search_document_idx ON network_post_search USING GIN (document)',
+            "INSERT INTO network_post_search (post_id, document) SELECT id, to_tsvector('english', content) FROM network_post",
+        ],
+        ['DROP TABLE network_post_search'],
+    ),
+}
+
+
+def create_search_index(apps, schema_editor):
+    create, drop = SQL.get(schema_editor.connection.vendor, ([], []))
+    for statement in create:
+        schema_editor.execute(statement)
+
+def drop_search_index(apps, schema_editor):
+    create, drop = SQL.get(schema_editor.connection.vendor, ([], []))
+    for statement in drop:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('network', '0009_feed_indexes'),
+    ]
+
+    operations = [
+        # full-text index of posts content (check: network/search.py)
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 3.2.8 on 2026-10-16 23:54
+
+import math
+import time
+
+from django.db import migrations, models
+
+
+# (self-contained: migrations don't import app modules, which may change later)
+# default half-life (6 hours) and min score of network/hot.py when this was written
+TAU = 6 * 60 * 60 / math.log(2)
+MIN_SCORE = 1e-6
+
+
+def populate_hot_scores(apps, schema_editor):
+    """Score posts as if all their likes were made when they were created (landmark: now)"""
+    Post = apps.get_model('network', 'Post')
+    HotLandmark = apps.get_model('network', 'HotLandmark')
+    now = time.time()
+    HotLandmark.objects.update_or_create(pk=1, defaults={'timestamp': now})
+    posts = []
+    for post in Post.objects.filter(likes_count__gt=0).only('id', 'likes_count', 'created_at').iterator():
+        post.hot_score = post.likes_count * math.exp((post.created_at.timestamp() - now) / TAU)
+        if post.hot_score >= MIN_SCORE:
+            posts.append(post)
+    Post.objects.bulk_update(posts, ['hot_score'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('network', '0011_tags'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HotLandmark',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.FloatField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='hot_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-hot_score', '-id'], name='post_hot_idx'),
+        ),
+        migrations.RunPython(populate_hot_scores, migrations.RunPython.noop),
+    ]
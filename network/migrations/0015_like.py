@@ -0,0 +1,86 @@
+# Generated by Django 3.2.8 on 2026-10-17 02:05
+
+import math
+import time
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+# (self-contained: migrations don't import app modules, which may change later)
+# default half-life (6 hours) and min score of network/hot.py when this was written
+TAU = 6 * 60 * 60 / math.log(2)
+MIN_SCORE = 1e-6
+
+
+def populate_like_times(apps, schema_editor):
+    """Date existing likes when their posts were created, then score posts from them (landmark: now)
+
+    (times of existing likes weren't stored, scores then only match what unliking removes)
+    """
+    Like = apps.get_model('network', 'Like')
+    Post = apps.get_model('network', 'Post')
+    HotLandmark = apps.get_model('network', 'HotLandmark')
+    Like.objects.update(created_at=models.Subquery(
+        Post.objects.filter(pk=models.OuterRef('post')).values('created_at')[:1]
+    ))
+
+    now = time.time()
+    HotLandmark.objects.update_or_create(pk=1, defaults={'timestamp': now})
+    Post.objects.exclude(hot_score=0).update(hot_score=0)
+    posts = []
+    for post in Post.objects.filter(likes_count__gt=0).only('id', 'likes_count', 'created_at').iterator():
+        post.hot_score = post.likes_count * math.exp((post.created_at.timestamp() - now) / TAU)
+        if post.hot_score >= MIN_SCORE:
+            posts.append(post)
+    Post.objects.bulk_update(posts, ['hot_score'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('network', '0014_jobs'),
+    ]
+
+    operations = [
+        # the auto-created through table of User.likes becomes Like (same table)
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='Like',
+                    fields=[
+                        ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='network.post')),
+                        ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='network.user')),
+                    ],
+                    options={
+                        'db_table': 'network_user_likes',
+                        'unique_together': {('user', 'post')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='user',
+                    name='likes',
+                    field=models.ManyToManyField(blank=True, related_name='fans', through='network.Like', to='network.Post'),
+                ),
+            ],
+            database_operations=[
+                # (re-added below, named within index name limits of models)
+                migrations.RunSQL(
+                    'DROP INDEX network_user_likes_post_user_idx',
+                    'CREATE INDEX network_user_likes_post_user_idx ON network_user_likes (post_id, user_id)',
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='like',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='like',
+            index=models.Index(fields=['post', 'user'], name='like_post_user_idx'),
+        ),
+        migrations.RunPython(populate_like_times, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.utils import timezone
 
 
 class User(AbstractUser):
@@ -8,7 +9,12 @@ class User(AbstractUser):
     friends = models.ManyToManyField('self', blank=True, symmetrical=False, related_name='followers')
 
     # keep track of posts liked by user
-    likes = models.ManyToManyField('Post', blank=True, related_name='fans')
+    likes = models.ManyToManyField('Post', blank=True, related_name='fans', through='Like')
+
+    # denormalized counters (kept in sync by network.actions)
+    # so that profiles don't have to count rows of friends through table
+    followers_count = models.PositiveIntegerField(default=0)
+    friends_count = models.PositiveIntegerField(default=0)
 
 class Post(models.Model):
     """Represent a new post that has a content, timestamps (created/updated)
@@ -19,9 +25,208 @@ class Post(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='posts')
 
+    # denormalized counter (kept in sync by network.actions)
+    # so that feeds don't have to count rows of likes through table per post
+    likes_count = models.PositiveIntegerField(default=0)
+
+    # time-decayed likes (kept in sync by network.actions, check: network/hot.py)
+    # so that Hot feed is a range read of an index instead of aggregating likes
+    hot_score = models.FloatField(default=0)
+
     class Meta:
         # return posts in reverse chronological order (ie. most recent first)
-        ordering = ['-created_at']
+        # id breaks ties between posts created at the same time
+        # so that pages (and cursors) are deterministic
+        ordering = ['-created_at', '-id']
+        indexes = [
+            # All Posts feed (ordered by most recent first)
+            models.Index(fields=['-created_at', '-id'], name='post_created_idx'),
+            # profile feed (posts of a user ordered by most recent first)
+            models.Index(fields=['user', '-created_at', '-id'], name='post_user_created_idx'),
+            # Hot feed (ordered by highest score first)
+            models.Index(fields=['-hot_score', '-id'], name='post_hot_idx'),
+        ]
 
     def __str__(self):
         return f'Post ({self.id}): {self.content[:50]}'
+
+class Like(models.Model):
+    """Represent a post liked by a user (through table of User.likes)
+
+    its time is kept so that unliking removes the weight the like added
+    to the hot score of the post (check: network/hot.py)
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        # table of the auto-created through table it replaced
+        db_table = 'network_user_likes'
+        unique_together = [['user', 'post']]
+        indexes = [
+            # fans of a post (eg. counting likes)
+            models.Index(fields=['post', 'user'], name='like_post_user_idx'),
+        ]
+
+    def __str__(self):
+        return f'Like ({self.user_id}): post {self.post_id}'
+
+class HotLandmark(models.Model):
+    """Time (unix timestamp) that hot scores of posts are relative to (single row)
+
+    check: network/hot.py
+    """
+    timestamp = models.FloatField()
+
+    def __str__(self):
+        return f'HotLandmark: {self.timestamp}'
+
+class TimelineEntry(models.Model):
+    """Represent a post in the home timeline (Following feed) of a user
+
+    entries are written when posts are created (fan-out on write)
+    so that reading the timeline doesn't need to join friends and posts.
+    check: network/timeline.py
+    """
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')
+    # copy of post.created_at (so that entries are ordered/trimmed without joining posts)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-created_at', '-post']
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'post'], name='unique_timeline_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['owner', '-created_at', '-post'], name='timeline_owner_created_idx'),
+        ]
+
+    def __str__(self):
+        return f'TimelineEntry ({self.owner_id}): post {self.post_id}'
+
+class Tag(models.Model):
+    """Represent a hashtag (#name) used by posts
+
+    check: network/tags.py
+    """
+    name = models.CharField(max_length=64, unique=True)
+    # number of uses within trending window (kept in sync by network.tags)
+    # so that trending tags are read from an index instead of counting uses
+    window_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # trending tags (most used first)
+            models.Index(fields=['-window_count', 'name'], name='tag_window_count_idx'),
+        ]
+
+    def __str__(self):
+        return f'#{self.name}'
+
+class PostTag(models.Model):
+    """Represent a tag used by a post (tag feeds are read from these rows)"""
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='post_tags')
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='post_tags')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['tag', 'post'], name='unique_post_tag'),
+        ]
+
+    def __str__(self):
+        return f'PostTag ({self.tag_id}): post {self.post_id}'
+
+class Mention(models.Model):
+    """Represent a user mentioned (@username) by a post"""
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='mentions')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='mentions')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'], name='unique_mention'),
+        ]
+
+    def __str__(self):
+        return f'Mention ({self.user_id}): post {self.post_id}'
+
+class TagCount(models.Model):
+    """Uses of a tag within a time bucket (trending tags sliding window)
+
+    buckets leaving the window are subtracted from tags window_count then deleted.
+    """
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='counts')
+    # bucket number (timestamp // bucket size)
+    bucket = models.PositiveIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['tag', 'bucket'], name='unique_tag_count'),
+        ]
+        indexes = [
+            # buckets leaving the window
+            models.Index(fields=['bucket'], name='tag_count_bucket_idx'),
+        ]
+
+    def __str__(self):
+        return f'TagCount ({self.tag_id}): {self.count} in bucket {self.bucket}'
+
+class Recommendation(models.Model):
+    """Represent a user recommended to another one (Who to Follow)
+
+    candidates are friends of user friends (ranked by how many of them follow candidate)
+    check: network/recommendations.py
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='recommendations')
+    candidate = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    # number of user friends following candidate
+    mutual_count = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'candidate'], name='unique_recommendation'),
+        ]
+        indexes = [
+            # recommendations of a user (best first)
+            models.Index(fields=['user', '-mutual_count', 'candidate'], name='recommendation_user_idx'),
+        ]
+
+    def __str__(self):
+        return f'Recommendation ({self.user_id}): user {self.candidate_id} ({self.mutual_count} mutual)'
+
+class Job(models.Model):
+    """Represent a background job (a task to run with json args)
+
+    check: network/jobs.py
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    name = models.CharField(max_length=100)
+    args = models.JSONField(default=list)
+    # idempotency key: jobs with the same key are enqueued once (null: no key)
+    key = models.CharField(max_length=200, unique=True, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    # job isn't run before this time (retries are delayed)
+    run_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # traceback of last failed attempt
+    error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            # due jobs (claimed by workers in order)
+            models.Index(fields=['status', 'run_at', 'id'], name='job_due_idx'),
+        ]
+
+    def __str__(self):
+        return f'Job ({self.name}): {self.status}'
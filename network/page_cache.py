@@ -0,0 +1,228 @@
+import asyncio
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+
+# whole-page cache for anonymous visitors
+# cached pages are keyed by (url, versions of the feeds shown on page)
+# and writes (new post, edit, like, follow...) bump versions of feeds they affect
+# so stale pages are never read again (they expire after a short timeout)
+#
+# feeds are identified by "scopes":
+#   'index': All Posts feed
+#   'profile:<username>': profile page of a user
+#   'timelines': Following feeds (bumped once new posts are pushed into timelines)
+#
+# versions are also validators of conditional GETs (ETag / Last-Modified)
+# so clients (and CDNs) revalidating an unchanged page get a 304 without it being queried or rendered.
+# that needs versions shared by all processes (eg. redis): bumps of other processes
+# (eg. fan-out jobs run by workers) never reach a process-local cache (eg. locmem)
+# whose versions would then never change (cached pages still expire after their timeout)
+
+
+# backends whose entries only the current process sees
+LOCAL_CACHES = (LocMemCache, DummyCache)
+
+
+def _cache():
+    alias = getattr(settings, 'NETWORK_PAGE_CACHE', 'default')
+    return caches[alias] if alias else None
+
+def _version_key(scope):
+    return f'feed-version:{scope}'
+
+def _new_version():
+    return time.time_ns()
+
+
+def get_versions(*scopes):
+    """Return current version of each scope (a timestamp in ns of its last change)"""
+    cache = _cache()
+    if cache is None:
+        return {}
+    keys = {_version_key(scope): scope for scope in scopes}
+    versions = cache.get_many(keys)
+
+    # unknown (or evicted) versions start now
+    missing = {key: _new_version() for key in keys if key not in versions}
+    if missing:
+        for key, version in missing.items():
+            if not cache.add(key, version, timeout=None):
+                version = cache.get(key, version)
+            versions[key] = version
+    return {scope: versions[key] for key, scope in keys.items()}
+
+def bump(*scopes):
+    """Mark scopes as changed (once current transaction commits)
+
+    bumping after commit makes sure a page rendered concurrently
+    (from data before commit) isn't cached under the new version.
+    """
+    cache = _cache()
+    if cache is None:
+        return
+    transaction.on_commit(lambda: cache.set_many(
+        {_version_key(scope): _new_version() for scope in scopes},
+        timeout=None,
+    ))
+
+
+def index_scopes(request, *args, **kwargs):
+    return ['index']
+
+def profile_scopes(request, username, *args, **kwargs):
+    return [f'profile:{username}']
+
+def following_scopes(request, *args, **kwargs):
+    # any post (or like) changes index, follows change profile of follower
+    # and new posts reach timelines later (fan-out jobs)
+    if not request.user.is_authenticated:
+        return []
+    return ['index', 'timelines', f'profile:{request.user.username}']
+
+
+def is_cacheable(request):
+    """Whether responses to request are cached (anonymous GET requests)"""
+    return _cache() is not None and request.method == 'GET' and not request.user.is_authenticated
+
+def _lookup(request, scopes_func, args, kwargs):
+    """Return (cache, key, cached response) of a request (cache is None if not cacheable)"""
+    if not is_cacheable(request):
+        return None, None, None
+    cache = _cache()
+
+    versions = get_versions(*scopes_func(request, *args, **kwargs))
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    key = 'page:' + ':'.join([path, *(str(v) for v in versions.values())])
+
+    cached = cache.get(key)
+    if cached is None:
+        return cache, key, None
+    content, content_type = cached
+    response = HttpResponse(content, content_type=content_type)
+    response['X-Page-Cache'] = 'hit'
+    return cache, key, response
+
+def _store(cache, key, response):
+    if response.status_code == 200 and not response.streaming:
+        cache.set(
+            key,
+            (response.content, response['Content-Type']),
+            timeout=getattr(settings, 'NETWORK_PAGE_CACHE_TIMEOUT', 30),
+        )
+        response['X-Page-Cache'] = 'miss'
+
+
+def cache_anonymous_page(scopes_func):
+    """Cache responses of a view (sync or async) for anonymous GET requests
+
+    scopes_func gets view args and returns scopes of feeds shown by the page.
+    """
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                # cache (and session) access is blocking
+                cache, key, cached = await sync_to_async(_lookup)(request, scopes_func, args, kwargs)
+                if cached is not None:
+                    return cached
+                response = await view(request, *args, **kwargs)
+                if cache is not None:
+                    await sync_to_async(_store)(cache, key, response)
+                return response
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            cache, key, cached = _lookup(request, scopes_func, args, kwargs)
+            if cached is not None:
+                return cached
+            response = view(request, *args, **kwargs)
+            if cache is not None:
+                _store(cache, key, response)
+            return response
+        return wrapper
+    return decorator
+
+
+def _validators(request, scopes_func, args, kwargs):
+    """Return (etag, last modified) of a page (None if it has no validators)
+
+    pages differ per user (liked posts, follow buttons), so etag includes current user
+    and last modified (which can't) is only sent to anonymous visitors.
+    pages have no validators unless versions are shared by all processes (check: LOCAL_CACHES).
+    pages of users embed their csrf token (forms of likes/edits/follows),
+    so etag includes it too (a page with a rotated token, eg. after logging in again, is stale).
+    """
+    if request.method not in ('GET', 'HEAD') or isinstance(_cache(), LOCAL_CACHES):
+        return None, None
+    scopes = scopes_func(request, *args, **kwargs)
+    versions = get_versions(*scopes) if scopes else {}
+    if not versions:
+        return None, None
+
+    if request.user.is_authenticated:
+        # (csrf cookie, created if it's missing like rendering the page would)
+        get_token(request)
+        user = f"{request.user.pk}:{request.META['CSRF_COOKIE']}"
+    else:
+        user = 'anonymous'
+    etag = hashlib.md5(':'.join([user, *(str(versions[scope]) for scope in scopes)]).encode()).hexdigest()
+    # http dates have a resolution of seconds
+    last_modified = None if request.user.is_authenticated else max(versions.values()) // 10 ** 9
+    return quote_etag(etag), last_modified
+
+def _set_validators(request, response, etag, last_modified):
+    if response.status_code not in (200, 304):
+        return response
+    response.headers.setdefault('ETag', etag)
+    if last_modified is not None and not response.has_header('Last-Modified'):
+        response['Last-Modified'] = http_date(last_modified)
+    # always revalidate (a 304 is cheap), never share pages of users
+    patch_cache_control(response, no_cache=True, private=request.user.is_authenticated)
+    return response
+
+
+def conditional_page(scopes_func):
+    """Answer conditional GET requests (If-None-Match / If-Modified-Since) of a view (sync or async)
+
+    validators are computed from versions of feeds shown by the page (see scopes_func)
+    so a 304 Not Modified costs a cache read (no db query or rendering).
+    """
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                # cache (and session) access is blocking
+                etag, last_modified = await sync_to_async(_validators)(request, scopes_func, args, kwargs)
+                if etag is None:
+                    return await view(request, *args, **kwargs)
+                response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                return _set_validators(request, response, etag, last_modified)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            etag, last_modified = _validators(request, scopes_func, args, kwargs)
+            if etag is None:
+                return view(request, *args, **kwargs)
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view(request, *args, **kwargs)
+            return _set_validators(request, response, etag, last_modified)
+        return wrapper
+    return decorator
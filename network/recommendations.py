@@ -0,0 +1,207 @@
+"""Who to Follow: recommend friends of friends
+
+candidates of a user are users followed by their friends (but not by them)
+ranked by how many of their friends follow each one (mutual count).
+recommendations are persisted per user (Recommendation rows) so that
+reading them is an index lookup:
+  - compute_all (manage.py compute_recommendations) computes them for all users
+    from the follow graph loaded once as compressed sparse rows (CSR): two flat
+    integer arrays, so a million follows take a few MBs instead of a python
+    object per follow, and only one user's candidates are counted at a time.
+  - follow/unfollow (network/actions.py) refresh them incrementally:
+    recommendations of follower are recomputed (a single 2-hop query)
+    and mutual counts of (un)followed user are updated for followers of follower
+    (their friends of friends changed too), then trimmed to NETWORK_RECOMMENDATIONS.
+"""
+import heapq
+from array import array
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery
+
+from .models import User, Recommendation
+from .sql import insert_or_add
+
+
+Friends = User.friends.through
+
+
+def recommendations_count():
+    """Max number of recommendations kept per user"""
+    return getattr(settings, 'NETWORK_RECOMMENDATIONS', 10)
+
+
+class Graph:
+    """Follow graph as compressed sparse rows
+
+    friends of user u are targets[offsets[u]:offsets[u + 1]] (sorted by id)
+    users are indexed by their id, so offsets has an entry per id (ids are mostly dense).
+    """
+    def __init__(self, offsets, targets):
+        self.offsets = offsets
+        self.targets = targets
+
+    def friends(self, user_id):
+        if user_id + 1 >= len(self.offsets):
+            return self.targets[:0]
+        return self.targets[self.offsets[user_id]:self.offsets[user_id + 1]]
+
+    @property
+    def edges(self):
+        return len(self.targets)
+
+    @property
+    def nbytes(self):
+        return self.offsets.itemsize * len(self.offsets) + self.targets.itemsize * len(self.targets)
+
+
+def load_graph(chunk_size=10000):
+    """Load follow graph (streamed from friends through table ordered by follower)"""
+    max_id = User.objects.aggregate(Max('id'))['id__max'] or 0
+    # degrees first (offsets[u + 1]), then turned into offsets by a running sum
+    offsets = array('q', bytes(8 * (max_id + 2)))
+    # ids are 32-bit (AutoField)
+    targets = array('i')
+    rows = (
+        Friends.objects
+        .order_by('from_user', 'to_user')
+        .values_list('from_user', 'to_user')
+        .iterator(chunk_size=chunk_size)
+    )
+    for from_user, to_user in rows:
+        offsets[from_user + 1] += 1
+        targets.append(to_user)
+    for i in range(1, len(offsets)):
+        offsets[i] += offsets[i - 1]
+    return Graph(offsets, targets)
+
+
+def _top(mutual, limit):
+    # most mutual first, lowest id breaks ties (same order as recommendation_user_idx)
+    return heapq.nsmallest(limit, mutual.items(), key=lambda item: (-item[1], item[0]))
+
+def candidates(graph, user_id, limit=None):
+    """Return best candidates of a user as (candidate id, mutual count)"""
+    friends = graph.friends(user_id)
+    excluded = set(friends)
+    excluded.add(user_id)
+    mutual = Counter()
+    for friend in friends:
+        for candidate in graph.friends(friend):
+            if candidate not in excluded:
+                mutual[candidate] += 1
+    return _top(mutual, limit or recommendations_count())
+
+
+def _save(user_ids, rows):
+    with transaction.atomic():
+        Recommendation.objects.filter(user__in=user_ids).delete()
+        Recommendation.objects.bulk_create(rows, batch_size=1000)
+
+def compute_all(graph=None, batch_size=500):
+    """Compute (and persist) recommendations of all users, return number of recommendations
+
+    users are written in batches so memory is bounded by graph and a batch of rows.
+    """
+    graph = graph or load_graph()
+    limit = recommendations_count()
+    user_ids, rows, total = [], [], 0
+    for user_id in User.objects.order_by('id').values_list('id', flat=True).iterator():
+        user_ids.append(user_id)
+        rows.extend(
+            Recommendation(user_id=user_id, candidate_id=candidate, mutual_count=count)
+            for candidate, count in candidates(graph, user_id, limit)
+        )
+        if len(user_ids) >= batch_size:
+            _save(user_ids, rows)
+            total += len(rows)
+            user_ids, rows = [], []
+    _save(user_ids, rows)
+    return total + len(rows)
+
+
+def refresh(user):
+    """Recompute recommendations of a user (from db, counting friends of friends in a single query)"""
+    friend_ids = Friends.objects.filter(from_user=user.id).values('to_user')
+    mutual = (
+        Friends.objects
+        .filter(from_user__in=friend_ids)
+        .exclude(to_user=user.id)
+        .exclude(to_user__in=friend_ids)
+        .values('to_user')
+        .annotate(mutual=Count('*'))
+        .order_by('-mutual', 'to_user')
+        .values_list('to_user', 'mutual')[:recommendations_count()]
+    )
+    _save([user.id], [
+        Recommendation(user_id=user.id, candidate_id=candidate, mutual_count=count)
+        for candidate, count in mutual
+    ])
+
+def _past_limit(user_ids):
+    """Ids of the first recommendation past recommendations_count of each user (null for users with fewer)
+
+    read through recommendation_user_idx in order (no sort), a short read per user
+    """
+    limit = recommendations_count()
+    first_past = (
+        Recommendation.objects.filter(user=OuterRef('pk'))
+        .order_by('-mutual_count', 'candidate_id').values('id')[limit:limit + 1]
+    )
+    return User.objects.filter(pk__in=user_ids).annotate(first_past=Subquery(first_past)).values('first_past')
+
+def trim(user_ids, chunk_size=500):
+    """Keep only the best (recommendations_count) recommendations of the given users"""
+    user_ids = list(user_ids)
+    for i in range(0, len(user_ids), chunk_size):
+        cutoffs = Recommendation.objects.filter(pk__in=_past_limit(user_ids[i:i + chunk_size]))
+        trimmed = Q()
+        for user_id, mutual_count, candidate_id in cutoffs.values_list('user', 'mutual_count', 'candidate'):
+            # first recommendation past the limit and worse ones
+            worse = Q(mutual_count__lt=mutual_count) | Q(mutual_count=mutual_count, candidate__gte=candidate_id)
+            trimmed |= Q(user=user_id) & worse
+        if trimmed:
+            Recommendation.objects.filter(trimmed).delete()
+
+def follows_changed(follower, deltas):
+    """Refresh recommendations after follower (un)followed users
+
+    deltas: {user: +1 (followed) or -1 (unfollowed)}
+    recommendations of follower are recomputed and, for followers of follower,
+    mutual counts of (un)followed users are incremented (inserted if missing)
+    or decremented (deleted when no friend follows them anymore).
+    only the top recommendations of each user are kept (inserts past them are trimmed)
+    so users whose count was cut off get a lower bound until the next compute_all.
+    """
+    refresh(follower)
+    followers = Friends.objects.filter(to_user=follower.id)
+    for user, delta in deltas.items():
+        if delta > 0:
+            # followers who don't follow user already (and aren't user)
+            ids = list(
+                followers
+                .exclude(from_user=user.id)
+                .exclude(from_user__in=Friends.objects.filter(to_user=user.id).values('from_user'))
+                .values_list('from_user', flat=True)
+            )
+            if ids:
+                insert_or_add(
+                    Recommendation,
+                    [{'user': pk, 'candidate': user.id, 'mutual_count': 1} for pk in ids],
+                    ['user', 'candidate'], 'mutual_count',
+                )
+                trim(ids)
+
+    unfollowed = [user.id for user, delta in deltas.items() if delta < 0]
+    if unfollowed:
+        recommended = Recommendation.objects.filter(user__in=followers.values('from_user'), candidate__in=unfollowed)
+        recommended.update(mutual_count=F('mutual_count') - 1)
+        # candidates no friend follows anymore
+        recommended.filter(mutual_count__lte=0).delete()
+
+
+def recommended_users(user):
+    """Recommendations of a user (best first) with their candidates"""
+    return user.recommendations.select_related('candidate').order_by('-mutual_count', 'candidate')[:recommendations_count()]
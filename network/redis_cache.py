@@ -0,0 +1,233 @@
+import pickle
+import socket
+import threading
+from urllib.parse import urlparse
+
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+
+class RedisError(Exception):
+    """Error reply of the server (eg. LOADING, OOM, READONLY)"""
+
+
+class RedisConnection:
+    """Minimal client of redis protocol (RESP) over a tcp socket"""
+    def __init__(self, host, port, db=0, timeout=None):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.reader = self.sock.makefile('rb')
+        if db:
+            self.execute('SELECT', db)
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+    @staticmethod
+    def _encode(args):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(parts)
+
+    def _read_reply(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError('connection closed by redis server')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode()
+        if kind == b'-':
+            # returned (not raised) so that replies after it are still read
+            return RedisError(rest.decode())
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length == -1:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(rest)
+            if length == -1:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        # out of sync with the server (drop the connection)
+        raise ConnectionError(f'unexpected reply: {line!r}')
+
+    def pipeline(self, commands):
+        """Send many commands at once then read their replies (in order)
+
+        raise the first error reply once all replies are read (connection stays usable)
+        """
+        self.sock.sendall(b''.join(self._encode(args) for args in commands))
+        replies = [self._read_reply() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    def execute(self, *args):
+        return self.pipeline([args])[0]
+
+
+class RedisCache(BaseCache):
+    """Django cache backend for redis (or any server speaking its protocol)
+
+    LOCATION: redis://host:port/db
+    integers are stored as-is (so that INCRBY works on them)
+    any other value is pickled.
+    if the server is unreachable (or slow, OPTIONS['SOCKET_TIMEOUT'] in seconds)
+    or replies with an error (eg. still loading, out of memory, read-only replica)
+    reads are misses and writes are dropped (like a cache that was cleared)
+    so that an outage doesn't break (or stall) pages using it.
+    """
+    def __init__(self, server, params):
+        super().__init__(params)
+        url = urlparse(server)
+        self._host = url.hostname or '127.0.0.1'
+        self._port = url.port or 6379
+        self._db = int(url.path.lstrip('/') or 0)
+        options = params.get('OPTIONS', {})
+        # (a host dropping packets would block requests forever without a timeout)
+        self._socket_timeout = options.get('SOCKET_TIMEOUT', 0.25)
+        self._close_connection = options.get('CLOSE_CONNECTION', False)
+        # one connection per thread
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = RedisConnection(self._host, self._port, self._db, self._socket_timeout)
+        return conn
+
+    def _pipeline(self, commands):
+        try:
+            return self._connection().pipeline(commands)
+        except (OSError, ConnectionError):
+            # drop broken connection (next call reconnects)
+            self._disconnect()
+            raise
+
+    def _execute(self, *args):
+        return self._pipeline([args])[0]
+
+    def _try_pipeline(self, commands, default):
+        """Same as _pipeline but return default if server is unreachable or replies with an error"""
+        try:
+            return self._pipeline(commands)
+        except (OSError, RedisError):
+            return default
+
+    def _try(self, default, *args):
+        return self._try_pipeline([args], [default])[0]
+
+    def _serialize(self, value):
+        if isinstance(value, int) and not isinstance(value, bool):
+            return str(value).encode()
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def _deserialize(self, value):
+        if value is None:
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            return pickle.loads(value)
+
+    def _expiry_args(self, timeout):
+        """Return SET args for timeout (or None if value should expire immediately)"""
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        if timeout is None:
+            return []
+        if timeout <= 0:
+            return None
+        return ['PX', int(timeout * 1000)]
+
+    def _set_command(self, key, value, timeout, *flags):
+        expiry = self._expiry_args(timeout)
+        if expiry is None:
+            return ['DEL', key]
+        return ['SET', key, self._serialize(value), *expiry, *flags]
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        command = self._set_command(self._key(key, version), value, timeout, 'NX')
+        if command[0] == 'DEL':
+            return False
+        return self._try(None, *command) == 'OK'
+
+    def get(self, key, default=None, version=None):
+        value = self._try(None, 'GET', self._key(key, version))
+        return default if value is None else self._deserialize(value)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._try(None, *self._set_command(self._key(key, version), value, timeout))
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        expiry = self._expiry_args(timeout)
+        if expiry is None:
+            return bool(self._try(0, 'DEL', key))
+        if not expiry:
+            return bool(self._try(0, 'PERSIST', key)) or self.has_key(key)
+        return bool(self._try(0, 'PEXPIRE', key, expiry[1]))
+
+    def delete(self, key, version=None):
+        return bool(self._try(0, 'DEL', self._key(key, version)))
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = self._try([], 'MGET', *[self._key(key, version) for key in keys])
+        return {
+            key: self._deserialize(value)
+            for key, value in zip(keys, values)
+            if value is not None
+        }
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        if data and self._try_pipeline([
+            self._set_command(self._key(key, version), value, timeout)
+            for key, value in data.items()
+        ], None) is None:
+            # keys that couldn't be set
+            return list(data)
+        return []
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        if keys:
+            self._try(0, 'DEL', *[self._key(key, version) for key in keys])
+
+    def has_key(self, key, version=None):
+        return bool(self._try(0, 'EXISTS', self._key(key, version)))
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        if not self._execute('EXISTS', key):
+            raise ValueError(f"Key '{key}' not found")
+        return self._execute('INCRBY', key, delta)
+
+    def clear(self):
+        self._execute('FLUSHDB')
+
+    def _disconnect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.conn = None
+            conn.close()
+
+    def close(self, **kwargs):
+        # called by django at the end of every request
+        # keep connections open (unless told otherwise) to avoid reconnecting per request
+        if self._close_connection:
+            self._disconnect()
@@ -0,0 +1,134 @@
+"""Read replicas (feed reads go to replicas, everything else to the primary)
+
+views decorated with @replica_reads run their reads of network models on a replica
+(one per request, picked from NETWORK_REPLICAS), writes always go to the primary
+(ReplicaRouter, check DATABASE_ROUTERS).
+replicas lag behind the primary, so clients that just wrote are pinned to the primary
+for NETWORK_REPLICA_PIN seconds (a cookie set by network.middleware.ReplicaPinMiddleware)
+and read their own writes (eg. their new post once create_post redirects to index).
+"""
+import asyncio
+import contextlib
+import contextvars
+import functools
+import random
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+# cookie of pinned clients (value: timestamp the pin ends at)
+PIN_COOKIE = 'network_primary'
+
+# apps whose reads may go to replicas
+# (others, eg. sessions, are always read from the primary)
+REPLICATED_APPS = {'network'}
+
+
+class RequestState:
+    """Db routing of the request being handled"""
+    def __init__(self, pinned=False):
+        # client wrote lately (reads go to the primary)
+        self.pinned = pinned
+        # alias reads go to (None: primary)
+        self.replica = None
+        # request wrote to the primary (client gets pinned)
+        self.wrote = False
+
+# mutated in place (not set again) so that async views running queries
+# in threads (with a copy of the context) share it
+_state = contextvars.ContextVar('network_replica_state', default=None)
+
+
+def replicas():
+    """Db aliases of replicas (empty: everything uses the primary)"""
+    return getattr(settings, 'NETWORK_REPLICAS', [])
+
+def pin_duration():
+    """Time (seconds) clients are pinned to the primary after writing (longer than replication lag)"""
+    return getattr(settings, 'NETWORK_REPLICA_PIN', 10)
+
+
+def is_pinned(request):
+    try:
+        return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+def pin(response):
+    """Pin client to the primary (if current request wrote)"""
+    state = _state.get()
+    if state is not None and state.wrote:
+        duration = pin_duration()
+        response.set_cookie(PIN_COOKIE, str(time.time() + duration), max_age=duration, httponly=True, samesite='Lax')
+    return response
+
+
+def current_state():
+    """Copy of routing of current request (None outside requests)"""
+    state = _state.get()
+    if state is None:
+        return None
+    copy = RequestState(state.pinned)
+    copy.replica = state.replica
+    return copy
+
+@contextlib.contextmanager
+def routing(state):
+    """Route queries as `state` (eg. rendering a streamed body once its view returned)"""
+    token = _state.set(state)
+    try:
+        yield
+    finally:
+        _state.reset(token)
+
+
+def _choose_replica(request):
+    state = _state.get()
+    if state is None or state.pinned or not replicas() or request.method not in ('GET', 'HEAD'):
+        return None
+    state.replica = random.choice(replicas())
+    return state
+
+def replica_reads(view):
+    """Read from a replica during view (unless client is pinned or request isn't a read)"""
+    if asyncio.iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            state = _choose_replica(request)
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                if state is not None:
+                    state.replica = None
+        return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        state = _choose_replica(request)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            if state is not None:
+                state.replica = None
+    return wrapper
+
+
+class ReplicaRouter:
+    """Route reads of @replica_reads views to their replica and all writes to the primary"""
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or state.replica is None or model._meta.app_label not in REPLICATED_APPS:
+            return None
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # databases are the primary and its replicas (same rows)
+        return True
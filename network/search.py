@@ -0,0 +1,114 @@
+"""Full-text search of posts
+
+posts content is kept in an inverted index next to posts table
+  - sqlite: an FTS5 virtual table (rowid = post id, words matched by their stem), ranked by bm25
+  - postgresql: a table of tsvector documents (with a GIN index), ranked by ts_rank
+(created by migrations, check: network/migrations/0010_post_search.py)
+create_post/edit_post (network/actions.py) index posts as they're written
+and deleted posts are dropped from index (network/signals.py).
+other databases fall back to scanning posts (icontains) without ranking.
+"""
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Value
+from django.db.models.expressions import RawSQL
+
+from .models import Post
+
+
+POSTS = Post._meta.db_table
+
+SQL = {
+    'sqlite': {
+        'index': 'INSERT OR REPLACE INTO network_post_fts (rowid, content) VALUES (%s, %s)',
+        'unindex': 'DELETE FROM network_post_fts WHERE rowid = %s',
+        'rebuild': [
+            'DELETE FROM network_post_fts',
+            f'INSERT INTO network_post_fts (rowid, content) SELECT id, content FROM {POSTS}',
+        ],
+        'matches': 'SELECT rowid FROM network_post_fts WHERE network_post_fts MATCH %s',
+        # bm25 is lower for better matches
+        'rank': (
+            'SELECT -bm25(network_post_fts) FROM network_post_fts'
+            f' WHERE network_post_fts MATCH %s AND rowid = {POSTS}.id'
+        ),
+    },
+    'postgresql': {
+        'index': (
+            "INSERT INTO network_post_search (post_id, document) VALUES (%s, to_tsvector('english', %s))"
+            ' ON CONFLICT (post_id) DO UPDATE SET document = EXCLUDED.document'
+        ),
+        'unindex': 'DELETE FROM network_post_search WHERE post_id = %s',
+        'rebuild': [
+            'DELETE FROM network_post_search',
+            f"INSERT INTO network_post_search (post_id, document) SELECT id, to_tsvector('english', content) FROM {POSTS}",
+        ],
+        'matches': "SELECT post_id FROM network_post_search WHERE document @@ websearch_to_tsquery('english', %s)",
+        'rank': (
+            "SELECT ts_rank(document, websearch_to_tsquery('english', %s)) FROM network_post_search"
+            f' WHERE post_id = {POSTS}.id'
+        ),
+    },
+}
+
+
+def _sql(vendor=None):
+    return SQL.get(vendor or connection.vendor)
+
+
+def index_post(post):
+    """Add a post to search index (or replace its indexed content)"""
+    sql = _sql()
+    if sql is None:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(sql['index'], [post.id, post.content])
+
+def unindex_post(post_id):
+    sql = _sql()
+    if sql is None:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(sql['unindex'], [post_id])
+
+def rebuild():
+    """Index all posts again (eg. after bulk-creating posts)"""
+    sql = _sql()
+    if sql is None:
+        return
+    with connection.cursor() as cursor:
+        for statement in sql['rebuild']:
+            cursor.execute(statement)
+
+
+def _fts5_query(query):
+    """Turn user input into an FTS5 query (so that its syntax never raises errors)
+
+    every word must match (implicit AND), last one as a prefix (eg. while typing)
+    """
+    words = re.findall(r'\w+', query)
+    if not words:
+        return None
+    return ' '.join([f'"{word}"' for word in words[:-1]] + [f'"{words[-1]}"*'])
+
+def search_posts(query):
+    """Return posts matching query annotated with their `rank` (higher is better)
+
+    use get_cursor_page(posts, cursor, key='rank') to paginate them by rank.
+    """
+    vendor = connection.vendor
+    sql = _sql(vendor)
+    unranked = Value(0.0, output_field=FloatField())
+    if sql is None:
+        return Post.objects.filter(content__icontains=query).annotate(rank=unranked)
+
+    if vendor == 'sqlite':
+        query = _fts5_query(query)
+        if query is None:
+            return Post.objects.none().annotate(rank=unranked)
+    return (
+        Post.objects
+        .filter(id__in=RawSQL(sql['matches'], [query]))
+        .annotate(rank=RawSQL(sql['rank'], [query], output_field=FloatField()))
+    )
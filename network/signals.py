@@ -0,0 +1,24 @@
+from django.db.models.signals import post_delete, pre_delete
+from django.dispatch import receiver
+
+from . import search, tags
+from .cache import evict_card
+from .models import Post
+
+
+@receiver(post_delete, sender=Post)
+def evict_deleted_post_card(sender, instance, **kwargs):
+    # posts could be deleted from anywhere (admin, cascades of deleted users)
+    # so handle it here instead of inside a view
+    evict_card(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_deleted_post(sender, instance, **kwargs):
+    search.unindex_post(instance.id)
+
+
+@receiver(pre_delete, sender=Post)
+def uncount_deleted_post_tags(sender, instance, **kwargs):
+    # before its tags (PostTag rows) are deleted by cascade
+    tags.unindex_post(instance)
@@ -0,0 +1,93 @@
+"""Single-statement writes that report what they changed
+
+plain orm writes (bulk_create(ignore_conflicts=True), delete(), update())
+only return row counts (if anything), these also return the written rows
+(using RETURNING) so callers know which rows changed without reading them again.
+they need sqlite 3.35+ or postgresql.
+writes go to the db routers pick for model (so that eg. clients writing get pinned to the primary).
+"""
+from django.db import connections, router
+from django.db.models.sql import DeleteQuery, UpdateQuery
+
+
+def _connection(model):
+    return connections[router.db_for_write(model)]
+
+def _quote(connection, name):
+    return connection.ops.quote_name(name)
+
+def _columns(connection, model, names):
+    return ', '.join(_quote(connection, model._meta.get_field(name).column) for name in names)
+
+def _convert(connection, model, names, rows):
+    """Convert returned values like querysets do (raw cursors don't, eg. sqlite returns datetimes as text)"""
+    columns = [model._meta.get_field(name).get_col(model._meta.db_table) for name in names]
+    converters = [connection.ops.get_db_converters(column) + column.get_db_converters(connection) for column in columns]
+    if not any(converters):
+        return rows
+    converted = []
+    for row in rows:
+        row = list(row)
+        for i, column in enumerate(columns):
+            for converter in converters[i]:
+                row[i] = converter(row[i], column, connection)
+        converted.append(tuple(row))
+    return converted
+
+
+def insert_ignore(model, rows, returning):
+    """Insert rows unless they already exist (relies on a unique constraint of model)
+
+    rows are dicts (field name: value)
+    return `returning` fields of inserted rows (ie. rows that didn't exist)
+    """
+    connection = _connection(model)
+    names = list(rows[0])
+    placeholders = ', '.join([f'({", ".join(["%s"] * len(names))})'] * len(rows))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {_quote(connection, model._meta.db_table)} ({_columns(connection, model, names)})'
+            f' VALUES {placeholders} ON CONFLICT DO NOTHING RETURNING {_columns(connection, model, returning)}',
+            [row[name] for row in rows for name in names],
+        )
+        return _convert(connection, model, returning, cursor.fetchall())
+
+def insert_or_add(model, rows, unique, field):
+    """Insert rows or, for rows that already exist (same `unique` fields), add to their `field`
+
+    (eg. increment counters of buckets, creating missing buckets)
+    """
+    connection = _connection(model)
+    names = list(rows[0])
+    table = _quote(connection, model._meta.db_table)
+    column = _quote(connection, model._meta.get_field(field).column)
+    placeholders = ', '.join([f'({", ".join(["%s"] * len(names))})'] * len(rows))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({_columns(connection, model, names)}) VALUES {placeholders}'
+            f' ON CONFLICT ({_columns(connection, model, unique)})'
+            f' DO UPDATE SET {column} = {table}.{column} + excluded.{column}',
+            [row[name] for row in rows for name in names],
+        )
+
+
+def _returning(query, queryset, returning):
+    # run a compiled (UPDATE/DELETE) query with a RETURNING clause
+    connection = _connection(queryset.model)
+    sql, params = query.get_compiler(connection=connection).as_sql()
+    with connection.cursor() as cursor:
+        cursor.execute(f'{sql} RETURNING {_columns(connection, queryset.model, returning)}', params)
+        return _convert(connection, queryset.model, returning, cursor.fetchall())
+
+def delete_returning(queryset, returning):
+    """Same as queryset.delete() but return `returning` fields of deleted rows
+
+    (no cascades or signals, meant for through tables and counters)
+    """
+    return _returning(queryset.query.chain(DeleteQuery), queryset, returning)
+
+def update_returning(queryset, returning, **values):
+    """Same as queryset.update(**values) but return `returning` fields of updated rows"""
+    query = queryset.query.chain(UpdateQuery)
+    query.add_update_values(values)
+    return _returning(query, queryset, returning)
@@ -33,35 +33,48 @@ function isSaveEditBtn(elm) {
 
 // when showing post editing view
 // textarea element must be pre-populated with current post content
+// (as text: content has links of tags and mentions)
 function prepopulateTextArea(postContentView, postContentEditingView) {
-    const currentContent = postContentView.querySelector('p').innerHTML;
+    const currentContent = postContentView.querySelector('p').textContent;
     postContentEditingView.querySelector('textarea').value = currentContent;
 }
 
+// post editing view is a copy of the edit form shared by posts (a template in page)
+// created when user starts editing a post (posts don't carry a hidden form each)
+function createEditPostForm() {
+    return document.querySelector('#edit-post-form').content.firstElementChild.cloneNode(true);
+}
+
 // show post editing form when user clicks edit button
-function showEditPostForm(postContentView, postContentEditingView) {
+function showEditPostForm(postContentDiv, postContentView) {
     // first: hide post content view
     postContentView.style.display = 'none';
 
-    // then: show post editing view
-    postContentEditingView.style.display = 'block';
+    // then: add post editing view (before content view)
+    const postContentEditingView = createEditPostForm();
+    postContentDiv.prepend(postContentEditingView);
 
     prepopulateTextArea(postContentView, postContentEditingView);
+    postContentEditingView.querySelector('textarea').focus();
 }
 
-// hide post editing form if user decides to cancel their edits
+// remove post editing form if user decides to cancel their edits
 // or after saving their changes by submitting them to server
-function hideEditPostForm(postContentView, postContentEditingView) {
-    // first: hide post editing view
-    postContentEditingView.style.display = 'none';
+function hideEditPostForm(postContentDiv, postContentView) {
+    // first: remove post editing view
+    const postContentEditingView = postContentDiv.querySelector('.edit-post-form');
+    if (postContentEditingView) {
+        postContentEditingView.remove();
+    }
 
     // then: show post content view
     postContentView.style.display = 'block';
 }
 
 // replace post content with updated content (from server response)
+// (raw text, so it's never parsed as html)
 function updatePostContent(postContentView, updatedContent) {
-    postContentView.querySelector('p').innerHTML = updatedContent;
+    postContentView.querySelector('p').textContent = updatedContent;
 }
 
 // replace post likes with updated likes (from server response)
@@ -72,12 +85,14 @@ function updatePostLikes(postLikesDiv, updatedLikes) {
 // ====== http helper functions ====== //
 
 // send an http request
-async function sendRequest(url, method='GET', headers={}, body=null) {
+// keepalive: let request outlive the page (eg. when sent while user leaves it)
+async function sendRequest(url, method='GET', headers={}, body=null, keepalive=false) {
     const reqHeaders = new Headers(headers)
     const reqConfig = {
         method: method,
         headers: reqHeaders,
-        body: body
+        body: body,
+        keepalive: keepalive
     }
     if (reqConfig.method == 'POST' || reqConfig.method == 'PUT') {
         const csrftoken = document.querySelector('[name=csrfmiddlewaretoken]').value;
@@ -120,85 +135,221 @@ async function sendRequest(url, method='GET', headers={}, body=null) {
 
 // when user save their edits
 // send a put request to server to update post content
-async function updatePost(postId, postContentView, postContentEditingView) {
+async function updatePost(postId, postContentDiv, postContentView) {
     // get changed content
-    const newContent = postContentEditingView.querySelector('textarea').value;
+    const newContent = postContentDiv.querySelector('.edit-post-form textarea').value;
 
     // send the request
     // TODO: add validation and error handling here
     // also, MUST DISPLAY A NOTIFICATION for user detailing
     // server response/reason for rejecting the request
     try {
-        const resBody = await sendRequest(`posts/${postId}/edit`, 'PUT', {}, JSON.stringify({ content: newContent }));
+        const resBody = await sendRequest(`/posts/${postId}/edit`, 'PUT', {}, JSON.stringify({ content: newContent }));
         updatePostContent(postContentView, resBody);
-        hideEditPostForm(postContentView, postContentEditingView);
+        hideEditPostForm(postContentDiv, postContentView);
     } catch (error) {
         console.log(`update_post | ERROR |`, error.message);
     }
 }
 
-// like post when user clicks like btn
-async function likePost(postId, postLikesDiv) {
+// ====== batched likes ====== //
+
+// like/unlike clicks aren't sent one request each
+// they're queued (only the last click on a post counts) and shown right away
+// then sent together in a single batch request once clicks stop for a while
+// (or when user leaves the page)
+const LIKES_BATCH_DELAY = 400;
+// post id => { liked (wanted state), original (state before clicks), postLikesDiv }
+const pendingLikes = new Map();
+let likesBatchTimer = null;
+
+// read like state shown in a post likes div
+function readPostLikes(postLikesDiv) {
+    return {
+        liked: postLikesDiv.querySelector('.unlike-post') !== null,
+        likes: parseInt(postLikesDiv.querySelector('span').textContent, 10)
+    };
+}
+
+// show like state in a post likes div (same markup as likes.html)
+function renderPostLikes(postLikesDiv, liked, likes) {
+    const button = liked
+        ? '<button class="unlike-post faheart faheart-red"><i class="fa-solid fa-heart"></i></button>'
+        : '<button class="like-post faheart"><i class="fa-regular fa-heart"></i></button>';
+    updatePostLikes(postLikesDiv, `${button}\n<span>${likes}</span>`);
+}
+
+// queue a like/unlike click (and show its result right away)
+function queueLike(postId, postLikesDiv, liked) {
+    const current = readPostLikes(postLikesDiv);
+    const original = pendingLikes.has(postId) ? pendingLikes.get(postId).original : current;
+    renderPostLikes(postLikesDiv, liked, Math.max(0, current.likes + (liked ? 1 : -1)));
+
+    if (liked === original.liked) {
+        // clicks cancelled each other (eg. like then unlike): nothing to send
+        pendingLikes.delete(postId);
+    } else {
+        pendingLikes.set(postId, { liked, original, postLikesDiv });
+    }
+
+    clearTimeout(likesBatchTimer);
+    likesBatchTimer = setTimeout(flushLikes, LIKES_BATCH_DELAY);
+}
+
+// send queued likes/unlikes in a single request
+// then show state (and likes count) sent by server
+async function flushLikes(keepalive=false) {
+    clearTimeout(likesBatchTimer);
+    if (pendingLikes.size === 0) {
+        return;
+    }
+    const batch = new Map(pendingLikes);
+    pendingLikes.clear();
+
+    const operations = Array.from(batch, ([postId, { liked }]) => ({ op: liked ? 'like' : 'unlike', post: Number(postId) }));
+    // posts clicked again while request is sent are left as they are
+    const restore = (postId, liked, likes) => {
+        if (!pendingLikes.has(postId)) {
+            renderPostLikes(batch.get(postId).postLikesDiv, liked, likes);
+        }
+    };
     try {
-        const resBody = await sendRequest(`/posts/${postId}/like`, 'POST');
-        updatePostLikes(postLikesDiv, resBody);
+        const resBody = await sendRequest('/api/v1/batch', 'POST', { 'Content-Type': 'application/json' }, JSON.stringify({ operations }), keepalive);
+        resBody.results.forEach(result => {
+            const postId = String(result.post);
+            if (result.error) {
+                const { original } = batch.get(postId);
+                restore(postId, original.liked, original.likes);
+            } else {
+                restore(postId, result.liked, result.likes);
+            }
+        });
     } catch (error) {
-        console.log('like_post', '|', error.message);
+        // nothing was saved: show state before clicks
+        batch.forEach(({ original }, postId) => restore(postId, original.liked, original.likes));
+        console.log('like_posts', '|', error.message);
+    }
+}
+
+// ====== posts setup ====== //
+
+// attach event handlers to a post div
+// (posts rendered with the page and posts appended later by infinite scroll)
+function setupPost(postDiv) {
+    const postId = postDiv.dataset.id;
+
+    const postLikesDiv = postDiv.querySelector('div.likes-container');
+
+    // post content container div has a content view: which include the actual content
+    // and, while its owner edits it, a content editing view: which include the editing form
+    // (added before content view, check: showEditPostForm)
+    const postContentDiv = postDiv.querySelector('.content-container');
+    const postContentView = postContentDiv.lastElementChild;
+
+    // attach an event handler for clicks at post div
+    // then check for the actual elm -inside post div- that triggered the click
+    // and perform the required/correct operation related to that elm
+    // this is done according to (event delegation) technique
+    // check: https://davidwalsh.name/event-delegate
+    postDiv.onclick = (event) => {
+        // const postDiv = event.currentTarget;
+        const clickedElement = event.target;
+
+        if (isLikeBtn(clickedElement)) {
+            queueLike(postId, postLikesDiv, true);
+        } else if (isUnlikeBtn(clickedElement)) {
+            queueLike(postId, postLikesDiv, false);
+        } else if (isEditBtn(clickedElement)) {
+            showEditPostForm(postContentDiv, postContentView);
+        } else if (isCancelEditBtn(clickedElement)) {
+            hideEditPostForm(postContentDiv, postContentView);
+        }
+    }
+
+    // handle editing form submission
+    // (form is added later, submit events bubble up to post div)
+    postDiv.onsubmit = (event) => {
+        if (event.target.matches('.edit-post-form')) {
+            updatePost(postId, postContentDiv, postContentView);
+        }
+
+        // disable default form submission behavior
+        return false;
     }
 }
 
-// unlike post when user clicks unlike btn
-async function unLikePost(postId, postLikesDiv) {
+// ====== infinite scroll ====== //
+
+// load the next batch of posts (html fragment) and append it to posts list
+// server sends cursor of the batch after it in X-Next-Cursor header
+async function loadMorePosts(loadMoreDiv, postsDiv) {
+    const url = `${loadMoreDiv.dataset.url}&cursor=${encodeURIComponent(loadMoreDiv.dataset.cursor)}`;
+
+    let res;
     try {
-        const resBody = await sendRequest(`/posts/${postId}/unlike`, 'POST');
-        updatePostLikes(postLikesDiv, resBody);
+        res = await fetch(url, { headers: { 'X-Requested-With': 'XMLHttpRequest' } });
     } catch (error) {
-        console.log('unlike_post', '|', error.message);
+        console.log('load_more_posts', '|', error.message);
+        return false;
     }
+    if (!res.ok) {
+        console.log('load_more_posts', '|', res.status);
+        return false;
+    }
+
+    // append new posts then setup only them
+    const html = await res.text();
+    const template = document.createElement('template');
+    template.innerHTML = html;
+    const newPosts = Array.from(template.content.querySelectorAll('.post'));
+    postsDiv.append(template.content);
+    newPosts.forEach(setupPost);
+
+    // no more posts: stop loading
+    const nextCursor = res.headers.get('X-Next-Cursor');
+    if (!nextCursor) {
+        return false;
+    }
+    loadMoreDiv.dataset.cursor = nextCursor;
+    return true;
 }
 
-document.addEventListener('DOMContentLoaded', () => {
-    document.querySelectorAll('.post').forEach(postDiv => {
-        const postId = postDiv.dataset.id;
-
-        const postLikesDiv = postDiv.querySelector('div.likes-container');
-
-        // post content container div has two views
-        // content view: which include the actual content
-        // content editing view: which include the editing form
-        const postContentDiv = postDiv.querySelector('.content-container');
-        const [postContentEditingView, postContentView] = Array.from(postContentDiv.children);
-        const postEditingForm = postContentEditingView.querySelector('form');
-
-        // editing view should be initially hidden
-        postContentEditingView.style.display = 'none';
-
-        // attach an event handler for clicks at post div
-        // then check for the actual elm -inside post div- that triggered the click
-        // and perform the required/correct operation related to that elm
-        // this is done according to (event delegation) technique
-        // check: https://davidwalsh.name/event-delegate
-        postDiv.onclick = (event) => {
-            // const postDiv = event.currentTarget;
-            const clickedElement = event.target;
-
-            if (isLikeBtn(clickedElement)) {
-                likePost(postId, postLikesDiv);
-            } else if (isUnlikeBtn(clickedElement)) {
-                unLikePost(postId, postLikesDiv);
-            } else if (isEditBtn(clickedElement)) {
-                showEditPostForm(postContentView, postContentEditingView);
-            } else if (isCancelEditBtn(clickedElement)) {
-                hideEditPostForm(postContentView, postContentEditingView);
-            }
-        }
+// load more posts whenever load-more div (at the end of posts list) becomes visible
+function setupInfiniteScroll() {
+    const loadMoreDiv = document.querySelector('.load-more');
+    const postsDiv = document.querySelector('.posts');
+    if (!loadMoreDiv || !postsDiv || !('IntersectionObserver' in window)) {
+        // keep pagination links
+        return;
+    }
 
-        // handle editing form submission
-        postEditingForm.onsubmit = () => {
-            updatePost(postId, postContentView, postContentEditingView);
+    // pages are now loaded as user scrolls
+    document.querySelector('.pagination-nav').style.display = 'none';
 
-            // disable default form submission behavior
-            return false;
+    let loading = false;
+    const observer = new IntersectionObserver(async (entries) => {
+        if (!entries.some(entry => entry.isIntersecting) || loading) {
+            return;
+        }
+        loading = true;
+        const hasMore = await loadMorePosts(loadMoreDiv, postsDiv);
+        loading = false;
+        if (!hasMore) {
+            observer.disconnect();
+            loadMoreDiv.remove();
         }
-    })
+    }, { rootMargin: '200px' });
+    observer.observe(loadMoreDiv);
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    document.querySelectorAll('.post').forEach(setupPost);
+    setupInfiniteScroll();
+});
+
+// don't lose queued likes when user leaves the page
+document.addEventListener('visibilitychange', () => {
+    if (document.visibilityState === 'hidden') {
+        flushLikes(true);
+    }
 });
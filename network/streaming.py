@@ -0,0 +1,52 @@
+"""Streaming rendering of feed pages (NETWORK_STREAM_PAGES)
+
+a page is sent in two chunks: the layout head (stylesheets, navbar)
+then the rest of the page (rendered with head_sent, check: templates/network/layout.html)
+so browsers fetch stylesheets while the feed is rendered.
+compressed responses flush each chunk (check: network.middleware.CompressionMiddleware).
+
+the feed query runs after the head is sent, only the requested page (number or cursor)
+is checked before (no query), so malformed ones are still 404s (the status is sent with the head)
+but a page number past the end is sent as an empty feed.
+anonymous pages that could be cached whole (network/page_cache.py) are never streamed.
+"""
+from django.conf import settings
+from django.http import Http404, StreamingHttpResponse
+
+from . import page_cache, replicas
+from .feeds import annotate_page
+from .middleware import render, render_to_string
+from .utils import CursorPage, get_request_page, is_valid_page_request
+
+
+HEAD_TEMPLATE = 'network/layout_head.html'
+
+
+def is_streamed(request):
+    return getattr(settings, 'NETWORK_STREAM_PAGES', False) and not page_cache.is_cacheable(request)
+
+
+def render_page(request, template_name, posts, context):
+    """Render a page of posts (the one requested, check: get_request_page) along with context
+
+    streamed (head first) or buffered (like render()) depending on NETWORK_STREAM_PAGES.
+    """
+    if not is_streamed(request):
+        page = get_request_page(request, posts)
+        if page is None:
+            raise Http404()
+        return render(request, template_name, {**context, 'page': annotate_page(page, request.user)})
+
+    if not is_valid_page_request(request, posts):
+        raise Http404()
+    # the view (and its db routing) is over once the body is rendered
+    state = replicas.current_state()
+
+    def chunks():
+        yield render_to_string(HEAD_TEMPLATE, request=request)
+        with replicas.routing(state):
+            page = get_request_page(request, posts) or CursorPage([])
+            annotate_page(page, request.user)
+            yield render_to_string(template_name, {**context, 'page': page, 'head_sent': True}, request=request)
+
+    return StreamingHttpResponse(chunks(), content_type='text/html; charset=utf-8')
@@ -0,0 +1,168 @@
+"""Hashtags (#tag) and mentions (@username) of posts
+
+create_post/edit_post (network/actions.py) extract them from posts content
+into PostTag/Mention rows (diffing old ones on edit), then tag feeds and
+mentions of a user are lookups of those rows instead of scanning posts content.
+
+trending tags count uses of each tag within a sliding window (last day):
+uses are added to hourly buckets (TagCount) and to Tag.window_count as posts
+are written, buckets leaving the window are subtracted then deleted
+by a job scheduled (once per bucket) for the time the bucket leaves the window,
+so reading trending tags is a read-only index scan of Tag.window_count.
+"""
+import datetime
+import re
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from . import jobs
+from .models import User, Post, Tag, PostTag, Mention, TagCount
+from .sql import delete_returning, insert_or_add
+
+
+# a tag has at least one letter (so that "post #1" isn't a tag)
+# and isn't part of a word, another tag or an html entity (eg. &#39;)
+TAG_RE = re.compile(r'(?<![\w#&])#(\w*[^\W\d_]\w*)')
+# usernames allow same characters as django (letters, digits and @.+-_)
+# but can't end with punctuation (eg. "thanks @foo.")
+MENTION_RE = re.compile(r'(?<![\w@])@([\w.+-]*\w)')
+
+TAG_MAX_LENGTH = Tag._meta.get_field('name').max_length
+
+
+def extract_tags(content):
+    """Return names of tags used in content (lowercase, so #Foo and #foo are the same tag)"""
+    return {name.lower() for name in TAG_RE.findall(content) if len(name) <= TAG_MAX_LENGTH}
+
+def extract_mentions(content):
+    """Return usernames mentioned in content (they may not exist)"""
+    return set(MENTION_RE.findall(content))
+
+
+def window():
+    """Length (seconds) of trending window"""
+    return getattr(settings, 'NETWORK_TRENDING_WINDOW', 24 * 60 * 60)
+
+def bucket_size():
+    """Length (seconds) of trending buckets (window moves a bucket at a time)"""
+    return getattr(settings, 'NETWORK_TRENDING_BUCKET', 60 * 60)
+
+def _bucket(timestamp):
+    return int(timestamp // bucket_size())
+
+def _oldest_bucket():
+    """First bucket still inside the window"""
+    return _bucket(time.time() - window()) + 1
+
+
+def _count(tag_ids, created_at, delta):
+    """Add (or remove) a use of tags by a post created at `created_at`"""
+    bucket = _bucket(created_at.timestamp())
+    # posts older than the window don't count
+    if not tag_ids or bucket < _oldest_bucket():
+        return
+    insert_or_add(TagCount, [{'tag': pk, 'bucket': bucket, 'count': delta} for pk in tag_ids], ['tag', 'bucket'], 'count')
+    Tag.objects.filter(pk__in=tag_ids).update(window_count=Greatest(F('window_count') + delta, 0))
+    if delta > 0:
+        _schedule_expiry(bucket)
+
+def _schedule_expiry(bucket):
+    """Enqueue expiry of trending counts for when bucket leaves the window (once per bucket)"""
+    expires = bucket * bucket_size() + window()
+    jobs.enqueue(
+        'tags.expire_trending', key=f'expire_trending:{bucket}',
+        run_at=datetime.datetime.fromtimestamp(expires, tz=timezone.utc),
+    )
+
+
+def _index_tags(post, created):
+    names = extract_tags(post.content)
+    current = {} if created else dict(post.post_tags.values_list('tag__name', 'tag'))
+
+    added = names - current.keys()
+    if added:
+        Tag.objects.bulk_create([Tag(name=name) for name in added], ignore_conflicts=True)
+        tag_ids = list(Tag.objects.filter(name__in=added).values_list('id', flat=True))
+        PostTag.objects.bulk_create([PostTag(post=post, tag_id=pk) for pk in tag_ids], ignore_conflicts=True)
+        _count(tag_ids, post.created_at, 1)
+
+    removed = [current[name] for name in current.keys() - names]
+    if removed:
+        PostTag.objects.filter(post=post, tag__in=removed).delete()
+        _count(removed, post.created_at, -1)
+
+def _index_mentions(post, created):
+    usernames = extract_mentions(post.content)
+    mentioned = set(User.objects.filter(username__in=usernames).values_list('id', flat=True)) if usernames else set()
+    current = set() if created else set(post.mentions.values_list('user', flat=True))
+
+    added = mentioned - current
+    if added:
+        Mention.objects.bulk_create([Mention(post=post, user_id=pk) for pk in added], ignore_conflicts=True)
+    removed = current - mentioned
+    if removed:
+        post.mentions.filter(user__in=removed).delete()
+
+def index_post(post, created=False):
+    """Update tags and mentions of a post from its content
+
+    created: post is new (so it has no tags or mentions yet, skip reading them)
+    """
+    with transaction.atomic():
+        _index_tags(post, created)
+        _index_mentions(post, created)
+
+def unindex_post(post):
+    """Remove uses of tags by a post (before deleting it) from trending counters"""
+    tag_ids = list(post.post_tags.values_list('tag', flat=True))
+    _count(tag_ids, post.created_at, -1)
+
+def rebuild():
+    """Extract tags and mentions of all posts again (eg. after bulk-creating posts)"""
+    with transaction.atomic():
+        PostTag.objects.all().delete()
+        Mention.objects.all().delete()
+        TagCount.objects.all().delete()
+        Tag.objects.update(window_count=0)
+        for post in Post.objects.only('id', 'content', 'created_at').iterator():
+            index_post(post, created=True)
+
+
+def expire_trending():
+    """Subtract buckets that left the window from tags window counts (then delete them)
+
+    run by jobs (check: _schedule_expiry) so that reads of trending tags never write
+    """
+    expired = TagCount.objects.filter(bucket__lt=_oldest_bucket())
+    # most of the time there's nothing to expire (don't write then)
+    if not expired.exists():
+        return
+    with transaction.atomic():
+        totals = Counter()
+        for tag, count in delete_returning(expired, ['tag', 'count']):
+            totals[tag] += count
+        totals = {tag: count for tag, count in totals.items() if count}
+        if totals:
+            Tag.objects.filter(pk__in=totals).update(window_count=Greatest(
+                F('window_count') - Case(*[When(pk=pk, then=Value(count)) for pk, count in totals.items()]),
+                0,
+            ))
+
+def trending_tags(limit=10):
+    """Most used tags within the trending window (annotated with uses as window_count)"""
+    return Tag.objects.filter(window_count__gt=0).order_by('-window_count', 'name')[:limit]
+
+
+def tag_posts(tag):
+    """Posts using a tag"""
+    return Post.objects.filter(pk__in=tag.post_tags.values('post'))
+
+def mentioned_posts(user):
+    """Posts mentioning a user"""
+    return Post.objects.filter(pk__in=user.mentions.values('post'))
@@ -0,0 +1,37 @@
+"""Tasks run by background jobs (check: network/jobs.py)
+
+jobs only carry json args, so tasks take ids and read what they need
+(targets may have been deleted before a job runs).
+tasks may run more than once (retries), so they must be idempotent.
+"""
+from . import page_cache, recommendations, tags, timeline
+from .jobs import task
+from .models import User, Post
+
+
+@task('timeline.fan_out')
+def fan_out(post_id):
+    """Push a new post into timelines of its author followers"""
+    post = Post.objects.select_related('user').filter(pk=post_id).first()
+    if post is not None:
+        timeline.fan_out(post)
+        # following feeds changed (only now, not when post was created)
+        page_cache.bump('timelines')
+
+
+@task('recommendations.follows_changed')
+def follows_changed(follower_id, deltas):
+    """Refresh recommendations after a user (un)followed users
+
+    deltas: [[user id, +1 (followed) or -1 (unfollowed)], ...]
+    """
+    users = User.objects.in_bulk([pk for pk, _ in deltas] + [follower_id])
+    follower = users.get(follower_id)
+    if follower is not None:
+        recommendations.follows_changed(follower, {users[pk]: delta for pk, delta in deltas if pk in users})
+
+
+@task('tags.expire_trending')
+def expire_trending():
+    """Subtract trending buckets that left the window (scheduled when buckets are first used)"""
+    tags.expire_trending()
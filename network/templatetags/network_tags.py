@@ -0,0 +1,31 @@
+from django import template
+from django.urls import reverse
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from network.tags import MENTION_RE, TAG_RE
+from network.utils import continuation_cursor
+
+
+register = template.Library()
+
+
+@register.filter
+def next_cursor(page):
+    """Cursor of posts after page (used by infinite scroll)"""
+    return continuation_cursor(page) or ''
+
+
+def _tag_link(match):
+    name = match.group(1)
+    return f'<a href="{reverse("tag", args=[name.lower()])}">#{name}</a>'
+
+def _mention_link(match):
+    username = match.group(1)
+    return f'<a href="{reverse("profile", args=[username])}">@{username}</a>'
+
+@register.filter
+def linkify(content):
+    """Escape post content then link its tags and mentions"""
+    content = TAG_RE.sub(_tag_link, escape(content))
+    return mark_safe(MENTION_RE.sub(_mention_link, content))
@@ -1,9 +1,35 @@
+import datetime
+import gzip
+import json
 import math
-
-from django.test import TestCase
-from django.db.models import Max
-
-from .models import User, Post
+import re
+import shutil
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+import unittest
+import zlib
+from io import StringIO
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db.models import F, Max
+from django.urls import resolve
+
+from accounts.forms import PROFILE_ROUTES
+
+from . import actions, benchmark, hot, jobs, middleware, page_cache, recommendations, replicas, tags, timeline
+from .cache import card_key, card_stats
+from .redis_cache import RedisCache
+from .utils import encode_cursor, keyset_filter
+from .metrics import registry
+from .models import User, Post, HotLandmark, Job, Like, Recommendation, Tag, TagCount, TimelineEntry
 
 
 # init some data
@@ -51,6 +77,24 @@ class UserSignupTests(TestCase):
         self.assertFalse(response.context['user'].is_authenticated)
         self.assertIn("A user with that username already exists.", str(response.context['form'].errors))
 
+    def test_signup_fails_username_reserved(self):
+        """Check that signup fails if profile of username would be shadowed by another page (eg. /following)"""
+        self.signup_form_fields['username'] = 'following'
+
+        response = self.client.post('/accounts/signup', self.signup_form_fields)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("This username is reserved.", str(response.context['form'].errors))
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_pages_dont_shadow_profiles(self):
+        """Check that users named like pages (eg. hot, tags) keep their profile and follow urls"""
+        for username in ['hot', 'search', 'mentions', 'tags', 'who-to-follow', 'metrics', 'posts', 'users', 'internal']:
+            user = User.objects.create_user(username=username, password=username)
+            for suffix, view_name in PROFILE_ROUTES.items():
+                self.assertEqual(resolve(f'/{username}{suffix}').view_name, view_name)
+            self.assertEqual(self.client.get(f'/{username}').context['user'], user)
+
     def test_signup_works(self):
         """Check that signup succeeds when user enters
         unqiue username, unqiue email and a correct password twice
@@ -139,6 +183,7 @@ class CreatePostTests(TestCase):
         posts_count_after = Post.objects.count()
         self.assertEqual(posts_count_after, posts_count_before + 1)
 
+@override_settings(NETWORK_STREAM_PAGES=False)
 class EditPostTests(TestCase):
     def setUp(self):
         """Add two users and a post to db"""
@@ -161,6 +206,28 @@ class EditPostTests(TestCase):
         # client: identify resources
         self.post_to_edit = p
 
+    def test_shared_edit_form(self):
+        """Check that pages send a single edit form (a template) instead of one per post"""
+        for i in range(5):
+            Post.objects.create(content=f'post #{i}', user=self.user_who_didnt_create_post)
+
+        # token of ajax requests sent once per page, even by pages without other forms
+        self.client.login(**self.login_credentials_of_user_who_created_post)
+        for url in ['/', '/following', f'/{self.user_who_created_post.username}']:
+            response = self.client.get(url)
+            self.assertContains(response, '<template id="edit-post-form">', count=1)
+            self.assertContains(response, 'class="edit-post-form"', count=1)
+            self.assertContains(response, 'name="csrfmiddlewaretoken"', count=1 if url != '/' else 2)
+        # cards (eg. loaded by infinite scroll) don't carry forms
+        response = self.client.get('/posts/cards')
+        self.assertNotContains(response, '<form')
+        self.assertContains(response, 'class="btn btn-primary btn-sm edit-post"', count=1)
+
+        self.client.logout()
+        response = self.client.get('/')
+        self.assertNotContains(response, 'edit-post-form')
+        self.assertNotContains(response, 'csrfmiddlewaretoken')
+
     def test_edit_post_fails_notloggedin(self):
         """Check that editing a post fails if current user isn't logged in"""
         new_content = "some new content"
@@ -205,6 +272,7 @@ class EditPostTests(TestCase):
         # POV: db
         self.assertEqual(Post.objects.get(pk=1).content, new_content)
 
+@override_settings(NETWORK_STREAM_PAGES=False)
 class UserProfile(TestCase):
     def setUp(self):
         """add a user and some posts in db"""
@@ -387,6 +455,7 @@ class FriendsPostsTests(TestCase):
         response = self.client.get('/following')
         self.assertEqual(response.status_code, 200)
 
+@override_settings(NETWORK_PAGE_CACHE=None, NETWORK_STREAM_PAGES=False)
 class PaginationTests(TestCase):
     def setUp(self):
         """add a new user and posts in db"""
@@ -564,3 +633,2205 @@ class PostLikesTests(TestCase):
 
         response = self.client.post(f'/posts/{self.id_of_post_to_unlike_that_exists}/unlike', HTTP_REFERER='http://testserver/', follow=True)
         self.assertEqual(response.status_code, 200)
+
+@override_settings(NETWORK_PAGE_CACHE=None, NETWORK_STREAM_PAGES=False)
+class LikedStateTests(TestCase):
+    def setUp(self):
+        """Create a user who liked some posts (out of many)"""
+        foo = User.objects.create_user(**foo_credentials)
+        bar = User.objects.create_user(**bar_credentials)
+
+        for i in range(15):
+            Post.objects.create(content=f'post #{i + 1}', user=bar)
+
+        # like the most recent post (on 1st page) and the oldest one (on 2nd page)
+        self.liked_post = Post.objects.first()
+        self.liked_post_on_other_page = Post.objects.last()
+        foo.likes.add(self.liked_post, self.liked_post_on_other_page)
+
+        self.login_credentials_of_user_who_liked_posts = foo_credentials
+
+    def test_liked_state_attached_to_page_posts(self):
+        """Check that each post in page knows whether current user liked it"""
+        self.client.login(**self.login_credentials_of_user_who_liked_posts)
+
+        response = self.client.get('/')
+
+        self.assertEqual(response.status_code, 200)
+        liked = {post.id for post in response.context['page'] if post.is_liked}
+        self.assertEqual(liked, {self.liked_post.id})
+
+    def test_liked_state_notloggedin(self):
+        """Check that anonymous users see no post as liked"""
+        response = self.client.get('/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(any(post.is_liked for post in response.context['page']))
+
+    def test_like_post_response_shows_unlike_btn(self):
+        """Check that like response renders an unlike button (and vice versa)"""
+        self.client.login(**self.login_credentials_of_user_who_liked_posts)
+        post_to_like = Post.objects.all()[1]
+
+        response = self.client.post(f'/posts/{post_to_like.id}/like')
+        self.assertContains(response, 'unlike-post')
+
+        response = self.client.post(f'/posts/{post_to_like.id}/unlike')
+        self.assertNotContains(response, 'unlike-post')
+        self.assertContains(response, 'like-post')
+
+class CountersTests(TestCase):
+    def setUp(self):
+        """Create some users and a post"""
+        foo = User.objects.create_user(**foo_credentials)
+        bar = User.objects.create_user(**bar_credentials)
+
+        self.post = Post.objects.create(content=post['content'], user=bar)
+
+        self.follower = foo
+        self.login_credentials_of_follower = foo_credentials
+        self.user_to_follow = bar
+
+    def test_like_unlike_update_likes_count(self):
+        """Check that liking/unliking a post updates its stored likes count"""
+        self.client.login(**self.login_credentials_of_follower)
+
+        response = self.client.post(f'/posts/{self.post.id}/like')
+        self.assertContains(response, '<span>1</span>')
+        self.assertEqual(Post.objects.get(pk=self.post.id).likes_count, 1)
+
+        response = self.client.post(f'/posts/{self.post.id}/unlike')
+        self.assertContains(response, '<span>0</span>')
+        self.assertEqual(Post.objects.get(pk=self.post.id).likes_count, 0)
+
+    def test_follow_unfollow_update_counts(self):
+        """Check that following/unfollowing updates stored friends/followers counts"""
+        self.client.login(**self.login_credentials_of_follower)
+
+        self.client.post(f'/{self.user_to_follow.username}/follow')
+        self.assertEqual(User.objects.get(pk=self.follower.id).friends_count, 1)
+        self.assertEqual(User.objects.get(pk=self.user_to_follow.id).followers_count, 1)
+
+        response = self.client.get(f'/{self.user_to_follow.username}')
+        self.assertContains(response, 'Followers: 1')
+
+        self.client.post(f'/{self.user_to_follow.username}/unfollow')
+        self.assertEqual(User.objects.get(pk=self.follower.id).friends_count, 0)
+        self.assertEqual(User.objects.get(pk=self.user_to_follow.id).followers_count, 0)
+
+    def test_reconcile_counters_command(self):
+        """Check that counters that drifted from relations get fixed"""
+        # change relations directly (ie. without updating counters)
+        self.follower.friends.add(self.user_to_follow)
+        self.follower.likes.add(self.post)
+        Post.objects.filter(pk=self.post.id).update(likes_count=7)
+
+        call_command('reconcile_counters', stdout=StringIO())
+
+        self.assertEqual(Post.objects.get(pk=self.post.id).likes_count, 1)
+        self.assertEqual(User.objects.get(pk=self.follower.id).friends_count, 1)
+        self.assertEqual(User.objects.get(pk=self.follower.id).followers_count, 0)
+        self.assertEqual(User.objects.get(pk=self.user_to_follow.id).followers_count, 1)
+
+@override_settings(NETWORK_PAGE_CACHE=None, NETWORK_STREAM_PAGES=False)
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        """add a new user and posts in db"""
+        user = User.objects.create_user(**foo_credentials)
+
+        self.posts_to_add = [f'post #{i + 1}' for i in range(55)]
+        for post_content in self.posts_to_add:
+            Post.objects.create(content=post_content, user=user)
+
+        self.page_size = 10
+
+    def test_cursor_pagination_first_page(self):
+        """Check that first page has most recent posts, a next cursor and no previous cursor"""
+        response = self.client.get('/?cursor=')
+
+        self.assertEqual(response.status_code, 200)
+        page = response.context['page']
+        self.assertEqual([p.id for p in page], list(Post.objects.values_list('id', flat=True)[:self.page_size]))
+        self.assertTrue(page.has_next())
+        self.assertFalse(page.has_previous())
+        self.assertContains(response, f'?cursor={page.next_cursor}')
+
+    def test_cursor_pagination_walks_all_posts(self):
+        """Check that following next cursors visits every post exactly once (in order)"""
+        seen = []
+        cursor = ''
+        while True:
+            response = self.client.get('/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 200)
+            page = response.context['page']
+            seen.extend(p.id for p in page)
+            if not page.has_next():
+                break
+            cursor = page.next_cursor
+
+        self.assertEqual(seen, list(Post.objects.values_list('id', flat=True)))
+
+    def test_cursor_pagination_previous_page(self):
+        """Check that previous cursor points back to the page we came from"""
+        first_page = self.client.get('/?cursor=').context['page']
+        second_page = self.client.get('/', {'cursor': first_page.next_cursor}).context['page']
+
+        response = self.client.get('/', {'cursor': second_page.previous_cursor})
+
+        self.assertEqual([p.id for p in response.context['page']], [p.id for p in first_page])
+
+    def test_cursor_pagination_no_count_query(self):
+        """Check that cursor pagination doesn't count all posts"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/?cursor=')
+
+        self.assertEqual(len(response.context['page']), self.page_size)
+        self.assertFalse(any('COUNT(' in q['sql'].upper() for q in queries.captured_queries))
+
+    def test_cursor_pagination_invalid_cursor(self):
+        """Check that a malformed cursor gives a 404 (like a wrong page number)"""
+        response = self.client.get('/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_pagination_invalid_key_value(self):
+        """Check that cursors with a key value of the wrong type give a 404 (not a 500)"""
+        urls = ['/', '/foo', '/following', '/posts/cards?feed=index', '/api/v1/posts', '/posts/hot', '/posts/cards?feed=hot']
+        self.client.login(**foo_credentials)
+        for key_value in ['not-a-date', '', None, [1], {'a': 1}, 1.5]:
+            cursor = encode_cursor('n', key_value, 1)
+            for url in urls:
+                with self.subTest(url=url, key_value=key_value):
+                    separator = '&' if '?' in url else '?'
+                    response = self.client.get(f'{url}{separator}cursor={cursor}')
+                    if url.endswith('hot') and isinstance(key_value, float):
+                        # a valid score
+                        self.assertEqual(response.status_code, 200)
+                    else:
+                        self.assertEqual(response.status_code, 404)
+
+    @override_settings(NETWORK_PAGINATION='cursor')
+    def test_cursor_pagination_enabled_by_setting(self):
+        """Check that feeds use cursor pagination when enabled project-wide"""
+        response = self.client.get('/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(response.context['page'].next_cursor)
+
+# more followers than the (default) celebrity threshold
+celebrity_followers = 20000
+
+@override_settings(NETWORK_STREAM_PAGES=False)
+class TimelineTests(TestCase):
+    def setUp(self):
+        """Create some users where foo follows bar (using the app)"""
+        foo = User.objects.create_user(**foo_credentials)
+        bar = User.objects.create_user(**bar_credentials)
+        baz = User.objects.create_user(**baz_credentials)
+
+        # bar posted before foo followed them
+        self.older_post = Post.objects.create(content='older post', user=bar)
+
+        self.client.login(**foo_credentials)
+        self.client.post(f'/{bar.username}/follow')
+
+        self.follower = foo
+        self.user_followed = bar
+        self.login_credentials_of_user_followed = bar_credentials
+        self.user_not_followed = baz
+        self.login_credentials_of_user_not_followed = baz_credentials
+
+    def following_feed(self):
+        self.client.login(**foo_credentials)
+        response = self.client.get('/following')
+        self.assertEqual(response.status_code, 200)
+        return [p.content for p in response.context['page']]
+
+    def create_post(self, login_credentials, content):
+        self.client.login(**login_credentials)
+        # (fan-out runs once post is committed)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/posts/create', {'content': content})
+
+    def test_follow_backfills_timeline(self):
+        """Check that posts created before following appear in timeline"""
+        self.assertEqual(self.following_feed(), ['older post'])
+
+    def test_create_post_fans_out_to_followers(self):
+        """Check that a new post is pushed into timelines of its author followers only"""
+        self.create_post(self.login_credentials_of_user_followed, 'new post')
+        self.create_post(self.login_credentials_of_user_not_followed, 'unrelated post')
+
+        self.assertEqual(self.following_feed(), ['new post', 'older post'])
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.user_not_followed).exists())
+
+    def test_unfollow_removes_posts_from_timeline(self):
+        """Check that posts of unfollowed users disappear from timeline"""
+        self.client.post(f'/{self.user_followed.username}/unfollow')
+
+        self.assertEqual(self.following_feed(), [])
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.follower).exists())
+
+    @override_settings(NETWORK_TIMELINE_LENGTH=3)
+    def test_timeline_is_trimmed(self):
+        """Check that only the most recent posts are kept in timelines"""
+        for i in range(5):
+            self.create_post(self.login_credentials_of_user_followed, f'post #{i + 1}')
+
+        self.assertEqual(TimelineEntry.objects.filter(owner=self.follower).count(), 3)
+        self.assertEqual(self.following_feed(), ['post #5', 'post #4', 'post #3'])
+
+        # timelines within the length aren't written to
+        with CaptureQueriesContext(connection) as captured:
+            timeline.trim([self.follower.id, self.user_not_followed.id])
+        self.assertFalse([q for q in captured.captured_queries if q['sql'].startswith('DELETE')])
+
+    @override_settings(NETWORK_TIMELINE_CELEBRITY_THRESHOLD=0)
+    def test_celebrity_posts_pulled_at_read(self):
+        """Check that posts of celebrities aren't pushed but still appear in timeline"""
+        self.create_post(self.login_credentials_of_user_followed, 'celebrity post')
+
+        self.assertFalse(TimelineEntry.objects.filter(post__content='celebrity post').exists())
+        self.assertEqual(self.following_feed(), ['celebrity post', 'older post'])
+
+    def test_pushed_and_pulled_posts_are_merged_across_pages(self):
+        """Check that every page (page-number or cursor) merges timeline entries and celebrity posts in order"""
+        User.objects.filter(pk=self.user_not_followed.id).update(followers_count=celebrity_followers)
+        self.client.post(f'/{self.user_not_followed.username}/follow')
+        authors = [self.user_followed, self.user_not_followed]
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(24):
+                actions.create_post(authors[(i // 3) % 2], f'post #{i + 1}')
+
+        expected = [f'post #{i}' for i in range(24, 0, -1)] + ['older post']
+        self.assertFalse(TimelineEntry.objects.filter(post__user=self.user_not_followed).exists())
+
+        self.client.login(**foo_credentials)
+        pages = [self.client.get('/following', {'page': number}).context['page'] for number in [1, 2, 3]]
+        self.assertEqual(pages[0].paginator.count, len(expected))
+        self.assertEqual([p.content for page in pages for p in page], expected)
+
+        seen, cursor = [], ''
+        while cursor is not None:
+            page = self.client.get('/following', {'cursor': cursor}).context['page']
+            seen.extend(p.content for p in page)
+            cursor = page.next_cursor
+        self.assertEqual(seen, expected)
+
+        previous = self.client.get('/following', {'cursor': page.previous_cursor}).context['page']
+        self.assertEqual([p.content for p in previous], expected[10:20])
+
+    def test_rebuild_timelines_command(self):
+        """Check that timelines can be rebuilt from friends/posts"""
+        TimelineEntry.objects.all().delete()
+
+        call_command('rebuild_timelines', stdout=StringIO())
+
+        self.assertEqual(self.following_feed(), ['older post'])
+
+class QueryPlanTests(TestCase):
+    """Check (using EXPLAIN) that feeds queries are served by indexes"""
+    def setUp(self):
+        foo = User.objects.create_user(**foo_credentials)
+        bar = User.objects.create_user(**bar_credentials)
+        foo.friends.add(bar)
+        Post.objects.create(content=post['content'], user=bar)
+
+        self.follower = foo
+        self.user_followed = bar
+
+    def explain(self, queryset):
+        if connection.vendor == 'postgresql':
+            # tiny test tables are cheaper to scan than to search
+            # so tell planner to avoid sequential scans whenever it can
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain()
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = self.explain(queryset)
+        self.assertIn(index_name, plan)
+
+    def assertNoFullScan(self, queryset):
+        plan = self.explain(queryset)
+        if connection.vendor == 'postgresql':
+            self.assertNotIn('Seq Scan', plan)
+        else:
+            # sqlite reports full table scans as "SCAN <table>" (without an index)
+            for line in plan.splitlines():
+                if ' SCAN ' in f' {line} ':
+                    self.assertIn('INDEX', line)
+
+    def test_index_feed_uses_created_index(self):
+        """All Posts feed: ORDER BY created_at DESC, id DESC LIMIT n"""
+        self.assertUsesIndex(Post.objects.all()[:11], 'post_created_idx')
+
+    def test_profile_feed_uses_user_created_index(self):
+        """profile feed: WHERE user_id = ? ORDER BY created_at DESC, id DESC LIMIT n"""
+        self.assertUsesIndex(self.user_followed.posts.all()[:11], 'post_user_created_idx')
+
+    def test_next_page_searches_index(self):
+        """pages after the first: (created_at, id) < (?, ?) is a range search (not a scan of the index)"""
+        rest = keyset_filter('n', 'created_at', datetime.datetime.now(datetime.timezone.utc), 1)
+        queryset = Post.objects.filter(rest)[:11]
+        self.assertUsesIndex(queryset, 'post_created_idx')
+        if connection.vendor == 'sqlite':
+            self.assertIn('SEARCH', self.explain(queryset))
+        self.assertNoFullScan(queryset)
+
+    def test_following_feed_uses_indexes(self):
+        """Following feed: timeline entries of user (and celebrities they follow)"""
+        User.objects.filter(pk=self.user_followed.id).update(followers_count=celebrity_followers)
+        pushed, pulled = timeline.timeline_posts(self.follower).ordered_sources()
+        self.assertUsesIndex(pushed[:11], 'timeline_owner_created_idx')
+        self.assertNoFullScan(pushed[:11])
+        self.assertNoFullScan(pulled[:11])
+
+    def test_following_feed_reads_timeline_in_index_order(self):
+        """Following feed pages: entries are read in index order (not gathered then sorted)"""
+        posts = timeline.timeline_posts(self.follower).values('id', 'content')
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for direction in ['n', 'p']:
+            for pushed in [posts.ordered_sources(direction)[0], posts.ordered_sources(direction, now, 1)[0]]:
+                plan = self.explain(pushed[:11])
+                self.assertIn('timeline_owner_created_idx', plan)
+                if connection.vendor == 'sqlite':
+                    self.assertNotIn('TEMP B-TREE', plan)
+                else:
+                    self.assertNotIn('Sort', plan)
+
+    def test_timeline_trim_reads_index(self):
+        """trimming timelines (on fan-out): first entry past the length of each one, read in index order"""
+        plan = self.explain(timeline._past_length([self.follower.id]))
+        self.assertIn('timeline_owner_created_idx', plan)
+        if connection.vendor == 'sqlite':
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_recommendations_trim_reads_index(self):
+        """trimming recommendations (on follow): first one past the limit of each user, read in index order"""
+        plan = self.explain(recommendations._past_limit([self.follower.id]))
+        self.assertIn('recommendation_user_idx', plan)
+        if connection.vendor == 'sqlite':
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_followers_lookup_uses_reverse_index(self):
+        """followers of a user (eg. when fanning out posts): WHERE to_user_id = ?"""
+        followers = (
+            User.friends.through.objects
+            .filter(to_user=self.user_followed.id)
+            .values_list('from_user', flat=True)
+        )
+        self.assertUsesIndex(followers, 'network_user_friends_to_from_idx')
+
+    def test_liked_state_lookup_uses_index(self):
+        """liked state of a page: WHERE user_id = ? AND post_id IN (...)"""
+        liked = (
+            User.likes.through.objects
+            .filter(user=self.follower.id, post__in=[1, 2, 3])
+            .values_list('post', flat=True)
+        )
+        self.assertNoFullScan(liked)
+
+    def test_fans_lookup_uses_reverse_index(self):
+        """fans of a post: WHERE post_id = ? (returning user_id)"""
+        fans = User.likes.through.objects.filter(post=1).values_list('user', flat=True)
+        self.assertUsesIndex(fans, 'like_post_user_idx')
+
+@override_settings(NETWORK_PAGE_CACHE=None)
+class FeedQueryCountTests(TestCase):
+    """Check that feeds run a constant number of queries (whatever posts are on page)"""
+    def setUp(self):
+        """Create some users where foo follows bar and baz"""
+        foo = User.objects.create_user(**foo_credentials)
+        bar = User.objects.create_user(**bar_credentials)
+        baz = User.objects.create_user(**baz_credentials)
+
+        self.client.login(**foo_credentials)
+        self.client.post(f'/{bar.username}/follow')
+        self.client.post(f'/{baz.username}/follow')
+
+        self.authors = [bar, baz]
+        self.login_credentials_of_follower = foo_credentials
+
+    def add_posts(self, count):
+        """Create posts (alternating authors) that fan out into follower timeline"""
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(count):
+                actions.create_post(self.authors[i % 2], f'post #{i + 1}')
+
+    def assertFeedQueries(self, url, num):
+        # a page with a couple of posts and a full page must cost the same
+        for posts_count in [2, 10]:
+            self.add_posts(posts_count)
+            with self.assertNumQueries(num):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                # (streamed pages run the feed query while their body is sent)
+                response.getvalue()
+
+    def test_index_queries_notloggedin(self):
+        """count + page"""
+        self.client.logout()
+        self.assertFeedQueries('/', 2)
+
+    def test_index_queries(self):
+        """session + user + count + page + liked state"""
+        self.assertFeedQueries('/', 5)
+
+    def test_profile_queries(self):
+        """session + user + profile user + count + page + liked state + following state"""
+        self.assertFeedQueries(f'/{self.authors[0].username}', 7)
+
+    def test_following_queries(self):
+        """session + user + celebrities followed + count + page + liked state"""
+        self.assertFeedQueries('/following', 6)
+
+@override_settings(NETWORK_PAGE_CACHE=None)
+class PostCardCacheTests(TestCase):
+    def setUp(self):
+        """Create a user and some posts (and start with an empty cache)"""
+        cache.clear()
+        foo = User.objects.create_user(**foo_credentials)
+        for i in range(3):
+            Post.objects.create(content=f'post #{i + 1}', user=foo)
+
+        self.post_to_edit = Post.objects.first()
+        self.login_credentials_of_post_owner = foo_credentials
+
+    def test_cards_cached_after_first_render(self):
+        """Check that cards are rendered once then read from cache"""
+        before = card_stats.as_dict()
+
+        self.client.get('/').getvalue()
+        self.client.get('/').getvalue()
+
+        after = card_stats.as_dict()
+        self.assertEqual(after['misses'] - before['misses'], 3)
+        self.assertEqual(after['hits'] - before['hits'], 3)
+        self.assertIsNotNone(cache.get(card_key(self.post_to_edit)))
+
+    def test_viewer_specific_parts_not_cached(self):
+        """Check that cached cards don't leak edit button to other viewers"""
+        self.client.login(**self.login_credentials_of_post_owner)
+        response = self.client.get('/')
+        self.assertContains(response, 'class="btn btn-primary btn-sm edit-post"', count=3)
+
+        self.client.logout()
+        response = self.client.get('/')
+        self.assertNotContains(response, 'class="btn btn-primary btn-sm edit-post"')
+
+    def test_edit_post_evicts_card(self):
+        """Check that editing a post evicts its card and next render shows new content"""
+        self.client.get('/')
+        old_key = card_key(self.post_to_edit)
+
+        self.client.login(**self.login_credentials_of_post_owner)
+        self.client.put(f'/posts/{self.post_to_edit.id}/edit', {'content': 'edited content'}, content_type='application/json')
+
+        self.assertIsNone(cache.get(old_key))
+        self.assertContains(self.client.get('/'), 'edited content')
+
+    def test_delete_post_evicts_card(self):
+        """Check that deleting a post evicts its card"""
+        self.client.get('/')
+        key = card_key(self.post_to_edit)
+
+        self.post_to_edit.delete()
+
+        self.assertIsNone(cache.get(key))
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    """Local stand-in for a redis server (supports commands used by RedisCache)"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeRedisHandler)
+        self.data = {}
+        self.expiry = {}
+        self.lock = threading.Lock()
+        # error reply to every command (eg. '-LOADING ...' while a server starts)
+        self.error = None
+
+    @property
+    def url(self):
+        return f'redis://127.0.0.1:{self.server_address[1]}/0'
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+    def alive(self, key):
+        if key in self.expiry and self.expiry[key] < time.monotonic():
+            self.data.pop(key, None)
+            self.expiry.pop(key, None)
+        return key in self.data
+
+    def run(self, command, *args):
+        if self.error:
+            return self.error
+        command = command.upper()
+        if command in (b'PING', b'SELECT'):
+            return '+OK'
+        if command == b'GET':
+            return self.data[args[0]] if self.alive(args[0]) else None
+        if command == b'MGET':
+            return [self.data[k] if self.alive(k) else None for k in args]
+        if command == b'SET':
+            key, value, *options = args
+            options = [o.upper() for o in options]
+            if b'NX' in options and self.alive(key):
+                return None
+            self.data[key] = value
+            self.expiry.pop(key, None)
+            if b'PX' in options:
+                self.expiry[key] = time.monotonic() + int(options[options.index(b'PX') + 1]) / 1000
+            return '+OK'
+        if command == b'DEL':
+            deleted = [k for k in args if self.alive(k)]
+            for k in deleted:
+                del self.data[k]
+            return len(deleted)
+        if command == b'EXISTS':
+            return sum(self.alive(k) for k in args)
+        if command == b'INCRBY':
+            self.data[args[0]] = str(int(self.data.get(args[0], b'0')) + int(args[1])).encode()
+            return int(self.data[args[0]])
+        if command == b'FLUSHDB':
+            self.data.clear()
+            self.expiry.clear()
+            return '+OK'
+        return f'-ERR unknown command {command.decode()}'
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def write_reply(self, reply):
+        if reply is None:
+            self.wfile.write(b'$-1\r\n')
+        elif isinstance(reply, str):
+            self.wfile.write(reply.encode() + b'\r\n')
+        elif isinstance(reply, int):
+            self.wfile.write(b':%d\r\n' % reply)
+        elif isinstance(reply, bytes):
+            self.wfile.write(b'$%d\r\n%s\r\n' % (len(reply), reply))
+        else:
+            self.wfile.write(b'*%d\r\n' % len(reply))
+            for item in reply:
+                self.write_reply(item)
+
+    def handle(self):
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            with self.server.lock:
+                reply = self.server.run(*args)
+            self.write_reply(reply)
+
+
+@override_settings(NETWORK_PAGE_CACHE='default')
+class PageCacheTests(TestCase):
+    def setUp(self):
+        """Create some users and posts (and start with an empty cache)"""
+        cache.clear()
+        foo = User.objects.create_user(**foo_credentials)
+        bar = User.objects.create_user(**bar_credentials)
+        self.post = Post.objects.create(content='some content', user=foo)
+
+        self.author = foo
+        self.login_credentials_of_author = foo_credentials
+        self.other_user = bar
+        self.login_credentials_of_other_user = bar_credentials
+
+    def assertCached(self, url, expected):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Page-Cache'], expected)
+        return response
+
+    def test_anonymous_pages_cached(self):
+        """Check that anonymous visits of index/profile are served from cache"""
+        for url in ['/', f'/{self.author.username}']:
+            self.assertCached(url, 'miss')
+            with self.assertNumQueries(0):
+                self.assertCached(url, 'hit')
+
+    def test_logged_in_pages_not_cached(self):
+        """Check that pages of logged-in users are never cached"""
+        self.client.login(**self.login_credentials_of_other_user)
+
+        response = self.client.get('/')
+        self.assertNotIn('X-Page-Cache', response)
+
+    def test_pages_differ_by_query_string(self):
+        """Check that different pages of a feed are cached separately"""
+        self.assertCached('/?page=1', 'miss')
+        self.assertCached('/?cursor=', 'miss')
+
+    def test_writes_invalidate_affected_pages(self):
+        """Check that create/edit/like/follow bump versions of pages they change"""
+        writes = [
+            (self.login_credentials_of_author, lambda: self.client.post('/posts/create', {'content': 'new post'})),
+            (self.login_credentials_of_author, lambda: self.client.put(f'/posts/{self.post.id}/edit', {'content': 'edited'}, content_type='application/json')),
+            (self.login_credentials_of_other_user, lambda: self.client.post(f'/posts/{self.post.id}/like')),
+            (self.login_credentials_of_other_user, lambda: self.client.post(f'/{self.author.username}/follow')),
+        ]
+        for credentials, write in writes:
+            self.assertCached(f'/{self.author.username}', 'miss')
+            self.assertCached(f'/{self.author.username}', 'hit')
+
+            self.client.login(**credentials)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertIn(write().status_code, [200, 302])
+            self.client.logout()
+
+        self.assertContains(self.assertCached(f'/{self.author.username}', 'miss'), 'Followers: 1')
+
+    def test_unrelated_profile_stays_cached(self):
+        """Check that a new post of a user doesn't invalidate other users profiles"""
+        self.assertCached(f'/{self.other_user.username}', 'miss')
+
+        self.client.login(**self.login_credentials_of_author)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/posts/create', {'content': 'new post'})
+        self.client.logout()
+
+        self.assertCached(f'/{self.other_user.username}', 'hit')
+
+
+def shared_page_cache(test):
+    """Settings caching pages on files (shared by processes, unlike locmem) so that pages have validators"""
+    location = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, location, ignore_errors=True)
+    return override_settings(
+        CACHES={
+            **settings.CACHES,
+            'shared': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location},
+        },
+        NETWORK_PAGE_CACHE='shared',
+    )
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        """Create a user followed by another one and a post (and start with an empty shared cache)"""
+        shared = shared_page_cache(self)
+        shared.enable()
+        self.addCleanup(shared.disable)
+        self.author = User.objects.create_user(**foo_credentials)
+        self.follower = User.objects.create_user(**bar_credentials)
+        actions.follow(self.follower, self.author)
+        self.post = actions.create_post(self.author, 'some content')
+
+    def write(self, action, *args):
+        with self.captureOnCommitCallbacks(execute=True):
+            action(*args)
+
+    def test_not_modified(self):
+        """Check that revalidating unchanged pages gets a 304 without querying db"""
+        for url in ['/', f'/{self.author.username}']:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('no-cache', response['Cache-Control'])
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.content, b'')
+
+            response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(response.status_code, 304)
+
+    def test_writes_change_validators(self):
+        """Check that writes shown by a page change its etag"""
+        writes = [
+            (actions.create_post, self.author, 'new post'),
+            (actions.edit_post, self.post, 'edited'),
+            (actions.like, self.follower, self.post),
+            (actions.unfollow, self.follower, self.author),
+        ]
+        etag = self.client.get(f'/{self.author.username}')['ETag']
+        for write in writes:
+            self.write(*write)
+            response = self.client.get(f'/{self.author.username}', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+            etag = response['ETag']
+
+    def test_validators_per_user(self):
+        """Check that pages of logged-in users have their own etag (and no last modified)"""
+        anonymous = self.client.get('/')
+        self.client.login(**bar_credentials)
+        response = self.client.get('/', HTTP_IF_NONE_MATCH=anonymous['ETag'], HTTP_IF_MODIFIED_SINCE=anonymous['Last-Modified'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], anonymous['ETag'])
+        self.assertNotIn('Last-Modified', response)
+        self.assertIn('private', response['Cache-Control'])
+
+        # session and user only
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get('/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_following_feed(self):
+        """Check that following feed changes once new posts reach timelines"""
+        self.client.login(**bar_credentials)
+        etag = self.client.get('/following')['ETag']
+        self.assertEqual(self.client.get('/following', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.write(actions.create_post, self.author, 'new post')
+        response = self.client.get('/following', HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'new post')
+
+    def test_rotated_csrf_token(self):
+        """Check that a page embedding an older csrf token isn't revalidated (eg. after logging in again)"""
+        self.client.login(**bar_credentials)
+        response = self.client.get('/')
+        token = self.client.cookies[settings.CSRF_COOKIE_NAME].value
+        self.assertEqual(self.client.get('/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        # (token is rotated by logging in, test client keeps the older cookie)
+        self.client.cookies[settings.CSRF_COOKIE_NAME] = token[::-1]
+        response = self.client.get('/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'csrfmiddlewaretoken')
+
+    def test_no_validators(self):
+        """Check that errors and uncached (versionless) pages have no validators"""
+        self.assertNotIn('ETag', self.client.get('/nobody'))
+        self.assertNotIn('ETag', self.client.get('/following'))
+        with override_settings(NETWORK_PAGE_CACHE=None):
+            self.assertNotIn('ETag', self.client.get('/'))
+        # (versions in locmem are never bumped by other processes)
+        with override_settings(NETWORK_PAGE_CACHE='default'):
+            self.assertNotIn('ETag', self.client.get('/'))
+
+    def test_bumped_by_other_process(self):
+        """Check that versions bumped by another process (eg. a worker running fan-out) change validators"""
+        self.client.login(**bar_credentials)
+        etag = self.client.get('/following')['ETag']
+
+        # threads get their own cache instances (like other processes)
+        worker = threading.Thread(target=page_cache.bump, args=['timelines'])
+        worker.start()
+        worker.join()
+        self.assertEqual(self.client.get('/following', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+def without_csrf_tokens(content):
+    # tokens are masked differently on every render
+    return re.sub(rb'name="csrfmiddlewaretoken" value="[^"]+"', b'', content)
+
+
+@override_settings(NETWORK_STREAM_PAGES=False)
+class CompressionTests(TestCase):
+    def setUp(self):
+        """Create a user with a page of posts (and start with an empty cache)"""
+        cache.clear()
+        self.user = User.objects.create_user(**foo_credentials)
+        for i in range(10):
+            Post.objects.create(content=f'post #{i}', user=self.user)
+
+    def test_gzip(self):
+        """Check that pages are gzipped for clients accepting it"""
+        plain = self.client.get('/')
+        response = self.client.get('/', HTTP_ACCEPT_ENCODING='deflate, gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertEqual(without_csrf_tokens(gzip.decompress(response.content)), without_csrf_tokens(plain.content))
+        # cards are repetitive
+        self.assertLess(len(response.content), len(plain.content) / 4)
+
+    def test_not_compressed(self):
+        """Check that refused encodings and small responses aren't compressed"""
+        response = self.client.get('/', HTTP_ACCEPT_ENCODING='gzip;q=0, identity')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertContains(response, 'post #9')
+
+        self.client.login(**foo_credentials)
+        post = Post.objects.first()
+        response = self.client.post(f'/posts/{post.id}/like', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Content-Encoding', response)
+
+    @unittest.skipIf(middleware.brotli is None, 'brotli is not installed')
+    def test_brotli(self):
+        """Check that brotli is preferred when installed"""
+        plain = self.client.get('/')
+        response = self.client.get('/', HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(without_csrf_tokens(middleware.brotli.decompress(response.content)), without_csrf_tokens(plain.content))
+
+    def test_conditional_requests(self):
+        """Check that etags of compressed pages are weak (and still match)"""
+        with shared_page_cache(self):
+            self.conditional_requests()
+
+    def conditional_requests(self):
+        response = self.client.get('/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        response = self.client.get('/', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertNotIn('Content-Encoding', response)
+
+
+@override_settings(NETWORK_STREAM_PAGES=True)
+class StreamingTests(TestCase):
+    def setUp(self):
+        """Create a user with a page of posts (then login)"""
+        self.user = User.objects.create_user(**foo_credentials)
+        for i in range(12):
+            Post.objects.create(content=f'post #{i}', user=self.user)
+        self.client.login(**foo_credentials)
+
+    def test_head_sent_before_feed_is_rendered(self):
+        """Check that layout head is sent before the feed is rendered"""
+        for url in ['/', f'/{self.user.username}', '/following']:
+            response = self.client.get(url)
+            self.assertTrue(response.streaming)
+            chunks = iter(response.streaming_content)
+            head = next(chunks)
+            self.assertIn(b'<nav', head)
+            self.assertNotIn(b'<h1', head)
+            rest = b''.join(chunks)
+            self.assertIn(b'<h1', rest)
+            self.assertTrue(rest.rstrip().endswith(b'</html>'))
+
+    def test_same_page_as_buffered(self):
+        """Check that streamed pages are the same as rendered ones"""
+        for url in ['/', '/?page=2', f'/{self.user.username}']:
+            streamed = b''.join(self.client.get(url).streaming_content)
+            with self.settings(NETWORK_STREAM_PAGES=False):
+                buffered = self.client.get(url).content
+            self.assertEqual(without_csrf_tokens(streamed), without_csrf_tokens(buffered))
+
+    def test_compressed_chunks(self):
+        """Check that gzipped streams flush every chunk"""
+        response = self.client.get('/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', response)
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        chunks = iter(response.streaming_content)
+        self.assertIn(b'<nav', decompressor.decompress(next(chunks)))
+        rest = b''.join(decompressor.decompress(chunk) for chunk in chunks)
+        self.assertIn(b'post #11', rest)
+
+    def test_feed_query_runs_after_head(self):
+        """Check that no feed query runs before the layout head is sent"""
+        for url in ['/', f'/{self.user.username}', '/following']:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+                chunks = iter(response.streaming_content)
+                next(chunks)
+                self.assertFalse([q for q in queries if 'network_post' in q['sql']])
+                b''.join(chunks)
+            self.assertTrue([q for q in queries if 'network_post' in q['sql']])
+
+    def test_missing_page(self):
+        """Check that malformed pages are 404s (like buffered ones) and pages past the end are empty"""
+        self.assertEqual(self.client.get('/?page=0').status_code, 404)
+        self.assertEqual(self.client.get('/?page=two').status_code, 404)
+        self.assertEqual(self.client.get('/', {'cursor': encode_cursor('n', 'not-a-date', 1)}).status_code, 404)
+        self.assertEqual(self.client.get('/nobody').status_code, 404)
+
+        response = self.client.get('/?page=9')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(b'post #', b''.join(response.streaming_content))
+
+    @override_settings(NETWORK_METRICS_SAMPLE_RATE=1)
+    def test_metrics_include_streamed_body(self):
+        """Check that metrics of streamed pages are recorded once their body (rendering included) is sent"""
+        registry.clear()
+        response = self.client.get('/')
+        self.assertNotIn('index', registry.histograms['network_request_duration_seconds'])
+
+        b''.join(response.streaming_content)
+        self.assertEqual(registry.histograms['network_request_duration_seconds']['index'].count, 1)
+        self.assertGreater(registry.histograms['network_db_queries']['index'].sum, 0)
+        self.assertGreater(registry.histograms['network_template_render_seconds']['index'].sum, 0)
+
+    @override_settings(NETWORK_PAGE_CACHE='default')
+    def test_cached_pages_not_streamed(self):
+        """Check that anonymous pages (cached whole) aren't streamed"""
+        self.client.logout()
+        self.assertFalse(self.client.get('/').streaming)
+
+
+class RedisCacheTests(TestCase):
+    def setUp(self):
+        self.server = FakeRedisServer().__enter__()
+        self.addCleanup(self.server.__exit__)
+
+    def redis_settings(self):
+        return override_settings(
+            CACHES={
+                'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                'pages': {'BACKEND': 'network.redis_cache.RedisCache', 'LOCATION': self.server.url},
+            },
+            NETWORK_PAGE_CACHE='pages',
+        )
+
+    def test_redis_cache_operations(self):
+        """Check that RedisCache behaves like other django cache backends"""
+        with self.redis_settings():
+            redis = caches['pages']
+            redis.set('a', {'some': 'value'})
+            self.assertEqual(redis.get('a'), {'some': 'value'})
+            self.assertFalse(redis.add('a', 'other'))
+            self.assertTrue(redis.add('b', 1))
+            self.assertEqual(redis.incr('b', 5), 6)
+            self.assertEqual(redis.get_many(['a', 'b', 'c']), {'a': {'some': 'value'}, 'b': 6})
+            self.assertTrue(redis.delete('a'))
+            self.assertIsNone(redis.get('a'))
+            redis.set('expired', 'value', timeout=0)
+            self.assertFalse(redis.has_key('expired'))
+            with self.assertRaises(ValueError):
+                redis.incr('missing')
+            redis.close()
+
+    def test_page_cache_on_redis(self):
+        """Check that anonymous pages could be cached on a redis server"""
+        User.objects.create_user(**foo_credentials)
+        with self.redis_settings():
+            self.assertEqual(self.client.get('/')['X-Page-Cache'], 'miss')
+            self.assertEqual(self.client.get('/')['X-Page-Cache'], 'hit')
+            self.assertTrue(any(key.startswith(b':1:page:') for key in self.server.data))
+
+    def test_redis_outage(self):
+        """Check that an unreachable redis server is a cache miss (pages still work)"""
+        User.objects.create_user(**foo_credentials)
+        with self.redis_settings():
+            redis = caches['pages']
+            redis.set('a', 'value')
+            # (open connections outlive the server, reconnect)
+            self.server.__exit__()
+            redis._disconnect()
+            self.assertEqual(redis.get('a', 'default'), 'default')
+            self.assertEqual(redis.get_many(['a']), {})
+            self.assertFalse(redis.add('b', 1))
+            self.assertEqual(redis.set_many({'b': 1}), ['b'])
+            redis.set('b', 1)
+
+            response = self.client.get('/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['X-Page-Cache'], 'miss')
+
+    def test_redis_error_replies(self):
+        """Check that error replies (eg. server loading or out of memory) are misses and dropped writes"""
+        with self.redis_settings():
+            redis = caches['pages']
+            redis.set('a', 'value')
+            self.server.error = '-LOADING Redis is loading the dataset in memory'
+            self.assertEqual(redis.get('a', 'default'), 'default')
+            self.assertEqual(redis.get_many(['a']), {})
+            self.assertEqual(redis.set_many({'b': 1}), ['b'])
+            redis.set('b', 1)
+
+            # the connection is still in sync once the server recovers
+            self.server.error = None
+            self.assertEqual(redis.get('a'), 'value')
+            self.assertIsNone(redis.get('b'))
+
+    def test_unresponsive_server(self):
+        """Check that a server that never replies is a miss after the socket timeout (instead of blocking)"""
+        with socket.socket() as server:
+            # connections are accepted (by the kernel backlog) but nothing is ever read or sent
+            server.bind(('127.0.0.1', 0))
+            server.listen()
+            redis = RedisCache(f'redis://127.0.0.1:{server.getsockname()[1]}/0', {'OPTIONS': {'SOCKET_TIMEOUT': 0.1}})
+            started = time.monotonic()
+            self.assertEqual(redis.get('a', 'default'), 'default')
+            self.assertLess(time.monotonic() - started, 2)
+            redis.close()
+
+class ApiTests(TestCase):
+    def setUp(self):
+        """Create some users and posts where foo follows bar"""
+        foo = User.objects.create_user(**foo_credentials)
+        bar = User.objects.create_user(**bar_credentials)
+        actions.follow(foo, bar)
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(15):
+                actions.create_post(bar, f'post #{i + 1}')
+            actions.create_post(foo, 'post of foo')
+
+        self.follower = foo
+        self.login_credentials_of_follower = foo_credentials
+        self.user_followed = bar
+
+    def test_posts_feed(self):
+        """Check that feed is paginated using cursors and has only needed fields"""
+        response = self.client.get('/api/v1/posts')
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(len(data['posts']), 10)
+        self.assertEqual(set(data['posts'][0]), {'id', 'content', 'created_at', 'author', 'likes', 'liked'})
+        self.assertEqual(data['posts'][0]['content'], 'post of foo')
+        self.assertIsNone(data['previous'])
+
+        data = self.client.get('/api/v1/posts', {'cursor': data['next']}).json()
+        self.assertEqual(len(data['posts']), 6)
+        self.assertIsNone(data['next'])
+        self.assertEqual(data['posts'][-1]['content'], 'post #1')
+
+    def test_user_posts_feed(self):
+        """Check that profile feed has only posts of that user"""
+        data = self.client.get(f'/api/v1/users/{self.follower.username}/posts').json()
+        self.assertEqual([p['content'] for p in data['posts']], ['post of foo'])
+
+        response = self.client.get('/api/v1/users/i_dont_exist/posts')
+        self.assertEqual(response.status_code, 404)
+
+    def test_following_feed(self):
+        """Check that following feed needs login and has posts of friends"""
+        self.assertEqual(self.client.get('/api/v1/following').status_code, 401)
+
+        self.client.login(**self.login_credentials_of_follower)
+        data = self.client.get('/api/v1/following').json()
+        self.assertEqual(data['posts'][0]['author'], self.user_followed.username)
+
+    def test_like_unlike(self):
+        """Check that like/unlike report updated likes and whether state changed"""
+        post_to_like = Post.objects.filter(user=self.user_followed).first()
+        self.assertEqual(self.client.post(f'/api/v1/posts/{post_to_like.id}/like').status_code, 401)
+
+        self.client.login(**self.login_credentials_of_follower)
+        data = self.client.post(f'/api/v1/posts/{post_to_like.id}/like').json()
+        self.assertEqual(data, {'id': post_to_like.id, 'liked': True, 'likes': 1, 'changed': True})
+        data = self.client.post(f'/api/v1/posts/{post_to_like.id}/like').json()
+        self.assertFalse(data['changed'])
+
+        feed = self.client.get('/api/v1/posts').json()
+        liked = [p['id'] for p in feed['posts'] if p['liked']]
+        self.assertEqual(liked, [post_to_like.id])
+
+        data = self.client.post(f'/api/v1/posts/{post_to_like.id}/unlike').json()
+        self.assertEqual(data, {'id': post_to_like.id, 'liked': False, 'likes': 0, 'changed': True})
+
+    def test_follow_unfollow(self):
+        """Check that follow/unfollow report updated followers and whether state changed"""
+        self.client.login(**self.login_credentials_of_follower)
+
+        data = self.client.post(f'/api/v1/users/{self.user_followed.username}/follow').json()
+        self.assertEqual(data['changed'], False)
+
+        data = self.client.post(f'/api/v1/users/{self.user_followed.username}/unfollow').json()
+        self.assertEqual(data, {'username': 'bar', 'following': False, 'followers': 0, 'changed': True})
+
+        response = self.client.post(f'/api/v1/users/{self.follower.username}/follow')
+        self.assertEqual(response.status_code, 400)
+
+@override_settings(NETWORK_STREAM_PAGES=False)
+class InfiniteScrollTests(TestCase):
+    def setUp(self):
+        """add a new user and posts in db"""
+        user = User.objects.create_user(**foo_credentials)
+        for i in range(25):
+            Post.objects.create(content=f'post #{i + 1}', user=user)
+        self.user = user
+
+    def test_page_has_load_more_cursor(self):
+        """Check that pages point infinite scroll at the posts right after them"""
+        response = self.client.get('/?page=2')
+
+        self.assertContains(response, 'class="load-more"')
+        cursor = re.search(r'data-cursor="([^"]+)"', response.content.decode()).group(1)
+
+        # 1st post of 3rd page
+        cards = self.client.get('/posts/cards', {'feed': 'index', 'cursor': cursor})
+        self.assertEqual(cards.context['page'][0].id, Post.objects.values_list('id', flat=True)[20])
+
+    def test_cards_fragment(self):
+        """Check that cards endpoint sends only post cards and the next cursor"""
+        first = self.client.get('/posts/cards', {'feed': 'index', 'cursor': ''})
+
+        self.assertEqual(first.status_code, 200)
+        self.assertNotContains(first, '<html')
+        self.assertContains(first, 'class="box post"', count=10)
+        self.assertTrue(first['X-Next-Cursor'])
+
+        second = self.client.get('/posts/cards', {'feed': 'index', 'cursor': first['X-Next-Cursor']})
+        third = self.client.get('/posts/cards', {'feed': 'index', 'cursor': second['X-Next-Cursor']})
+        self.assertContains(third, 'class="box post"', count=5)
+        self.assertEqual(third['X-Next-Cursor'], '')
+
+    def test_cards_of_profile_and_following(self):
+        """Check that cards endpoint serves profile and following feeds"""
+        response = self.client.get('/posts/cards', {'feed': 'profile', 'username': self.user.username})
+        self.assertContains(response, 'class="box post"', count=10)
+
+        response = self.client.get('/posts/cards', {'feed': 'profile', 'username': 'i_dont_exist'})
+        self.assertEqual(response.status_code, 404)
+
+        response = self.client.get('/posts/cards', {'feed': 'following'})
+        self.assertEqual(response.status_code, 401)
+
+class BenchmarkTests(TestCase):
+    def test_generate_graph(self):
+        """Check that generated graph has requested users/posts and consistent counters"""
+        call_command('generate_graph', users=30, follows=5, posts=3, likes=2, stdout=StringIO())
+
+        self.assertEqual(User.objects.filter(username__startswith='bench_').count(), 30)
+        self.assertEqual(Post.objects.count(), 90)
+        self.assertGreater(User.friends.through.objects.count(), 0)
+        # counters match relations
+        self.assertEqual(
+            sum(User.objects.values_list('followers_count', flat=True)),
+            User.friends.through.objects.count(),
+        )
+        # timelines built
+        self.assertTrue(TimelineEntry.objects.exists())
+
+    def test_benchmark_command(self):
+        """Check that benchmark reports latency percentiles, queries and rows per endpoint"""
+        call_command('generate_graph', users=30, follows=5, posts=3, likes=2, stdout=StringIO())
+        out = StringIO()
+
+        call_command('benchmark', requests=3, stdout=out)
+
+        results = json.loads(out.getvalue())
+        self.assertEqual(results['meta']['users'], 30)
+        for name in ['index', 'profile', 'following', 'like_post', 'follow']:
+            self.assertEqual(
+                set(results['endpoints'][name]),
+                {'requests', 'p50_ms', 'p95_ms', 'p99_ms', 'mean_ms', 'queries', 'rows_read'},
+            )
+
+    def test_markup_benchmark(self):
+        """Check that markup suite reports size, elements and render time of pages of 10 and 100 posts"""
+        call_command('generate_graph', users=30, follows=5, posts=10, likes=2, stdout=StringIO())
+        out = StringIO()
+
+        call_command('benchmark', suite=['markup'], requests=2, stdout=out)
+
+        results = json.loads(out.getvalue())['markup']
+        for size in [10, 100]:
+            result = results[f'{size}_posts']
+            self.assertEqual(set(result), {'posts', 'bytes', 'gzip_bytes', 'elements', 'render'})
+            self.assertLess(result['gzip_bytes'], result['bytes'])
+        self.assertGreater(results['100_posts']['elements'], results['10_posts']['elements'])
+
+    def test_transfer_benchmark(self):
+        """Check that transfer suite reports first byte times and sizes per encoding (compressed pages are smaller)"""
+        call_command('generate_graph', users=30, follows=5, posts=3, likes=2, stdout=StringIO())
+        out = StringIO()
+
+        call_command('benchmark', suite=['transfer'], requests=2, stdout=out)
+
+        results = json.loads(out.getvalue())['transfer']
+        for page in ['index', 'profile', 'following']:
+            for mode in ['buffered', 'streamed']:
+                result = results[page][mode]
+                self.assertEqual(set(result['gzip']), {'requests', 'first_byte', 'total', 'bytes'})
+                self.assertLess(result['gzip']['bytes'], result['identity']['bytes'])
+
+def read_metrics(client):
+    """Read the metrics endpoint (like a scraper holding the metrics token)"""
+    with override_settings(NETWORK_METRICS_TOKEN='metrics-token'):
+        return client.get('/internal/metrics', HTTP_AUTHORIZATION='Bearer metrics-token').content.decode()
+
+
+@override_settings(NETWORK_METRICS_SAMPLE_RATE=1, NETWORK_PAGE_CACHE=None, NETWORK_STREAM_PAGES=False)
+class MetricsTests(TestCase):
+    def setUp(self):
+        """add a new user and posts in db and reset recorded metrics"""
+        user = User.objects.create_user(**foo_credentials)
+        for i in range(3):
+            Post.objects.create(content=f'post #{i + 1}', user=user)
+        self.user = user
+        registry.clear()
+
+    def metric(self, name, view):
+        """Return value of a metric line (for a view) from metrics endpoint"""
+        match = re.search(rf'^{name}{{view="{view}"}} (\S+)$', read_metrics(self.client), re.M)
+        return float(match.group(1)) if match else None
+
+    def test_requests_recorded_per_view(self):
+        """Check that requests are recorded under their url name"""
+        self.client.get('/')
+        self.client.get('/')
+        self.client.get(f'/{self.user.username}')
+
+        self.assertEqual(self.metric('network_request_duration_seconds_count', 'index'), 2)
+        self.assertEqual(self.metric('network_request_duration_seconds_count', 'profile'), 1)
+        self.assertGreater(self.metric('network_db_queries_sum', 'index'), 0)
+        self.assertGreater(self.metric('network_template_render_seconds_sum', 'index'), 0)
+
+    def test_duplicate_queries_counted(self):
+        """Check that repeated queries (same sql and params) are counted"""
+        self.client.login(**foo_credentials)
+        self.client.get('/')
+        self.assertEqual(self.metric('network_db_duplicate_queries_sum', 'index'), 0)
+
+    def test_histogram_format(self):
+        """Check that histograms have cumulative buckets ending with +Inf"""
+        self.client.get('/')
+        content = read_metrics(self.client)
+
+        self.assertIn('# TYPE network_request_duration_seconds histogram', content)
+        self.assertIn('network_request_duration_seconds_bucket{view="index",le="+Inf"} 1', content)
+        self.assertIn('network_post_card_cache_hits_total', content)
+
+    @override_settings(NETWORK_METRICS_SAMPLE_RATE=0)
+    def test_sampling(self):
+        """Check that requests out of sample aren't recorded"""
+        self.client.get('/')
+        self.assertIsNone(self.metric('network_request_duration_seconds_count', 'index'))
+
+    @override_settings(NETWORK_METRICS_TOKEN='metrics-token')
+    def test_metrics_not_public(self):
+        """Check that metrics are only readable by staff users or with the token (whatever the client ip)"""
+        self.assertEqual(self.client.get('/internal/metrics', REMOTE_ADDR='127.0.0.1').status_code, 404)
+        self.assertEqual(self.client.get('/internal/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 404)
+        self.assertEqual(self.client.get('/internal/metrics', HTTP_AUTHORIZATION='Bearer metrics-token').status_code, 200)
+
+        self.client.login(**foo_credentials)
+        self.assertEqual(self.client.get('/internal/metrics').status_code, 404)
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.assertEqual(self.client.get('/internal/metrics').status_code, 200)
+
+    @override_settings(NETWORK_METRICS_TOKEN=None)
+    def test_no_token_set(self):
+        """Check that an empty bearer token doesn't match when no token is set"""
+        self.assertEqual(self.client.get('/internal/metrics', HTTP_AUTHORIZATION='Bearer ').status_code, 404)
+        self.assertEqual(self.client.get('/internal/metrics', HTTP_AUTHORIZATION='Bearer None').status_code, 404)
+
+
+@override_settings(NETWORK_ASYNC_PARALLEL_QUERIES=False, NETWORK_PAGE_CACHE=None, NETWORK_STREAM_PAGES=False)
+class AsyncViewsTests(TestCase):
+    def setUp(self):
+        """add users (one following the other) and posts in db"""
+        self.foo = User.objects.create_user(**foo_credentials)
+        self.bar = User.objects.create_user(**bar_credentials)
+        actions.follow(self.foo, self.bar)
+        for i in range(12):
+            actions.create_post(self.bar, f'post #{i + 1}')
+        self.post = Post.objects.first()
+
+    def assertSameAsSync(self, url):
+        """Check that async version of a page renders the same posts as the sync one"""
+        sync_response = self.client.get(url)
+        async_response = self.client.get(f'/async{url}')
+        self.assertEqual(async_response.status_code, 200)
+        self.assertEqual(
+            [post.id for post in async_response.context['page']],
+            [post.id for post in sync_response.context['page']],
+        )
+        return async_response
+
+    def test_feeds(self):
+        """Check that async feeds render the same pages as sync ones"""
+        self.assertSameAsSync('/')
+        self.assertSameAsSync('/?page=2')
+        self.assertSameAsSync(f'/{self.bar.username}')
+
+        self.client.login(**foo_credentials)
+        response = self.assertSameAsSync(f'/{self.bar.username}')
+        self.assertTrue(response.context['can_unfollow'])
+        self.assertSameAsSync('/following')
+
+    def test_feed_errors(self):
+        """Check that async feeds reject anonymous users and unknown profiles"""
+        self.assertEqual(self.client.get('/async/following').status_code, 401)
+        self.assertEqual(self.client.get('/async/i_dont_exist').status_code, 404)
+
+    def test_like_unlike(self):
+        """Check that async like/unlike update likes and reject repeated requests"""
+        self.client.login(**foo_credentials)
+
+        response = self.client.post(f'/async/posts/{self.post.id}/like')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['post'].is_liked)
+        self.assertEqual(Post.objects.get(pk=self.post.id).likes_count, 1)
+        self.assertEqual(self.client.post(f'/async/posts/{self.post.id}/like').status_code, 400)
+
+        response = self.client.post(f'/async/posts/{self.post.id}/unlike')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Post.objects.get(pk=self.post.id).likes_count, 0)
+        self.assertEqual(self.client.post(f'/async/posts/{self.post.id}/unlike').status_code, 400)
+
+    def test_follow_unfollow(self):
+        """Check that async follow/unfollow update relations and counters"""
+        self.client.login(**foo_credentials)
+
+        response = self.client.post(f'/async/{self.bar.username}/unfollow')
+        self.assertRedirects(response, f'/async/{self.bar.username}')
+        self.assertEqual(User.objects.get(pk=self.bar.id).followers_count, 0)
+        self.assertEqual(self.client.post(f'/async/{self.bar.username}/unfollow').status_code, 400)
+
+        self.client.post(f'/async/{self.bar.username}/follow')
+        self.assertTrue(self.foo.friends.filter(pk=self.bar.id).exists())
+        self.assertEqual(self.client.post(f'/async/{self.foo.username}/follow').status_code, 400)
+
+    def test_interactions_errors(self):
+        """Check that async interactions reject anonymous users, wrong methods and unknown targets"""
+        self.assertEqual(self.client.post(f'/async/posts/{self.post.id}/like').status_code, 401)
+
+        self.client.login(**foo_credentials)
+        self.assertEqual(self.client.get(f'/async/posts/{self.post.id}/like').status_code, 405)
+        self.assertEqual(self.client.post('/async/posts/0/like').status_code, 404)
+        self.assertEqual(self.client.post('/async/i_dont_exist/follow').status_code, 404)
+
+    @override_settings(NETWORK_PAGE_CACHE='default')
+    def test_anonymous_page_cache(self):
+        """Check that async pages are cached for anonymous visitors"""
+        cache.clear()
+        self.assertEqual(self.client.get('/async/')['X-Page-Cache'], 'miss')
+        self.assertEqual(self.client.get('/async/')['X-Page-Cache'], 'hit')
+
+
+@override_settings(NETWORK_ASYNC_PARALLEL_QUERIES=True)
+class AsyncParallelQueriesTests(TransactionTestCase):
+    def setUp(self):
+        """add users and posts in db (committed, so that other threads see them)"""
+        self.foo = User.objects.create_user(**foo_credentials)
+        self.bar = User.objects.create_user(**bar_credentials)
+        for i in range(3):
+            actions.create_post(self.bar, f'post #{i + 1}')
+
+    def test_profile_with_parallel_queries(self):
+        """Check that profile is rendered when its queries run concurrently"""
+        self.client.login(**foo_credentials)
+
+        response = self.client.get(f'/async/{self.bar.username}')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['page']), 3)
+        self.assertTrue(response.context['can_follow'])
+
+
+class LoadBenchmarkTests(TransactionTestCase):
+    def test_asgi_benchmark(self):
+        """Check that load benchmark reports throughput of sync and async feeds"""
+        call_command('generate_graph', users=20, follows=5, posts=2, likes=1, stdout=StringIO())
+        out = StringIO()
+
+        call_command('benchmark', suite=['asgi'], requests=4, workers=2, stdout=out)
+
+        results = json.loads(out.getvalue())['asgi']
+        self.assertEqual(results['workers'], 2)
+        for name in ['index', 'profile', 'following']:
+            for server in ['wsgi', 'asgi']:
+                self.assertEqual(results[name][server]['requests'], 4)
+                self.assertGreater(results[name][server]['requests_per_second'], 0)
+
+
+def write_statements(queries):
+    """Statements of captured queries (without savepoints of nested transactions)"""
+    return [q['sql'] for q in queries if not q['sql'].startswith(('SAVEPOINT', 'RELEASE'))]
+
+class IdempotentActionsTests(TestCase):
+    def setUp(self):
+        """add users and a post in db"""
+        self.foo = User.objects.create_user(**foo_credentials)
+        self.bar = User.objects.create_user(**bar_credentials)
+        self.post = Post.objects.create(content='some content', user=self.bar)
+        # actions read author's username (page cache scopes)
+        self.post = Post.objects.select_related('user').get(pk=self.post.id)
+
+    def test_like_statements(self):
+        """Check that like/unlike take at most two statements and report changes"""
+        with CaptureQueriesContext(connection) as captured:
+            self.assertTrue(actions.like(self.foo, self.post))
+        self.assertEqual(len(write_statements(captured)), 2)
+        self.assertEqual(self.post.likes_count, 1)
+
+        # liking again changes nothing (a single statement)
+        with CaptureQueriesContext(connection) as captured:
+            self.assertFalse(actions.like(self.foo, self.post))
+        self.assertEqual(len(write_statements(captured)), 1)
+        self.assertEqual(self.foo.likes.count(), 1)
+        self.assertEqual(Post.objects.get(pk=self.post.id).likes_count, 1)
+
+        with CaptureQueriesContext(connection) as captured:
+            self.assertTrue(actions.unlike(self.foo, self.post))
+        self.assertEqual(len(write_statements(captured)), 2)
+        self.assertEqual(self.post.likes_count, 0)
+        self.assertFalse(actions.unlike(self.foo, self.post))
+        self.assertEqual(Post.objects.get(pk=self.post.id).likes_count, 0)
+
+    def test_follow_counters(self):
+        """Check that follow/unfollow update both counters at once and report changes"""
+        self.assertTrue(actions.follow(self.foo, self.bar))
+        self.assertFalse(actions.follow(self.foo, self.bar))
+        self.assertEqual((self.foo.friends_count, self.bar.followers_count), (1, 1))
+        self.assertEqual(User.friends.through.objects.count(), 1)
+
+        # other counters of both users untouched
+        foo, bar = User.objects.get(pk=self.foo.id), User.objects.get(pk=self.bar.id)
+        self.assertEqual((foo.friends_count, foo.followers_count), (1, 0))
+        self.assertEqual((bar.friends_count, bar.followers_count), (0, 1))
+
+        self.assertTrue(actions.unfollow(self.foo, self.bar))
+        self.assertFalse(actions.unfollow(self.foo, self.bar))
+        bar = User.objects.get(pk=self.bar.id)
+        self.assertEqual((bar.followers_count, self.foo.friends_count), (0, 0))
+
+    def test_like_view_queries(self):
+        """Check that like view doesn't check like state before writing it"""
+        self.client.login(**foo_credentials)
+        self.client.get('/')
+
+        with CaptureQueriesContext(connection) as captured:
+            self.client.post(f'/posts/{self.post.id}/like')
+        # session, user, post (and author), insert like, update counter
+        self.assertEqual(len(write_statements(captured)), 5)
+
+
+class ConcurrentActionsTests(TransactionTestCase):
+    def setUp(self):
+        """add users and a post in db (committed, so that other threads see them)"""
+        self.foo = User.objects.create_user(**foo_credentials)
+        self.bar = User.objects.create_user(**bar_credentials)
+        self.post = Post.objects.select_related('user').get(
+            pk=Post.objects.create(content='some content', user=self.bar).pk
+        )
+
+    def run_concurrently(self, action, times=8):
+        """Call action from many threads at once, return results (or errors)"""
+        start = threading.Barrier(times)
+        results = [None] * times
+
+        def run(i):
+            start.wait()
+            try:
+                results[i] = action()
+            except Exception as error:
+                results[i] = error
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=[i]) for i in range(times)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_likes(self):
+        """Check that concurrent likes (eg. double clicks) like a post once"""
+        results = self.run_concurrently(lambda: actions.like(self.foo, self.post))
+
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(results.count(False), len(results) - 1)
+        self.assertEqual(User.likes.through.objects.filter(user=self.foo, post=self.post).count(), 1)
+        self.assertEqual(Post.objects.get(pk=self.post.id).likes_count, 1)
+
+        results = self.run_concurrently(lambda: actions.unlike(self.foo, self.post))
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(Post.objects.get(pk=self.post.id).likes_count, 0)
+
+    def test_concurrent_follows(self):
+        """Check that concurrent follows add a single relation and count it once"""
+        results = self.run_concurrently(lambda: actions.follow(self.foo, self.bar))
+
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(results.count(False), len(results) - 1)
+        self.assertEqual(User.friends.through.objects.count(), 1)
+        self.assertEqual(User.objects.get(pk=self.bar.id).followers_count, 1)
+        self.assertEqual(User.objects.get(pk=self.foo.id).friends_count, 1)
+
+
+class BatchApiTests(TestCase):
+    def setUp(self):
+        """add users and posts in db"""
+        self.foo = User.objects.create_user(**foo_credentials)
+        self.bar = User.objects.create_user(**bar_credentials)
+        self.baz = User.objects.create_user(**baz_credentials)
+        self.posts = [Post.objects.create(content=f'post #{i + 1}', user=self.bar) for i in range(3)]
+        self.client.login(**foo_credentials)
+
+    def send(self, *operations):
+        return self.client.post(
+            '/api/v1/batch', json.dumps({'operations': list(operations)}), content_type='application/json'
+        )
+
+    def test_batch(self):
+        """Check that a batch applies all operations and reports updated counts"""
+        first, second, third = self.posts
+        actions.like(self.foo, third)
+
+        response = self.send(
+            {'op': 'like', 'post': first.id},
+            {'op': 'like', 'post': second.id},
+            {'op': 'unlike', 'post': third.id},
+            {'op': 'follow', 'user': 'bar'},
+            {'op': 'follow', 'user': 'baz'},
+        )
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['results'][0], {'op': 'like', 'post': first.id, 'changed': True, 'liked': True, 'likes': 1})
+        self.assertEqual(data['results'][2], {'op': 'unlike', 'post': third.id, 'changed': True, 'liked': False, 'likes': 0})
+        self.assertEqual(data['results'][3], {'op': 'follow', 'user': 'bar', 'changed': True, 'following': True, 'followers': 1})
+        self.assertEqual(data['friends'], 2)
+
+        # relations, counters and timelines
+        self.assertEqual(set(self.foo.likes.values_list('id', flat=True)), {first.id, second.id})
+        self.assertEqual([p.likes_count for p in Post.objects.order_by('id')], [1, 1, 0])
+        self.assertEqual(User.objects.get(pk=self.foo.id).friends_count, 2)
+        self.assertEqual(User.objects.get(pk=self.baz.id).followers_count, 1)
+        self.assertEqual(self.foo.timeline.count(), 3)
+
+    def test_repeated_operations(self):
+        """Check that last operation on a target wins and each one reports its own change"""
+        post = self.posts[0]
+
+        data = self.send(
+            {'op': 'like', 'post': post.id},
+            {'op': 'unlike', 'post': post.id},
+            {'op': 'like', 'post': post.id},
+            {'op': 'like', 'post': post.id},
+        ).json()
+
+        self.assertEqual([r['changed'] for r in data['results']], [True, True, True, False])
+        self.assertEqual({r['likes'] for r in data['results']}, {1})
+        self.assertEqual(User.likes.through.objects.count(), 1)
+
+    def test_batch_statements(self):
+        """Check that a batch writes each kind of relation using bulk statements"""
+        operations = [{'op': 'like', 'post': post.id} for post in self.posts]
+        with CaptureQueriesContext(connection) as captured:
+            self.send(*operations)
+        # session, user, posts, insert likes, update counters
+        self.assertEqual(len(write_statements(captured)), 5)
+
+    def test_invalid_operations(self):
+        """Check that invalid batches are rejected and missing targets are reported"""
+        self.assertEqual(self.send({'op': 'share', 'post': 1}).status_code, 400)
+        self.assertEqual(self.send({'op': 'like'}).status_code, 400)
+        self.assertEqual(self.send(*[{'op': 'like', 'post': 1}] * 101).status_code, 400)
+
+        data = self.send(
+            {'op': 'like', 'post': 0},
+            {'op': 'follow', 'user': 'foo'},
+            {'op': 'follow', 'user': 'i_dont_exist'},
+        ).json()
+        self.assertEqual([r['error'] for r in data['results']], ['Post not found.', "You can't follow yourself!", 'User not found.'])
+
+        self.client.logout()
+        self.assertEqual(self.send({'op': 'like', 'post': 1}).status_code, 401)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        """add a new user and posts (indexed for search) in db"""
+        self.user = User.objects.create_user(**foo_credentials)
+        actions.create_post(self.user, 'running in the park today')
+        actions.create_post(self.user, 'a quiet day at home')
+        actions.create_post(self.user, 'park, park and more park!')
+
+    def search(self, query, **params):
+        return self.client.get('/posts/search', {'q': query, **params})
+
+    def test_search_ranked(self):
+        """Check that search finds posts by words (and their stems), best matches first"""
+        response = self.search('park')
+
+        self.assertEqual(response.status_code, 200)
+        contents = [post.content for post in response.context['page']]
+        self.assertEqual(contents, ['park, park and more park!', 'running in the park today'])
+
+        contents = [post.content for post in self.search('run').context['page']]
+        self.assertEqual(contents, ['running in the park today'])
+
+    def test_index_kept_up_to_date(self):
+        """Check that edited and deleted posts are searched by their current content"""
+        post = Post.objects.select_related('user').get(content='a quiet day at home')
+        actions.edit_post(post, 'a noisy day at the park')
+        self.assertEqual(len(self.search('quiet').context['page']), 0)
+        self.assertEqual(len(self.search('noisy').context['page']), 1)
+
+        post.delete()
+        self.assertEqual(len(self.search('noisy').context['page']), 0)
+
+    def test_search_paginated_by_rank(self):
+        """Check that results are paginated using cursors (keeping query in links)"""
+        for i in range(12):
+            actions.create_post(self.user, f'tree number {i}' + ' tree' * (i % 3))
+
+        first = self.search('tree')
+        self.assertEqual(len(first.context['page']), 10)
+        next_cursor = first.context['page'].next_cursor
+        self.assertContains(first, f'href="?q=tree&cursor={next_cursor}"')
+
+        second = self.search('tree', cursor=next_cursor)
+        self.assertEqual(len(second.context['page']), 2)
+        ids = [p.id for p in first.context['page']] + [p.id for p in second.context['page']]
+        self.assertEqual(len(set(ids)), 12)
+
+        # infinite scroll continues the same results
+        cards = self.client.get('/posts/cards', {'feed': 'search', 'q': 'tree', 'cursor': next_cursor})
+        self.assertEqual([p.id for p in cards.context['page']], ids[10:])
+
+    def test_search_syntax_is_safe(self):
+        """Check that any query (eg. with search syntax characters) is accepted"""
+        for query in ['"park', 'park AND (', '*', 'NEAR(park', '???']:
+            self.assertEqual(self.search(query).status_code, 200)
+        self.assertIsNone(self.search('').context['page'])
+
+
+class TagsTests(TestCase):
+    def setUp(self):
+        """add two users (one of them mentioned) and a post using tags in db"""
+        self.foo = User.objects.create_user(**foo_credentials)
+        self.bar = User.objects.create_user(**bar_credentials)
+        self.post = actions.create_post(self.foo, 'hi @bar, #Django is fun #python')
+
+    def tag_names(self, post):
+        return set(post.post_tags.values_list('tag__name', flat=True))
+
+    def test_extraction(self):
+        """Check which words are tags and mentions"""
+        self.assertEqual(tags.extract_tags('#a #B2 post #1 a#b &#39; ##c'), {'a', 'b2'})
+        self.assertEqual(tags.extract_mentions('@foo, @b.a+r. a@b @@baz'), {'foo', 'b.a+r'})
+
+    def test_create_and_edit(self):
+        """Check that tags and mentions are indexed, then diffed when a post is edited"""
+        self.assertEqual(self.tag_names(self.post), {'django', 'python'})
+        self.assertEqual(list(self.post.mentions.values_list('user', flat=True)), [self.bar.id])
+
+        actions.edit_post(self.post, '#django and #web @nobody')
+        self.assertEqual(self.tag_names(self.post), {'django', 'web'})
+        self.assertFalse(self.post.mentions.exists())
+        counts = dict(Tag.objects.values_list('name', 'window_count'))
+        self.assertEqual(counts, {'django': 1, 'python': 0, 'web': 1})
+
+    def test_no_queries_without_tags(self):
+        """Check that posts without tags or mentions don't cost extra queries"""
+        with CaptureQueriesContext(connection) as captured:
+            actions.create_post(self.foo, 'nothing to see here')
+        self.assertFalse([q for q in captured.captured_queries if 'tag' in q['sql'] or 'mention' in q['sql']])
+
+    def test_tag_and_mentions_feeds(self):
+        """Check that tag feed and mentions feed show matching posts (newest first)"""
+        other = actions.create_post(self.bar, 'more #DJANGO')
+        actions.create_post(self.bar, 'no tags')
+
+        response = self.client.get('/posts/tags/Django')
+        self.assertEqual([p.id for p in response.context['page']], [other.id, self.post.id])
+        self.assertContains(response, '<a href="/posts/tags/django">#DJANGO</a>', html=True)
+        self.assertEqual(self.client.get('/posts/tags/unknown').status_code, 404)
+
+        self.assertEqual(self.client.get('/posts/mentions').status_code, 401)
+        self.client.login(**bar_credentials)
+        response = self.client.get('/posts/mentions')
+        self.assertEqual([p.id for p in response.context['page']], [self.post.id])
+        self.assertContains(response, '<a href="/bar">@bar</a>', html=True)
+
+        cards = self.client.get('/posts/cards', {'feed': 'tag', 'tag': 'django'})
+        self.assertEqual([p.id for p in cards.context['page']], [other.id, self.post.id])
+
+    def test_trending(self):
+        """Check that trending tags are ordered by uses and old uses expire"""
+        actions.create_post(self.bar, '#python again')
+        actions.create_post(self.bar, 'deleted #python')
+        Post.objects.filter(content='deleted #python').delete()
+
+        response = self.client.get('/posts/tags')
+        self.assertEqual([(t.name, t.window_count) for t in response.context['tags']], [('python', 2), ('django', 1)])
+
+        # move all buckets out of the window: reads don't expire them, the scheduled job does
+        TagCount.objects.update(bucket=0)
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(len(tags.trending_tags()), 2)
+        self.assertEqual(len(captured), 1)
+        self.assertTrue(captured[0]['sql'].startswith('SELECT'))
+
+        jobs.TASKS['tags.expire_trending'][0]()
+        self.assertEqual(list(tags.trending_tags()), [])
+        self.assertFalse(TagCount.objects.exists())
+        self.assertContains(self.client.get('/posts/tags'), 'No tags were used lately.')
+
+    def test_expiry_run_once_due(self):
+        """Check that without workers (default settings) expiry is stored then run once due by a later job"""
+        job = Job.objects.get(name='tags.expire_trending')
+        self.assertEqual(job.status, Job.QUEUED)
+
+        # bucket leaves the window
+        TagCount.objects.update(bucket=0)
+        Job.objects.update(run_at=F('created_at'))
+        with self.captureOnCommitCallbacks(execute=True):
+            actions.create_post(self.bar, 'no tags')
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.DONE)
+        self.assertEqual(list(tags.trending_tags()), [])
+
+    @override_settings(NETWORK_JOBS_EAGER=False)
+    def test_expiry_scheduled(self):
+        """Check that expiry is enqueued once per bucket, due when the bucket leaves the window"""
+        Job.objects.all().delete()
+        actions.create_post(self.bar, '#python again')
+        actions.create_post(self.bar, '#django again')
+        actions.create_post(self.bar, 'no tags')
+
+        buckets = set(TagCount.objects.values_list('bucket', flat=True))
+        scheduled = Job.objects.filter(name='tags.expire_trending')
+        self.assertEqual({job.key for job in scheduled}, {f'expire_trending:{bucket}' for bucket in buckets})
+        for job in scheduled:
+            bucket = int(job.key.split(':')[1])
+            self.assertEqual(job.run_at.timestamp(), bucket * tags.bucket_size() + tags.window())
+
+
+class HotPostsTests(TestCase):
+    def setUp(self):
+        """add two users and three posts in db"""
+        self.foo = User.objects.create_user(**foo_credentials)
+        self.bar = User.objects.create_user(**bar_credentials)
+        self.posts = [actions.create_post(self.foo, f'post {i}') for i in range(3)]
+
+    def hot_ids(self, **params):
+        return [p.id for p in self.client.get('/posts/hot', params).context['page']]
+
+    def test_ranked_by_likes(self):
+        """Check that liked posts are ranked by likes (only liked posts are shown)"""
+        first, second, third = self.posts
+        actions.like(self.foo, second)
+        actions.like(self.bar, second)
+        actions.like(self.foo, first)
+        self.assertEqual(self.hot_ids(), [second.id, first.id])
+
+        actions.unlike(self.foo, first)
+        self.assertEqual(self.hot_ids(), [second.id])
+        self.assertEqual(Post.objects.get(pk=first.id).hot_score, 0)
+
+    def older_likes(self, age):
+        """Make likes so far (and the landmark they were weighed against) `age` seconds older"""
+        Like.objects.update(created_at=F('created_at') - datetime.timedelta(seconds=age))
+        HotLandmark.objects.update(timestamp=F('timestamp') - age)
+
+    def test_unlike_removes_weight_of_like(self):
+        """Check that unliking an older like removes the weight it added (not the one of a like made now)"""
+        first, second, third = self.posts
+        actions.like(self.foo, first)
+        actions.like(self.bar, first)
+        self.older_likes(2 * hot.half_life())
+        landmark = HotLandmark.objects.get().timestamp
+        remaining = Like.objects.get(user=self.bar, post=first)
+
+        actions.unlike(self.foo, first)
+        self.assertAlmostEqual(Post.objects.get(pk=first.id).hot_score, hot.weight(remaining.created_at.timestamp(), landmark))
+        self.assertEqual(self.hot_ids(), [first.id])
+
+        # same for batches
+        self.client.login(**bar_credentials)
+        self.client.post(
+            '/api/v1/batch',
+            json.dumps({'operations': [{'op': 'unlike', 'post': first.id}, {'op': 'like', 'post': second.id}]}),
+            content_type='application/json',
+        )
+        self.assertAlmostEqual(Post.objects.get(pk=first.id).hot_score, 0)
+        liked = Like.objects.get(user=self.bar, post=second)
+        self.assertAlmostEqual(Post.objects.get(pk=second.id).hot_score, hot.weight(liked.created_at.timestamp(), landmark))
+
+    def test_rebuild_scores_from_like_times(self):
+        """Check that rebuilt scores match scores kept by likes/unlikes"""
+        first, second, third = self.posts
+        actions.like(self.foo, first)
+        self.older_likes(hot.half_life())
+        actions.like(self.bar, first)
+        actions.like(self.foo, second)
+        scores = dict(Post.objects.values_list('id', 'hot_score'))
+
+        hot.rebuild(now=HotLandmark.objects.get().timestamp)
+        for pk, score in Post.objects.values_list('id', 'hot_score'):
+            self.assertAlmostEqual(score, scores[pk])
+
+    def test_recent_likes_weigh_more(self):
+        """Check that a recent like outranks older likes once they've decayed"""
+        first, second, third = self.posts
+        actions.like(self.foo, first)
+        actions.like(self.bar, first)
+        # two half-lives later: older likes count a quarter of a new one
+        HotLandmark.objects.update(timestamp=F('timestamp') - 2 * hot.half_life())
+        actions.like(self.foo, second)
+        self.assertEqual(self.hot_ids(), [second.id, first.id])
+
+    def test_decay_keeps_order(self):
+        """Check that decaying rescales scores (keeping order) and drops negligible ones"""
+        first, second, third = self.posts
+        actions.like(self.foo, first)
+        actions.like(self.foo, second)
+        actions.like(self.bar, second)
+        before = dict(Post.objects.values_list('id', 'hot_score'))
+
+        landmark = HotLandmark.objects.get().timestamp
+        hot.decay(now=landmark + hot.half_life())
+        after = dict(Post.objects.values_list('id', 'hot_score'))
+        self.assertAlmostEqual(after[second.id], before[second.id] / 2)
+        self.assertEqual(self.hot_ids(), [second.id, first.id])
+
+        # weights of new likes are relative to new landmark (no overflow)
+        actions.like(self.bar, third)
+        self.assertLess(Post.objects.get(pk=third.id).hot_score, 4)
+
+        hot.decay(now=landmark + 100 * hot.half_life())
+        self.assertEqual(self.hot_ids(), [])
+
+    def test_batch_likes_scored(self):
+        """Check that likes of batches update scores too"""
+        first, second, third = self.posts
+        self.client.login(**foo_credentials)
+        response = self.client.post(
+            '/api/v1/batch',
+            json.dumps({'operations': [{'op': 'like', 'post': first.id}, {'op': 'like', 'post': third.id}]}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(self.hot_ids()), {first.id, third.id})
+
+    def test_cursor_pagination(self):
+        """Check that hot feed is paginated by score (infinite scroll included)"""
+        posts = [actions.create_post(self.bar, f'more {i}') for i in range(12)]
+        for post in posts:
+            actions.like(self.foo, post)
+
+        first = self.client.get('/posts/hot')
+        self.assertEqual(len(first.context['page']), 10)
+        cursor = first.context['page'].next_cursor
+        cards = self.client.get('/posts/cards', {'feed': 'hot', 'cursor': cursor})
+        ids = [p.id for p in first.context['page']] + [p.id for p in cards.context['page']]
+        self.assertEqual(sorted(ids), sorted(p.id for p in posts))
+
+
+class RecommendationsTests(TestCase):
+    def setUp(self):
+        """add users following each other in db
+
+        foo follows bar and baz, both of them follow qux, bar follows quux
+        """
+        self.foo = User.objects.create_user(**foo_credentials)
+        self.bar = User.objects.create_user(**bar_credentials)
+        self.baz = User.objects.create_user(**baz_credentials)
+        self.qux = User.objects.create_user(username='qux', password='qux')
+        self.quux = User.objects.create_user(username='quux', password='quux')
+        for follower, friend in [
+            (self.foo, self.bar), (self.foo, self.baz),
+            (self.bar, self.qux), (self.baz, self.qux), (self.bar, self.quux),
+        ]:
+            follower.friends.add(friend)
+
+    def write(self, action, *args):
+        # (recommendations are refreshed once writes are committed)
+        with self.captureOnCommitCallbacks(execute=True):
+            return action(*args)
+
+    def recommended(self, user):
+        return list(user.recommendations.order_by('-mutual_count', 'candidate').values_list('candidate__username', 'mutual_count'))
+
+    def test_graph(self):
+        """Check that follow graph is loaded as compact arrays"""
+        graph = recommendations.load_graph()
+        self.assertEqual(graph.edges, 5)
+        self.assertEqual(list(graph.friends(self.foo.id)), sorted([self.bar.id, self.baz.id]))
+        self.assertEqual(list(graph.friends(self.qux.id)), [])
+        self.assertEqual(list(graph.friends(self.quux.id + 100)), [])
+        self.assertEqual(
+            recommendations.candidates(graph, self.foo.id),
+            [(self.qux.id, 2), (self.quux.id, 1)],
+        )
+
+    def test_compute_all(self):
+        """Check that recommendations of all users are persisted (friends excluded)"""
+        out = StringIO()
+        call_command('compute_recommendations', stdout=out)
+        self.assertIn('Computed 2 recommendation(s) from 5 follow(s)', out.getvalue())
+        self.assertEqual(self.recommended(self.foo), [('qux', 2), ('quux', 1)])
+        self.assertEqual(self.recommended(self.bar), [])
+
+    def test_incremental(self):
+        """Check that follow/unfollow refresh recommendations of follower and their followers"""
+        recommendations.compute_all()
+
+        # foo follows qux: qux is no longer recommended to foo
+        self.assertTrue(self.write(actions.follow, self.foo, self.qux))
+        self.assertEqual(self.recommended(self.foo), [('quux', 1)])
+
+        # bar unfollows quux: one less of foo's friends follows quux
+        self.assertTrue(self.write(actions.unfollow, self.bar, self.quux))
+        self.assertEqual(self.recommended(self.foo), [])
+
+        # baz then bar follow quux: foo's friends following quux (inserted then incremented)
+        self.assertTrue(self.write(actions.unfollow, self.foo, self.qux))
+        self.assertEqual(self.recommended(self.foo), [('qux', 2)])
+        self.assertTrue(self.write(actions.follow, self.baz, self.quux))
+        self.assertEqual(self.recommended(self.foo), [('qux', 2), ('quux', 1)])
+        self.assertTrue(self.write(actions.follow, self.bar, self.quux))
+        self.assertEqual(self.recommended(self.foo), [('qux', 2), ('quux', 2)])
+
+    @override_settings(NETWORK_RECOMMENDATIONS=1)
+    def test_incremental_keeps_top(self):
+        """Check that incremental updates keep only the top recommendations of each user"""
+        recommendations.compute_all()
+        self.assertEqual(self.recommended(self.foo), [('qux', 2)])
+
+        # baz follows quux: quux (cut off by compute_all) would be foo's second recommendation
+        self.assertTrue(self.write(actions.follow, self.baz, self.quux))
+        self.assertEqual(self.recommended(self.foo), [('qux', 2)])
+
+        # still inserted (then counted) while foo has room for it
+        self.assertTrue(self.write(actions.unfollow, self.bar, self.qux))
+        self.assertTrue(self.write(actions.unfollow, self.baz, self.qux))
+        self.assertEqual(self.recommended(self.foo), [])
+        corge = User.objects.create_user(username='corge', password='corge')
+        self.assertTrue(self.write(actions.follow, self.bar, corge))
+        self.assertTrue(self.write(actions.follow, self.baz, corge))
+        self.assertEqual(self.recommended(self.foo), [('corge', 2)])
+
+    def test_view(self):
+        """Check that who to follow page lists recommendations of current user"""
+        self.assertEqual(self.client.get('/users/who-to-follow').status_code, 401)
+
+        recommendations.compute_all()
+        self.client.login(**foo_credentials)
+        response = self.client.get('/users/who-to-follow')
+        self.assertEqual([r.candidate for r in response.context['recommendations']], [self.qux, self.quux])
+        self.assertContains(response, 'followed by 2 of your friends')
+
+
+# fails the first `failures` times it runs (for each key)
+flaky_runs = {}
+
+@jobs.task('tests.flaky', max_attempts=3)
+def flaky(key, failures):
+    flaky_runs[key] = flaky_runs.get(key, 0) + 1
+    if flaky_runs[key] <= failures:
+        raise ValueError('flaky failure')
+
+
+@override_settings(NETWORK_JOBS_EAGER=False)
+class JobsTests(TransactionTestCase):
+    def setUp(self):
+        """add a user followed by another one in db"""
+        self.foo = User.objects.create_user(**foo_credentials)
+        self.bar = User.objects.create_user(**bar_credentials)
+        self.bar.friends.add(self.foo)
+
+    def make_due(self):
+        # skip backoff delays
+        Job.objects.filter(status=Job.QUEUED).update(run_at=F('created_at'))
+
+    def test_fan_out_in_background(self):
+        """Check that creating a post enqueues fan-out (once) which workers run later"""
+        post = actions.create_post(self.foo, 'some content')
+        self.assertFalse(TimelineEntry.objects.exists())
+        job = Job.objects.get()
+        self.assertEqual((job.name, job.args, job.status), ('timeline.fan_out', [post.id], Job.QUEUED))
+
+        # same idempotency key: not enqueued again
+        self.assertFalse(jobs.enqueue('timeline.fan_out', post.id, key=f'fan_out:{post.id}'))
+
+        out = StringIO()
+        call_command('run_jobs', once=True, threads=2, stdout=out)
+        self.assertIn('Ran 1 job(s)', out.getvalue())
+        self.assertEqual(list(self.bar.timeline.values_list('post', flat=True)), [post.id])
+        self.assertEqual(Job.objects.get().status, Job.DONE)
+
+    def test_retries_with_backoff(self):
+        """Check that failed jobs are retried later (backoff) until they succeed or run out of attempts"""
+        jobs.enqueue('tests.flaky', 'retried', 1)
+        jobs.enqueue('tests.flaky', 'failed', 5)
+
+        self.assertEqual(jobs.work(once=True), 2)
+        for job in Job.objects.all():
+            self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+            self.assertGreater(job.run_at, job.started_at)
+            self.assertIn('flaky failure', job.error)
+        # not due yet
+        self.assertEqual(jobs.work(once=True), 0)
+
+        self.make_due()
+        jobs.work(once=True)
+        self.make_due()
+        jobs.work(once=True)
+        self.assertEqual(Job.objects.get(args=['retried', 1]).status, Job.DONE)
+        failed = Job.objects.get(args=['failed', 5])
+        self.assertEqual((failed.status, failed.attempts), (Job.FAILED, 3))
+        self.assertEqual(flaky_runs['failed'], 3)
+
+    @override_settings(NETWORK_JOBS_EAGER=True)
+    def test_eager(self):
+        """Check that eager tasks run once the write commits and failed ones are retried later (write is kept)"""
+        with transaction.atomic():
+            post = Post.objects.create(content='some content', user=self.foo)
+            jobs.enqueue('tests.flaky', 'eager', 1)
+            self.assertNotIn('eager', flaky_runs)
+        self.assertTrue(Post.objects.filter(pk=post.pk).exists())
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertIn('flaky failure', job.error)
+
+        # due jobs are run by the next eager run
+        self.make_due()
+        jobs.enqueue('tests.flaky', 'next', 0)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.DONE)
+        self.assertEqual(flaky_runs['eager'], 2)
+
+    def test_stale_jobs(self):
+        """Check that jobs abandoned by crashed workers are run again"""
+        jobs.enqueue('tests.flaky', 'stale', 0)
+        [job] = jobs.claim()
+        self.assertEqual(jobs.claim(), [])
+
+        Job.objects.update(started_at=job.started_at - datetime.timedelta(seconds=jobs.stale_timeout() + 1))
+        self.assertEqual(jobs.requeue_stale(), 1)
+        self.assertEqual(jobs.work(once=True), 1)
+        self.assertEqual(Job.objects.get().status, Job.DONE)
+
+    def test_metrics(self):
+        """Check that queue depth and job latency are exposed"""
+        registry.clear()
+        jobs.enqueue('tests.flaky', 'metrics', 0)
+        content = read_metrics(self.client)
+        self.assertIn('network_jobs{status="queued"} 1', content)
+
+        jobs.work(once=True)
+        content = read_metrics(self.client)
+        self.assertIn('network_jobs{status="done"} 1', content)
+        self.assertIn('network_job_duration_seconds_count{job="tests.flaky"} 1', content)
+        self.assertIn('network_job_wait_seconds_bucket{job="tests.flaky",le="+Inf"} 1', content)
+
+
+class SqliteBackendTests(TransactionTestCase):
+    def test_pragmas(self):
+        """Check that connections use WAL and wait for locks"""
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+
+    def test_transactions_serialized(self):
+        """Check that write transactions of threads run one after another (none fails)"""
+        User.objects.create_user(**foo_credentials)
+        active, overlaps = [0], []
+
+        def write(i):
+            try:
+                with transaction.atomic():
+                    # read then write (a deferred transaction could fail to upgrade its lock)
+                    user = User.objects.get(username='foo')
+                    active[0] += 1
+                    overlaps.append(active[0])
+                    time.sleep(0.01)
+                    User.objects.filter(pk=user.pk).update(friends_count=F('friends_count') + 1)
+                    active[0] -= 1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=write, args=[i]) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(User.objects.get(username='foo').friends_count, 8)
+        self.assertEqual(max(overlaps), 1)
+
+    def test_benchmark(self):
+        """Check that sqlite benchmark compares default and tuned settings"""
+        call_command('generate_graph', users=4, follows=1, posts=1, likes=0, stdout=StringIO())
+        out = StringIO()
+
+        call_command('benchmark', suite=['sqlite'], requests=6, workers=2, stdout=out)
+
+        results = json.loads(out.getvalue())['sqlite']
+        for profile in ['default', 'tuned']:
+            self.assertEqual(results[profile]['operations'], 6)
+            self.assertEqual(results[profile]['errors'], 0)
+        # benchmark cleaned up after itself
+        self.assertFalse(Post.objects.filter(content='sqlite benchmark').exists())
+        self.assertEqual(User.likes.through.objects.count(), 0)
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+
+
+
+# replicas mirror the test db (check: settings.DATABASES) so they see what's committed,
+# a read transaction held on them (a snapshot, in WAL mode) makes them lag behind
+# (async views run their queries in this thread, which holds the snapshots)
+@override_settings(NETWORK_REPLICAS=['replica1', 'replica2'], NETWORK_ASYNC_PARALLEL_QUERIES=False)
+class ReplicaTests(TransactionTestCase):
+    databases = {'default', 'replica1', 'replica2'}
+
+    def setUp(self):
+        """Create a user and a post (both replicated), login then make replicas lag"""
+        self.user = User.objects.create_user(**foo_credentials)
+        self.post = Post.objects.create(content='replicated post', user=self.user)
+        self.client.login(**foo_credentials)
+        self.lag()
+        self.addCleanup(self.catch_up)
+
+    def lag(self):
+        for alias in ['replica1', 'replica2']:
+            with connections[alias].cursor() as cursor:
+                cursor.execute('BEGIN')
+                cursor.execute('SELECT COUNT(*) FROM network_post')
+
+    def catch_up(self):
+        for alias in ['replica1', 'replica2']:
+            if connections[alias].connection.in_transaction:
+                with connections[alias].cursor() as cursor:
+                    cursor.execute('COMMIT')
+
+    def test_feeds_read_from_replica(self):
+        """Check that feeds don't show posts that haven't reached replicas yet"""
+        Post.objects.create(content='lagging post', user=self.user)
+        for url in ['/', f'/{self.user.username}', '/async/']:
+            response = self.client.get(url)
+            self.assertContains(response, 'replicated post')
+            self.assertNotContains(response, 'lagging post')
+
+        self.catch_up()
+        self.assertContains(self.client.get('/'), 'lagging post')
+
+    def test_writes_pin_client_to_primary(self):
+        """Check that authors see their new post right after posting (before it's replicated)"""
+        response = self.client.post('/posts/create', {'content': 'new post'}, follow=True)
+        self.assertContains(response, 'new post')
+        self.assertIn(replicas.PIN_COOKIE, self.client.cookies)
+        self.assertEqual(Post.objects.using('replica1').filter(content='new post').count(), 0)
+
+    def test_pin_expires(self):
+        """Check that pinned clients read from replicas again once their pin ends"""
+        Post.objects.create(content='lagging post', user=self.user)
+        self.client.cookies[replicas.PIN_COOKIE] = str(time.time() + 60)
+        self.assertContains(self.client.get('/'), 'lagging post')
+
+        self.client.cookies[replicas.PIN_COOKIE] = str(time.time() - 1)
+        self.assertNotContains(self.client.get('/'), 'lagging post')
+
+    def test_reads_use_primary_outside_feeds(self):
+        """Check that writes and reads outside feed views never use replicas"""
+        self.assertEqual(Post.objects.all().db, 'default')
+        response = self.client.post(f'/posts/{self.post.id}/like')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(replicas.PIN_COOKIE, response.cookies)
+        self.assertEqual(Post.objects.get(pk=self.post.id).likes_count, 1)
+        self.assertEqual(Post.objects.using('replica1').get(pk=self.post.id).likes_count, 0)
+
+    def test_benchmark_counts_replica_queries(self):
+        """Check that benchmarks count queries (and rows) of feeds read from replicas"""
+        self.catch_up()
+        measured = benchmark.measure(1, lambda: self.client.get('/'))
+        with override_settings(NETWORK_REPLICAS=[]):
+            expected = benchmark.measure(1, lambda: self.client.get('/'))
+        self.assertEqual((measured['queries'], measured['rows_read']), (expected['queries'], expected['rows_read']))
+
+    @override_settings(NETWORK_REPLICAS=[])
+    def test_no_replicas(self):
+        """Check that without replicas feeds read from the primary"""
+        Post.objects.create(content='lagging post', user=self.user)
+        self.assertContains(self.client.get('/'), 'lagging post')
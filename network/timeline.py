@@ -0,0 +1,222 @@
+"""Home timelines (Following feed) materialized per user
+
+when a user creates a post, it gets pushed into timelines of their followers
+(fan-out on write), then reading the Following feed is a lookup of
+TimelineEntry rows by owner instead of joining friends and all posts.
+
+celebrities (users with too many followers) aren't fanned out
+as that would write a row per follower for every post they create,
+instead their posts are pulled when reading timelines (hybrid push/pull).
+"""
+import heapq
+
+from django.conf import settings
+from django.db.models import F, OuterRef, Q, Subquery
+
+from .models import User, Post, TimelineEntry
+from .utils import keyset_filter, value_of
+
+
+def timeline_length():
+    """Max number of entries kept per timeline"""
+    return getattr(settings, 'NETWORK_TIMELINE_LENGTH', 800)
+
+def celebrity_threshold():
+    """Users with more followers than this aren't fanned out (their posts are pulled)"""
+    return getattr(settings, 'NETWORK_TIMELINE_CELEBRITY_THRESHOLD', 10000)
+
+def is_celebrity(user):
+    return user.followers_count > celebrity_threshold()
+
+
+def _follower_ids(user):
+    # when foo follows bar: from_user=foo (follower), to_user=bar (friend)
+    return list(
+        User.friends.through.objects
+        .filter(to_user=user.id)
+        .values_list('from_user', flat=True)
+    )
+
+def _add_entries(owner_ids, posts):
+    """Insert entries (owner, post) for every owner and post then trim timelines"""
+    entries = [
+        TimelineEntry(owner_id=owner_id, post_id=post_id, created_at=created_at)
+        for owner_id in owner_ids
+        for post_id, created_at in posts
+    ]
+    TimelineEntry.objects.bulk_create(entries, batch_size=500, ignore_conflicts=True)
+    trim(owner_ids)
+
+
+def fan_out(post):
+    """Push a new post into timelines of its author followers"""
+    if is_celebrity(post.user):
+        return
+    _add_entries(_follower_ids(post.user), [(post.id, post.created_at)])
+
+def backfill(follower, user_followed):
+    """Push recent posts of a newly followed user into follower's timeline"""
+    if is_celebrity(user_followed):
+        return
+    posts = user_followed.posts.values_list('id', 'created_at')[:timeline_length()]
+    _add_entries([follower.id], list(posts))
+
+def remove(follower, user_unfollowed):
+    """Drop posts of an unfollowed user from follower's timeline"""
+    TimelineEntry.objects.filter(owner=follower, post__user=user_unfollowed).delete()
+
+def _past_length(owner_ids):
+    """Ids of the first entry past timeline_length of each timeline (null for shorter ones)
+
+    read through timeline_owner_created_idx in order (no sort), a short read per timeline
+    """
+    length = timeline_length()
+    first_past = (
+        TimelineEntry.objects.filter(owner=OuterRef('pk'))
+        .order_by('-created_at', '-post_id').values('id')[length:length + 1]
+    )
+    return User.objects.filter(pk__in=owner_ids).annotate(first_past=Subquery(first_past)).values('first_past')
+
+def trim(owner_ids, chunk_size=500):
+    """Keep only the most recent (timeline_length) entries of the given timelines
+
+    only timelines longer than that (eg. not most followers of an author) are written to
+    """
+    owner_ids = list(owner_ids)
+    for i in range(0, len(owner_ids), chunk_size):
+        cutoffs = TimelineEntry.objects.filter(pk__in=_past_length(owner_ids[i:i + chunk_size]))
+        trimmed = Q()
+        for owner_id, created_at, post_id in cutoffs.values_list('owner', 'created_at', 'post'):
+            # first entry past the length and older ones
+            older = keyset_filter('n', 'created_at', created_at, post_id, id_key='post')
+            trimmed |= Q(owner=owner_id) & (older | Q(created_at=created_at, post=post_id))
+        if trimmed:
+            TimelineEntry.objects.filter(trimmed).delete()
+
+
+class TimelinePosts:
+    """Posts of a home timeline: pushed posts (timeline entries) merged with pulled posts of celebrities
+
+    both are read in (created_at, id) order from their own index
+    (timeline_owner_created_idx and post_user_created_idx) and only as many rows
+    as a page needs, so reading a page doesn't depend on the length of the timeline.
+    paginated like querysets of other feeds (check: network/utils.py)
+    and select_related()/only()/values() apply to both.
+    nothing is read until a page is (like querysets, eg. built in async views)
+    """
+    model = Post
+    ordered = True
+
+    def __init__(self, user, methods=()):
+        self.user = user
+        # queryset methods applied to pushed and pulled posts (name, args, kwargs)
+        self.methods = methods
+        self._sources = None
+
+    def _apply(self, method, *args, **kwargs):
+        return TimelinePosts(self.user, (*self.methods, (method, args, kwargs)))
+
+    def select_related(self, *fields):
+        return self._apply('select_related', *fields)
+
+    def only(self, *fields):
+        return self._apply('only', *fields)
+
+    def values(self, *fields, **expressions):
+        return self._apply('values', *fields, **expressions)
+
+    @property
+    def sources(self):
+        """(pushed, pulled) posts querysets"""
+        if self._sources is None:
+            celebrities = list(
+                self.user.friends
+                .filter(followers_count__gt=celebrity_threshold())
+                .values_list('id', flat=True)
+            )
+            pushed = (
+                Post.objects
+                .filter(timeline_entries__owner=self.user)
+                # order by timeline entries (same times as their posts) to read their index
+                .annotate(entry_created_at=F('timeline_entries__created_at'), entry_post=F('timeline_entries__post'))
+            )
+            # nothing to pull (and no query) for most users
+            pulled = Post.objects.none()
+            if celebrities:
+                # entries of users that became celebrities after fan-out (their posts are pulled)
+                pushed = pushed.exclude(user__in=celebrities)
+                pulled = Post.objects.filter(user__in=celebrities)
+            for method, args, kwargs in self.methods:
+                pushed = getattr(pushed, method)(*args, **kwargs)
+                pulled = getattr(pulled, method)(*args, **kwargs)
+            self._sources = pushed, pulled
+        return self._sources
+
+    @property
+    def query(self):
+        return self.sources[0].query
+
+    def count(self):
+        pushed, pulled = self.sources
+        return pushed.count() + pulled.count()
+
+    def ordered_sources(self, direction='n', key_value=None, id=None):
+        """Pushed and pulled posts after ('n') or before ('p') the row at (key_value, id)
+
+        ordered by their index: descending ('n') or ascending ('p')
+        """
+        pushed, pulled = self.sources
+        sign = '-' if direction == 'n' else ''
+        pushed = pushed.order_by(f'{sign}entry_created_at', f'{sign}entry_post')
+        pulled = pulled.order_by(f'{sign}created_at', f'{sign}id')
+        if key_value is not None:
+            pushed = pushed.filter(keyset_filter(direction, 'entry_created_at', key_value, id, id_key='entry_post'))
+            pulled = pulled.filter(keyset_filter(direction, 'created_at', key_value, id))
+        return pushed, pulled
+
+    def keyset_rows(self, direction, key, key_value, id, limit):
+        """First `limit` posts after ('n') or before ('p') the row at (key_value, id) (nearest first)"""
+        if key != 'created_at':
+            raise ValueError('timelines are ordered by created_at')
+        if limit == 0:
+            return []
+        pushed, pulled = self.ordered_sources(direction, key_value, id)
+
+        pushed = list(pushed[:limit])
+        if len(pushed) == limit:
+            # pulled posts past the last pushed one can't make it into the page
+            lookup = 'created_at__gte' if direction == 'n' else 'created_at__lte'
+            pulled = pulled.filter(**{lookup: value_of(pushed[-1], 'created_at')})
+        pulled = list(pulled[:limit])
+
+        rows = heapq.merge(
+            pushed, pulled,
+            key=lambda row: (value_of(row, 'created_at'), value_of(row, 'id')),
+            reverse=direction == 'n',
+        )
+        return list(rows)[:limit]
+
+    def __getitem__(self, index):
+        # pages of page-number pagination (ie. [offset:offset + page_size])
+        if not isinstance(index, slice) or index.step is not None:
+            raise TypeError('timelines only support slicing')
+        start, stop = index.start or 0, index.stop
+        return self.keyset_rows('n', 'created_at', None, None, stop)[start:stop]
+
+
+def timeline_posts(user):
+    """Return posts of user home timeline (ie. posts of their friends)
+
+    pushed posts are read from user timeline entries
+    and posts of celebrities they follow are pulled at read time.
+    """
+    return TimelinePosts(user)
+
+
+def rebuild(users=None):
+    """(Re)build timelines from scratch (eg. for users that existed before timelines)"""
+    users = User.objects.all() if users is None else users
+    for user in users.iterator():
+        TimelineEntry.objects.filter(owner=user).delete()
+        for friend in user.friends.all():
+            backfill(user, friend)
@@ -1,18 +1,39 @@
 from django.urls import path
 
-from . import views
+from . import api, metrics, views
 
 
 urlpatterns = [
     path("", views.index, name="index"),
 
     # post-related routes
+    # (new pages go under a prefix: a top-level /<name> would shadow profile of user <name>)
     path('posts/create', views.create_post, name='create_post'),
+    path('posts/cards', views.post_cards, name='post_cards'),
     path('posts/<int:post_id>/edit', views.edit_post, name='edit_post'),
     path('following', views.friends_posts, name='following'),
+    path('posts/hot', views.hot_posts, name='hot'),
+    path('posts/search', views.search, name='search'),
+    path('posts/mentions', views.mentions, name='mentions'),
+    path('posts/tags', views.trending, name='trending'),
+    path('posts/tags/<str:name>', views.tag_posts, name='tag'),
+    path('users/who-to-follow', views.who_to_follow, name='who_to_follow'),
     path('posts/<int:post_id>/like', views.like_post, name='like_post'),
     path('posts/<int:post_id>/unlike', views.unlike_post, name='unlike_post'),
 
+    # json api routes
+    path('api/v1/batch', api.batch, name='api_batch'),
+    path('api/v1/posts', api.posts_feed, name='api_posts'),
+    path('api/v1/posts/<int:post_id>/like', api.like_post, name='api_like_post'),
+    path('api/v1/posts/<int:post_id>/unlike', api.unlike_post, name='api_unlike_post'),
+    path('api/v1/following', api.following_feed, name='api_following'),
+    path('api/v1/users/<str:username>/posts', api.user_posts_feed, name='api_user_posts'),
+    path('api/v1/users/<str:username>/follow', api.follow, name='api_follow'),
+    path('api/v1/users/<str:username>/unfollow', api.unfollow, name='api_unfollow'),
+
+    # metrics (prometheus text format)
+    path('internal/metrics', metrics.metrics, name='metrics'),
+
     # user-related routes
     path('<str:username>', views.profile, name='profile'),
     path('<str:username>/follow', views.follow, name='follow'),
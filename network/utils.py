@@ -1,12 +1,225 @@
+import base64
+import collections.abc
+import datetime
+import json
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.core.paginator import Paginator, InvalidPage
+from django.db import connections
+from django.db.models import Q
+
+
+# show 10 posts per page
+PAGE_SIZE = 10
 
 
 def get_page(posts, page_number):
-    # show 10 posts per page
-    paginator = Paginator(posts, 10)
+    paginator = Paginator(posts, PAGE_SIZE)
     try:
         page = paginator.page(page_number)
     # handle wrong page number: page_num < 1, page_num > max_page_num
     except InvalidPage:
         page = None
     return page
+
+
+class CursorPage(collections.abc.Sequence):
+    """A page of items produced by keyset (cursor) pagination
+
+    unlike django's Page, it knows nothing about total count/number of pages
+    only whether there are items before/after it
+    and the (opaque) cursors that point at them.
+    """
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+def _encode_value(value):
+    # keep microseconds (DjangoJSONEncoder truncates them to milliseconds)
+    # otherwise rows created within the same millisecond get skipped
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not cursor serializable')
+
+def encode_cursor(direction, key_value, id):
+    payload = json.dumps([direction, key_value, id], default=_encode_value)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Return (direction, key_value, id) or None if cursor is malformed"""
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        direction, key_value, id = json.loads(base64.urlsafe_b64decode(cursor + padding))
+    except (ValueError, TypeError):
+        return None
+    if direction not in ('n', 'p') or not isinstance(id, int):
+        return None
+    return direction, key_value, id
+
+
+def value_of(item, field):
+    # items could be model instances or dicts (ie. rows of .values())
+    if isinstance(item, dict):
+        return item[field]
+    return getattr(item, field)
+
+
+def _parse_key_value(items, key, value):
+    # cursors come from clients, so their key value is parsed by the field it's compared to
+    # (a model field or an annotation, eg. search rank)
+    if key in items.query.annotations:
+        field = items.query.annotations[key].output_field
+    else:
+        field = items.model._meta.get_field(key)
+    value = field.to_python(value)
+    if value is None:
+        raise ValidationError('cursor has no key value')
+    return value
+
+
+def _parse_cursor(items, cursor, key):
+    # (direction, key_value, id) of a cursor (or None if it's malformed), no query involved
+    decoded = decode_cursor(cursor)
+    if decoded is None:
+        return None
+    direction, key_value, id = decoded
+    try:
+        return direction, _parse_key_value(items, key, key_value), id
+    except (ValidationError, TypeError, ValueError):
+        return None
+
+
+def keyset_filter(direction, key, key_value, id, id_key='id'):
+    """Filter items after ('n') or before ('p') the row at (key_value, id) in (key, id) order
+
+    a bare OR (key < v or (key = v and id < i)) makes sqlite scan the whole index
+    bounding key first (key <= v) turns it into a range search on the (key, id) index.
+    """
+    op = 'lt' if direction == 'n' else 'gt'
+    return Q(**{f'{key}__{op}e': key_value}) & (
+        Q(**{f'{key}__{op}': key_value}) | Q(**{key: key_value, f'{id_key}__{op}': id})
+    )
+
+
+def _keyset_rows(items, direction, key, key_value, id, limit):
+    # rows after ('n', descending) or before ('p', ascending) the cursor row
+    # merged feeds (eg. home timelines, check: network/timeline.py) read their own rows
+    if hasattr(items, 'keyset_rows'):
+        return items.keyset_rows(direction, key, key_value, id, limit)
+    sign = '-' if direction == 'n' else ''
+    rows = items.order_by(f'{sign}{key}', f'{sign}id')
+    if key_value is not None:
+        rows = rows.filter(keyset_filter(direction, key, key_value, id))
+    return list(rows[:limit])
+
+
+def get_cursor_page(items, cursor=None, key='created_at', page_size=PAGE_SIZE):
+    """Paginate items in descending (key, id) order using a cursor
+
+    no COUNT(*) and no OFFSET: each page is a range scan that starts
+    right after (or before) the row the cursor points at.
+    cursors are opaque strings: (direction, key, id) encoded as base64 json.
+    return None for malformed cursors (like get_page does for wrong page numbers).
+    """
+    if not cursor:
+        direction, key_value, id = 'n', None, None
+    else:
+        decoded = _parse_cursor(items, cursor, key)
+        if decoded is None:
+            return None
+        direction, key_value, id = decoded
+
+    rows = _keyset_rows(items, direction, key, key_value, id, page_size + 1)
+    if direction == 'n':
+        has_next, has_previous = len(rows) > page_size, bool(cursor)
+        rows = rows[:page_size]
+    else:
+        # walked backwards (ascending order) so flip rows back
+        has_next, has_previous = True, len(rows) > page_size
+        rows = rows[:page_size][::-1]
+
+    next_cursor = previous_cursor = None
+    if rows and has_next:
+        next_cursor = encode_cursor('n', value_of(rows[-1], key), value_of(rows[-1], 'id'))
+    if rows and has_previous:
+        previous_cursor = encode_cursor('p', value_of(rows[0], key), value_of(rows[0], 'id'))
+    return CursorPage(rows, next_cursor, previous_cursor)
+
+
+def continuation_cursor(page):
+    """Return the cursor of items right after page (None if it's the last page)
+
+    works for page-number pages as well
+    so that clients could continue any page using cursor pagination
+    """
+    if not page.has_next():
+        return None
+    if isinstance(page, CursorPage):
+        return page.next_cursor
+    last = page[len(page) - 1]
+    return encode_cursor('n', value_of(last, 'created_at'), value_of(last, 'id'))
+
+
+def _uses_cursor(request):
+    return 'cursor' in request.GET or getattr(settings, 'NETWORK_PAGINATION', 'page') == 'cursor'
+
+
+def get_request_page(request, items):
+    """Return the page of items requested by current request
+
+    cursor pagination is used if request has a cursor param (?cursor=...)
+    or if it's enabled project-wide (settings.NETWORK_PAGINATION = 'cursor')
+    otherwise fallback to page-number pagination (?page=N)
+    """
+    if _uses_cursor(request):
+        return get_cursor_page(items, request.GET.get('cursor'))
+    return get_page(items, request.GET.get('page', 1))
+
+
+def is_valid_page_request(request, items):
+    """Check the page requested by current request (like get_request_page) without running a query
+
+    only malformed requests fail (eg. ?page=0, broken cursors)
+    page numbers past the end aren't known until items are counted.
+    """
+    if _uses_cursor(request):
+        cursor = request.GET.get('cursor')
+        return not cursor or _parse_cursor(items, cursor, 'created_at') is not None
+    try:
+        return int(request.GET.get('page', 1)) >= 1
+    except (TypeError, ValueError):
+        return False
+
+
+def close_pool_connections(executor, workers):
+    """Close db connections of every thread of a pool (kept alive by CONN_MAX_AGE)
+
+    each thread runs exactly one close (they wait for each other) so connections
+    don't outlive the pool (open connections keep file handles and block journal mode changes).
+    return futures of the closes
+    """
+    barrier = threading.Barrier(workers)
+
+    def close():
+        try:
+            barrier.wait(timeout=10)
+        except threading.BrokenBarrierError:
+            pass
+        connections.close_all()
+    return [executor.submit(close) for _ in range(workers)]
@@ -1,63 +1,62 @@
 import json
-from urllib.parse import urlparse
+from urllib.parse import urlencode, urlparse
 
 from django.http import HttpResponse, HttpResponseRedirect, HttpResponseNotAllowed, Http404, JsonResponse, HttpResponseBadRequest
-from django.shortcuts import redirect, render
+from django.shortcuts import redirect
 from django.urls import reverse
 
-from .models import User, Post
-from .utils import get_page
-
+from . import actions, hot, recommendations, tags, timeline
+from .models import User, Post, Tag
+from .feeds import annotate_page, feed_posts
+from .middleware import render
+from .page_cache import cache_anonymous_page, conditional_page, following_scopes, index_scopes, profile_scopes
+from .replicas import replica_reads
+from .search import search_posts
+from .streaming import render_page
+from .utils import get_cursor_page, get_request_page
+
+@replica_reads
+@conditional_page(index_scopes)
+@cache_anonymous_page(index_scopes)
 def index(request):
-    posts = Post.objects.all()
-    page_number = request.GET.get('page', 1)
-
-    page = get_page(posts, page_number)
-    if page is None:
-        raise Http404()
-
-    return render(request, "network/index.html", {
-        'page': page,
+    # page-number (?page=N) or cursor (?cursor=...) pagination
+    # (streamed: layout head is sent before running the feed query)
+    return render_page(request, "network/index.html", feed_posts(Post.objects.all()), {
+        'cards_url': _cards_url('index'),
     })
 
+@replica_reads
+@conditional_page(profile_scopes)
+@cache_anonymous_page(profile_scopes)
 def profile(request, username):
     try:
         user = User.objects.get(username=username)
     except User.DoesNotExist:
         raise Http404()
 
-    user_posts = user.posts.all()
-    page_number = request.GET.get('page', 1)
-
-    page = get_page(user_posts, page_number)
-    if page is None:
-        raise Http404()
-
     # check if current user is already following the user whose profile is shown
     is_following = (
         request.user.is_authenticated
         and request.user.friends.filter(pk=user.id).exists()
     )
-    # control when to show follow button
-    can_follow = (
-        request.user.is_authenticated
-        and request.user != user
-        and not is_following
-    )
-    # control when to show unfollow button
-    can_unfollow = (
-        request.user.is_authenticated
-        and request.user != user
-        and is_following
-    )
 
-    return render(request, 'network/profile.html', {
+    # page-number (?page=N) or cursor (?cursor=...) pagination
+    # (streamed: layout head is sent before running the feed query)
+    return render_page(request, 'network/profile.html', feed_posts(user.posts.all()), {
         'user': user,
-        'page': page,
-        'can_follow': can_follow,
-        'can_unfollow': can_unfollow,
+        'cards_url': _cards_url('profile', username=user.username),
+        **_follow_buttons(request.user, user, is_following),
     })
 
+def _follow_buttons(current_user, user, is_following):
+    """Control when to show follow/unfollow buttons on a user profile"""
+    # users can't follow/unfollow themselves
+    can_change = current_user.is_authenticated and current_user != user
+    return {
+        'can_follow': can_change and not is_following,
+        'can_unfollow': can_change and is_following,
+    }
+
 
 def create_post(request):
     # validate the request first
@@ -71,7 +70,8 @@ def create_post(request):
 
     # start processing the request
     content = request.POST['content']
-    p = Post.objects.create(content=content, user=request.user)
+    # (also pushes it into timelines of user followers)
+    p = actions.create_post(request.user, content)
 
     return redirect(reverse('index'))
 
@@ -96,8 +96,7 @@ def edit_post(request, post_id):
     # load request data and replace post content with it
     data = json.loads(request.body)
     updated_content = data.get('content')
-    post.content = updated_content
-    post.save()
+    actions.edit_post(post, updated_content)
     
     # DON'T SEND WHOLE MODEL INSTANCE
     # cuz it requires more config to work (serialization... which isn't too straightforward)
@@ -125,15 +124,11 @@ def follow(request, username):
     if user_to_follow == request.user:
         return HttpResponseBadRequest("You can't follow yourself!")
 
+    # update relation and friends/followers counters
     # users can't follow users they already follow!
-    if request.user.friends.filter(pk=user_to_follow.id).exists():
+    if not actions.follow(request.user, user_to_follow):
         return HttpResponseBadRequest(f"You're already following {user_to_follow.username}")
 
-    # when foo follows bar
-    # bar is a friend to foo, foo is a follower to bar
-    request.user.friends.add(user_to_follow)
-    user_to_follow.followers.add(request.user)
-
     # redirect to user_to_follow profile
     return redirect(reverse('profile', kwargs={'username': username}))
 
@@ -155,18 +150,16 @@ def unfollow(request, username):
     if user_to_unfollow == request.user:
         return HttpResponseBadRequest("You can't unfollow yourself!")
 
+    # update relation and friends/followers counters
     # users can't unfollow users they aren't friends with! (ie. aren't following)
-    if not request.user.friends.filter(pk=user_to_unfollow.id).exists():
+    if not actions.unfollow(request.user, user_to_unfollow):
         return HttpResponseBadRequest(f"You can't unfollow {user_to_unfollow.username} as you aren't friends with them.")
 
-    # when foo unfollows bar
-    # bar is no longer a friend to foo, foo is no longer a follower to bar
-    request.user.friends.remove(user_to_unfollow)
-    user_to_unfollow.followers.remove(request.user)
-
     # redirect to user_to_unfollow profile
     return redirect(reverse('profile', kwargs={'username': username}))
 
+@replica_reads
+@conditional_page(following_scopes)
 def friends_posts(request):
     """View posts created by current user friends"""
     # only available for logged-in users
@@ -174,17 +167,164 @@ def friends_posts(request):
         return HttpResponse(status=401)
 
     # find posts whose owners have current user as a follower
-    posts = Post.objects.filter(user__followers=request.user)
-    page_number = request.GET.get('page', 1)
+    # (read from user timeline instead of joining friends and posts)
+    posts = feed_posts(timeline.timeline_posts(request.user))
+
+    # page-number (?page=N) or cursor (?cursor=...) pagination
+    # (streamed: layout head is sent before running the feed query)
+    return render_page(request, 'network/following.html', posts, {
+        'cards_url': _cards_url('following'),
+    })
+
+def who_to_follow(request):
+    """View users followed by current user friends (most followed by them first)"""
+    # only available for logged-in users
+    if not request.user.is_authenticated:
+        return HttpResponse(status=401)
+
+    # precomputed (check: network/recommendations.py)
+    return render(request, 'network/who_to_follow.html', {
+        'recommendations': recommendations.recommended_users(request.user),
+    })
+
+@replica_reads
+def hot_posts(request):
+    """View posts with most likes lately (recent likes count more)"""
+    # always paginated using cursors (ordered by score)
+    # scores change as posts are liked, so page numbers would skip/repeat posts
+    page = get_cursor_page(feed_posts(hot.hot_posts(), 'hot_score'), request.GET.get('cursor'), key='hot_score')
+    if page is None:
+        raise Http404()
+    annotate_page(page, request.user)
+
+    return render(request, 'network/hot.html', {
+        'page': page,
+        'cards_url': _cards_url('hot'),
+    })
+
+def search(request):
+    """Search posts by content (best matches first)"""
+    query = request.GET.get('q', '').strip()
+    page = None
+    if query:
+        # always paginated using cursors (ordered by rank)
+        # so matching posts are never counted
+        page = get_cursor_page(feed_posts(search_posts(query)), request.GET.get('cursor'), key='rank')
+        if page is None:
+            raise Http404()
+        annotate_page(page, request.user)
+
+    return render(request, 'network/search.html', {
+        'query': query,
+        'page': page,
+        # keep query in pagination links
+        'page_params': urlencode({'q': query}),
+        'cards_url': _cards_url('search', q=query),
+    })
+
+def tag_posts(request, name):
+    """View posts using a tag (#name)"""
+    try:
+        tag = Tag.objects.get(name=name.lower())
+    except Tag.DoesNotExist:
+        raise Http404()
+
+    # read from tag index (PostTag rows) instead of scanning posts content
+    posts = feed_posts(tags.tag_posts(tag))
 
-    page = get_page(posts, page_number)
+    # page-number (?page=N) or cursor (?cursor=...) pagination
+    page = get_request_page(request, posts)
     if page is None:
         raise Http404()
+    annotate_page(page, request.user)
 
-    return render(request, 'network/following.html', {
+    return render(request, 'network/tag.html', {
+        'tag': tag,
         'page': page,
+        'cards_url': _cards_url('tag', tag=tag.name),
     })
 
+def mentions(request):
+    """View posts mentioning current user (@username)"""
+    # only available for logged-in users
+    if not request.user.is_authenticated:
+        return HttpResponse(status=401)
+
+    posts = feed_posts(tags.mentioned_posts(request.user))
+
+    # page-number (?page=N) or cursor (?cursor=...) pagination
+    page = get_request_page(request, posts)
+    if page is None:
+        raise Http404()
+    annotate_page(page, request.user)
+
+    return render(request, 'network/mentions.html', {
+        'page': page,
+        'cards_url': _cards_url('mentions'),
+    })
+
+def trending(request):
+    """View most used tags of the last day"""
+    return render(request, 'network/trending.html', {
+        'tags': tags.trending_tags(),
+    })
+
+def _cards_url(feed, **params):
+    """Build url that sends the next batches (cards) of posts of a feed"""
+    return f"{reverse('post_cards')}?{urlencode({'feed': feed, **params})}"
+
+@replica_reads
+def post_cards(request):
+    """Send cards (html fragment) of the next batch of posts of a feed
+
+    used by infinite scroll (instead of reloading the whole page)
+    cursor of the batch after it is sent in X-Next-Cursor header
+    """
+    feed = request.GET.get('feed', 'index')
+    if feed == 'index':
+        posts = Post.objects.all()
+    elif feed == 'profile':
+        user_id = User.objects.filter(username=request.GET.get('username')).values_list('id', flat=True).first()
+        if user_id is None:
+            raise Http404()
+        posts = Post.objects.filter(user=user_id)
+    elif feed == 'following':
+        # only available for logged-in users
+        if not request.user.is_authenticated:
+            return HttpResponse(status=401)
+        posts = timeline.timeline_posts(request.user)
+    elif feed == 'hot':
+        posts = hot.hot_posts()
+    elif feed == 'search':
+        posts = search_posts(request.GET.get('q', ''))
+    elif feed == 'tag':
+        tag = Tag.objects.filter(name=request.GET.get('tag', '').lower()).first()
+        if tag is None:
+            raise Http404()
+        posts = tags.tag_posts(tag)
+    elif feed == 'mentions':
+        # only available for logged-in users
+        if not request.user.is_authenticated:
+            return HttpResponse(status=401)
+        posts = tags.mentioned_posts(request.user)
+    else:
+        raise Http404()
+
+    # search results are ordered by rank, hot posts by score (others by creation time)
+    key = {'search': 'rank', 'hot': 'hot_score'}.get(feed, 'created_at')
+    # load score (not rendered by cards) for cursors
+    fields = ['hot_score'] if feed == 'hot' else []
+    page = get_cursor_page(feed_posts(posts, *fields), request.GET.get('cursor'), key=key)
+    if page is None:
+        raise Http404()
+    annotate_page(page, request.user)
+
+    response = render(request, 'network/posts.html', {
+        'page': page,
+    })
+    response['X-Next-Cursor'] = page.next_cursor or ''
+    return response
+
 def like_post(request, post_id):
     # reject non-authenticated requests (ie. user not logged-in)
     if not request.user.is_authenticated:
@@ -195,17 +335,15 @@ def like_post(request, post_id):
 
     # read post from db (and handle case of notfound)
     try:
-        post_to_like = Post.objects.get(pk=post_id)
+        post_to_like = Post.objects.select_related('user').get(pk=post_id)
     except Post.DoesNotExist:
         raise Http404()
 
-    # check if current user already liked the post
-    # because user can't like a post twice!
-    if request.user.likes.filter(pk=post_to_like.id).exists():
+    # update post likes (relation and counter)
+    # user can't like a post twice! (nothing changes if they already liked it)
+    if not actions.like(request.user, post_to_like):
         return HttpResponseBadRequest("You already liked that post.")
-
-    # update post likes
-    request.user.likes.add(post_to_like)
+    post_to_like.is_liked = True
 
     # send updated likes and correct button (like/unlike)
     return render(request, 'network/likes.html', {
@@ -222,17 +360,15 @@ def unlike_post(request, post_id):
 
     # read post from db (and handle case of notfound)
     try:
-        post_to_unlike = Post.objects.get(pk=post_id)
+        post_to_unlike = Post.objects.select_related('user').get(pk=post_id)
     except Post.DoesNotExist:
         raise Http404()
 
-    # check if current user already liked the post
-    # because user can't unlike a post they hadn't liked yet!
-    if not request.user.likes.filter(pk=post_to_unlike.id).exists():
+    # update post likes (relation and counter)
+    # user can't unlike a post they hadn't liked yet! (nothing changes then)
+    if not actions.unlike(request.user, post_to_unlike):
         return HttpResponseBadRequest("You hadn't liked that post yet.")
-
-    # update post likes
-    request.user.likes.remove(post_to_unlike)
+    post_to_unlike.is_liked = False
 
     # send updated likes and correct button (like/unlike)
     return render(request, 'network/likes.html', {
@@ -45,6 +45,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'network.middleware.MetricsMiddleware',
+    'network.middleware.ReplicaPinMiddleware',
+    # (compresses what middleware below and views return)
+    'network.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -80,15 +84,57 @@ WSGI_APPLICATION = 'project4.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        # django's sqlite backend plus WAL and other pragmas, immediate transactions
+        # and serialized writes (check: project4/sqlite3/base.py)
+        'ENGINE': 'project4.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # keep connections open between requests (seconds)
+        'CONN_MAX_AGE': 60,
+        # pragmas applied to every connection (on top of project4.sqlite3.base.DEFAULT_PRAGMAS)
+        'PRAGMAS': {},
+        # tests run on a file (not in memory) so that threads of concurrency tests
+        # use their own connections (waiting on locks instead of failing)
+        'TEST': {
+            'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
+        },
     }
 }
 
+# read replicas of the primary (check: network/replicas.py)
+# local stand-ins are the primary file itself (they'd never lag, only add connections)
+# so they're only used once NAME points at real replicas (eg. read-only copies shipped by litestream)
+# and listed in NETWORK_REPLICAS
+# tests use the primary test db (mirrors) that replicas see once its transactions commit
+for alias in ['replica1', 'replica2']:
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    }
+
+DATABASE_ROUTERS = ['network.replicas.ReplicaRouter']
+
 AUTH_USER_MODEL = "network.User"
 LOGIN_REDIRECT_URL = "index"
 LOGOUT_REDIRECT_URL = "index"
 
+# Caches
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# a redis (or compatible) server could be used instead, eg:
+# 'pages': {
+#     'BACKEND': 'network.redis_cache.RedisCache',
+#     'LOCATION': 'redis://127.0.0.1:6379/0',
+#     # seconds before a slow/unreachable server counts as a miss (default: 0.25)
+#     'OPTIONS': {'SOCKET_TIMEOUT': 0.25},
+# }
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -127,3 +173,72 @@ USE_TZ = True
 STATIC_URL = '/static/'
 
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
+
+# feeds pagination mode
+# 'page': page-number pagination (?page=N)
+# 'cursor': keyset pagination (?cursor=...), no COUNT(*) or OFFSET
+# (any feed request with a cursor param uses cursor pagination anyway)
+NETWORK_PAGINATION = 'page'
+
+# home timelines (Following feed)
+# max number of posts kept per user timeline
+NETWORK_TIMELINE_LENGTH = 800
+# posts of users with more followers than this aren't pushed into timelines
+# (they're pulled when timelines are read instead)
+NETWORK_TIMELINE_CELEBRITY_THRESHOLD = 10000
+
+# whole-page cache for anonymous visitors (All Posts feed and profiles)
+# cache alias to use (None disables page caching)
+# conditional GETs (ETag / Last-Modified) need a cache shared by all processes (eg. redis, not locmem)
+NETWORK_PAGE_CACHE = 'default'
+# pages are invalidated by writes, timeout is only a safety net
+NETWORK_PAGE_CACHE_TIMEOUT = 30
+
+# streamed feed pages (network.streaming): layout head is sent before running feed query
+# (pages of logged-in users and uncached ones)
+NETWORK_STREAM_PAGES = True
+
+# response compression (network.middleware.CompressionMiddleware)
+# brotli is used when installed (pip install brotli) and accepted by clients
+NETWORK_GZIP_LEVEL = 6
+NETWORK_BROTLI_QUALITY = 5
+# smaller responses are sent as is (bytes)
+NETWORK_COMPRESSION_MIN_SIZE = 512
+
+# read replicas (network.replicas)
+# aliases (in DATABASES) that feed reads go to (empty: everything uses the primary)
+# eg. ['replica1', 'replica2'] once they point at real replicas
+NETWORK_REPLICAS = []
+# time (seconds) clients are pinned to the primary after writing
+NETWORK_REPLICA_PIN = 10
+
+# Hot feed (network.hot)
+# time (seconds) after which a like counts half as much
+NETWORK_HOT_HALF_LIFE = 6 * 60 * 60
+
+# Who to Follow (network.recommendations)
+# max number of recommendations kept per user
+NETWORK_RECOMMENDATIONS = 10
+
+# trending tags (network.tags)
+# uses of tags are counted within a sliding window (seconds)
+NETWORK_TRENDING_WINDOW = 24 * 60 * 60
+# that moves a bucket (seconds) at a time
+NETWORK_TRENDING_BUCKET = 60 * 60
+
+# background jobs (network.jobs), run by `manage.py run_jobs` (the worker process of Procfile)
+# run due jobs in requests once their write commits (no workers needed, delayed and retried jobs
+# run once due, after a later job) unless a worker is configured (NETWORK_JOBS_WORKER=1)
+NETWORK_JOBS_EAGER = not os.environ.get('NETWORK_JOBS_WORKER')
+# retries are delayed by NETWORK_JOBS_BACKOFF * 2^(attempts - 1) seconds (at most NETWORK_JOBS_MAX_BACKOFF)
+NETWORK_JOBS_BACKOFF = 2
+NETWORK_JOBS_MAX_BACKOFF = 60 * 60
+# jobs running for longer than this (seconds) are assumed abandoned and run again
+NETWORK_JOBS_STALE_TIMEOUT = 5 * 60
+
+# per-view request metrics (network.middleware.MetricsMiddleware)
+# fraction of requests measured (0: none, 1: all)
+NETWORK_METRICS_SAMPLE_RATE = 0.1
+# /internal/metrics is readable by staff users or scrapers sending this token ("Authorization: Bearer <token>")
+# also required by metrics ports of workers (run_jobs --metrics-port) when set
+NETWORK_METRICS_TOKEN = os.environ.get('NETWORK_METRICS_TOKEN')
@@ -0,0 +1,102 @@
+"""SQLite backend tuned for a web server (many threads/processes, one db file)
+
+same as django.db.backends.sqlite3 plus:
+  - pragmas applied to every new connection (settings_dict['PRAGMAS'], see DEFAULT_PRAGMAS)
+    WAL lets readers run while a write is in progress (and never block it)
+  - transactions start with BEGIN IMMEDIATE (they take the write lock up front,
+    settings_dict['TRANSACTION_MODE'] could be set to 'DEFERRED' to get django's behavior)
+    a deferred transaction that reads then writes fails right away ("database is locked")
+    when another connection is writing, as waiting for it could deadlock,
+    an immediate one waits (busy_timeout) for the lock instead
+  - writes of a process are serialized by a lock (per db file) held for the whole transaction
+    (unless settings_dict['SERIALIZE_WRITES'] is False)
+    so threads queue for the write lock in order instead of polling it in sqlite busy handler
+reads outside transactions (ie. most of a request) take none of these locks.
+keep connections alive between requests using CONN_MAX_AGE.
+"""
+import threading
+
+from django.db.backends.sqlite3 import base
+from django.db.utils import OperationalError
+
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'wal',
+    # WAL is durable with NORMAL (a crash can only lose the last commits, never corrupt db)
+    'synchronous': 'normal',
+    # read db pages through memory-mapped io (bytes)
+    'mmap_size': 256 * 2 ** 20,
+    # wait for locks (ms) instead of failing right away
+    'busy_timeout': 5000,
+    'temp_store': 'memory',
+}
+
+# db file name: lock
+_writer_locks = {}
+_writer_locks_lock = threading.Lock()
+
+def writer_lock(name):
+    """Lock serializing write transactions of this process to a db file"""
+    with _writer_locks_lock:
+        return _writer_locks.setdefault(name, threading.Lock())
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._holds_writer_lock = False
+
+    def pragmas(self):
+        return {**DEFAULT_PRAGMAS, **self.settings_dict.get('PRAGMAS', {})}
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        pragmas = self.pragmas()
+        # wait for locks while applying other pragmas too (eg. changing journal mode)
+        pragmas = {'busy_timeout': pragmas.pop('busy_timeout', 5000), **pragmas}
+        for name, value in pragmas.items():
+            # (pragmas don't accept query parameters)
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _busy_timeout(self):
+        # seconds
+        return int(self.pragmas().get('busy_timeout', 5000)) / 1000
+
+    def _acquire_writer_lock(self):
+        if not self.settings_dict.get('SERIALIZE_WRITES', True) or self.is_in_memory_db():
+            return
+        if not writer_lock(self.settings_dict['NAME']).acquire(timeout=self._busy_timeout()):
+            raise OperationalError('database is locked')
+        self._holds_writer_lock = True
+
+    def _release_writer_lock(self):
+        if self._holds_writer_lock:
+            self._holds_writer_lock = False
+            writer_lock(self.settings_dict['NAME']).release()
+
+    def _start_transaction_under_autocommit(self):
+        self._acquire_writer_lock()
+        try:
+            self.cursor().execute(f"BEGIN {self.settings_dict.get('TRANSACTION_MODE', 'IMMEDIATE')}")
+        except Exception:
+            self._release_writer_lock()
+            raise
+
+    def _commit(self):
+        try:
+            return super()._commit()
+        finally:
+            self._release_writer_lock()
+
+    def _rollback(self):
+        try:
+            return super()._rollback()
+        finally:
+            self._release_writer_lock()
+
+    def _close(self):
+        try:
+            return super()._close()
+        finally:
+            self._release_writer_lock()